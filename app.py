@@ -25,7 +25,6 @@ from config import config
 from security import SecurityMiddleware, validate_input, sanitize_filename, is_safe_url
 from routes import db, bcrypt, login_mgr, migrate
 from models import (
-    User,
     UserAddress,
     Category,
     Product,
@@ -238,9 +237,14 @@ def create_app(config_name=None):
     # Add static file caching and performance headers
     @app.after_request
     def add_performance_headers(response):
+        # Hashed builds under /static/dist set their own headers (send_built_asset)
         if request.endpoint == "static":
-            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
-            response.headers["ETag"] = None
+            # Only content-addressed files may be cached forever; the rest
+            # revalidate against their ETag once a day
+            if request.path.startswith("/static/IMG/optimized/"):
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            else:
+                response.headers["Cache-Control"] = "public, max-age=86400"
         elif request.path.endswith(".html") or "." not in request.path.split("/")[-1]:
             response.headers["Cache-Control"] = "public, max-age=3600, must-revalidate"
 
@@ -294,11 +298,37 @@ def create_app(config_name=None):
 
     app.jinja_env.globals["csrf_token"] = generate_csrf
 
+    from services.catalog_snapshot import responsive_image
+
+    app.jinja_env.globals["responsive_image"] = responsive_image
+
+    # Hashed, precompressed CSS/JS built by optimize_css.py
+    from services.asset_pipeline import asset_url, asset_urls, send_built_asset
+
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.jinja_env.globals["asset_urls"] = asset_urls
+    app.add_url_rule("/static/dist/<path:filename>", "dist_asset", send_built_asset)
+
     @app.template_filter('reject_keys')
     def reject_keys(d, keys):
         """Filter a dictionary to reject specified keys"""
         return {k: v for k, v in d.items() if k not in keys}
 
+    # Background DB probe and circuit breaker; routes check it instead of running SELECT 1
+    from services.db_health import init_db_health
+
+    init_db_health(app)
+
+    # Start the buffered audit writer before anything that logs audit entries
+    from services.audit_writer import init_audit_writer
+
+    init_audit_writer(app)
+
+    # Hourly admin counters, kept up to date from commits and audit flushes
+    from services.stats_rollup import init_stats_rollup
+
+    init_stats_rollup(app)
+
     # Initialize security middleware
     security = SecurityMiddleware()
     security.init_app(app)
@@ -306,6 +336,16 @@ def create_app(config_name=None):
     # Initialize Uber Direct service
     init_uber_service(app)
 
+    # Start the background sender for queued Slack/email notifications
+    from services.notification_outbox import init_notification_outbox
+
+    init_notification_outbox(app)
+
+    # Process recorded Stripe webhook events off the request path
+    from services.stripe_events import init_stripe_event_worker
+
+    init_stripe_event_worker(app)
+
     # Security headers / CSP for Stripe Elements
     app.logger.info(f"Current config_name: {config_name}")
     app.logger.info(f"FLASK_ENV: {os.getenv('FLASK_ENV', 'NOT SET')}")
@@ -376,6 +416,7 @@ def create_app(config_name=None):
     # ---------------- AGE GATE CONFIG ----------------
     EXEMPT_PATH_PREFIXES = (
         "/static/",
+        "/sitemap-",
         "/api/",
         "/webhooks/",
     )
@@ -494,50 +535,21 @@ def create_app(config_name=None):
     # SEO Routes
     @app.route("/sitemap.xml")
     def sitemap():
-        from flask import Response
-        from models import Product
-        from datetime import datetime
-
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-
-        # Static pages
-        static_pages = [
-            {"loc": "https://lovemenowmiami.com/", "changefreq": "daily", "priority": "1.0"},
-            {"loc": "https://lovemenowmiami.com/products", "changefreq": "daily", "priority": "0.9"},
-            {"loc": "https://lovemenowmiami.com/about", "changefreq": "monthly", "priority": "0.6"},
-            {"loc": "https://lovemenowmiami.com/support", "changefreq": "monthly", "priority": "0.6"},
-            {"loc": "https://lovemenowmiami.com/return", "changefreq": "monthly", "priority": "0.5"},
-            {"loc": "https://lovemenowmiami.com/track", "changefreq": "monthly", "priority": "0.5"},
-        ]
+        from services.sitemap import sitemap_response
 
-        # All active products (exclude Sexual Enhancements category 59 — noindex)
-        products = Product.query.filter(
-            Product.in_active.is_(False),
-            Product.category_id != 59
-        ).all()
+        return sitemap_response("sitemap.xml")
 
-        xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-        xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    @app.route("/sitemap-pages.xml")
+    def sitemap_pages():
+        from services.sitemap import sitemap_response
 
-        for page in static_pages:
-            xml += f'  <url>\n'
-            xml += f'    <loc>{page["loc"]}</loc>\n'
-            xml += f'    <lastmod>{today}</lastmod>\n'
-            xml += f'    <changefreq>{page["changefreq"]}</changefreq>\n'
-            xml += f'    <priority>{page["priority"]}</priority>\n'
-            xml += f'  </url>\n'
+        return sitemap_response("sitemap-pages.xml")
 
-        for p in products:
-            xml += f'  <url>\n'
-            xml += f'    <loc>https://lovemenowmiami.com/product/{p.id}</loc>\n'
-            xml += f'    <lastmod>{today}</lastmod>\n'
-            xml += f'    <changefreq>weekly</changefreq>\n'
-            xml += f'    <priority>0.8</priority>\n'
-            xml += f'  </url>\n'
+    @app.route("/sitemap-products-<int:page>.xml")
+    def sitemap_products(page):
+        from services.sitemap import sitemap_response
 
-        xml += '</urlset>'
-
-        return Response(xml, mimetype="application/xml")
+        return sitemap_response(f"sitemap-products-{page}.xml")
 
     @app.route("/robots.txt")
     def robots():
@@ -593,10 +605,14 @@ def register_error_handlers(app):
 
 @login_mgr.user_loader
 def load_user(user_id: str):
+    from services.identity_cache import load_identity
+
     try:
-        return User.query.get(int(user_id))
+        user = load_identity(int(user_id))
     except (ValueError, TypeError):
         return None
+    # Deactivated by an admin: treated as signed out from the next request on
+    return user if user is not None and user.is_active else None
 
 
 # Create the application
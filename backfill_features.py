@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 """
-Backfill products.features using the current heuristic from routes.main.process_product_details
+Backfill products.features using the current heuristic from services.product_details.process_product_details
 - Only populate when products.features is NULL or empty
 - Stores up to 4 bullets separated by newlines
+
+With --details, instead precompute features/specs/dims for every product whose
+text changed since the last run (product_detail_features), in parallel across
+processes. Use --force to recompute everything, --workers N to size the pool.
 """
+import argparse
 import sys
 import os
 
@@ -15,7 +20,7 @@ from routes import db
 from models import Product
 
 # Import the existing processing function
-from routes.main import process_product_details
+from services.product_details import process_product_details, backfill_product_details
 
 
 def backfill_features():
@@ -42,6 +47,22 @@ def backfill_features():
     print(f"✅ Backfill complete. Updated: {updated}, Skipped: {skipped}")
 
 
+def backfill_details(workers=None, force=False):
+    with app.app_context():
+        updated, skipped = backfill_product_details(workers=workers, force=force)
+    print(f"✅ Product details backfill complete. Computed: {updated}, Up to date: {skipped}")
+
+
 if __name__ == "__main__":
-    print("Starting features backfill...")
-    backfill_features()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Backfill product features")
+    parser.add_argument("--details", action="store_true", help="precompute product page features/specs/dims")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="recompute even when the content hash matches")
+    args = parser.parse_args()
+
+    if args.details:
+        print("Starting product details backfill...")
+        backfill_details(workers=args.workers, force=args.force)
+    else:
+        print("Starting features backfill...")
+        backfill_features()
\ No newline at end of file
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: legacy per-pattern suspicious-request checks vs services.request_scanner
+
+Usage: python benchmark_request_scanner.py [corpus.jsonl] [--repeat N]
+
+Each corpus line is a JSON object. 'url' (or 'path') and 'body' are used when
+present; any other record is scanned as a body made of its JSON text, so a
+plain JSONL export works as a corpus.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+# Ensure project root on path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.request_scanner import RequestScanner, SIGNATURES
+
+LEGACY_PATTERNS = [
+    r'<script', r'javascript:', r'vbscript:', r'onload=', r'onerror=', r'eval\(',
+    r'expression\(', r'url\(', r'import\(', r'\.\./', r'union.*select', r'drop.*table',
+]
+
+
+def load_corpus(path):
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and ('url' in record or 'body' in record or 'path' in record):
+                url = record.get('url') or f"http://localhost{record.get('path', '/')}"
+                body = record.get('body') or ''
+                if not isinstance(body, str):
+                    body = json.dumps(body)
+            else:
+                url, body = 'http://localhost/', line
+            corpus.append((url, body.encode('utf-8')))
+    return corpus
+
+
+def legacy_check(url, body):
+    """The old SecurityMiddleware loop: 12 searches over the URL and the bytes repr of the whole body."""
+    request_data = str(body)
+    for pattern in LEGACY_PATTERNS:
+        if re.search(pattern, url, re.IGNORECASE) or re.search(pattern, request_data, re.IGNORECASE):
+            return True
+    return False
+
+
+def bench(label, fn, corpus, repeat):
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url, body in corpus:
+            if fn(url, body):
+                hits += 1
+    elapsed = time.perf_counter() - start
+    per_request = elapsed / (repeat * len(corpus)) * 1e6
+    print(f"{label:<10} {per_request:8.2f} µs/request  ({hits // repeat} flagged of {len(corpus)})")
+    return per_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('corpus', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'requests.jsonl'))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"❌ No requests in {args.corpus}")
+        return 1
+
+    scanner = RequestScanner(skip_prefixes=())
+    print(f"📊 {len(corpus)} requests x {args.repeat} rounds, {len(SIGNATURES)} signatures, "
+          f"body limit {scanner.body_limit} bytes")
+    legacy = bench('legacy', legacy_check, corpus, args.repeat)
+    compiled = bench('scanner', lambda url, body: scanner.first_match(url, body) is not None, corpus, args.repeat)
+    print(f"✅ {legacy / compiled:.1f}x faster")
+
+    rule_counts = {}
+    for url, body in corpus:
+        for rule_id in scanner.matches(url, body):
+            rule_counts[rule_id] = rule_counts.get(rule_id, 0) + 1
+    for rule_id, count in sorted(rule_counts.items(), key=lambda item: -item[1]):
+        print(f"   {rule_id:<20} {count}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
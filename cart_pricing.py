@@ -0,0 +1,231 @@
+"""
+Cart pricing math: spend tiers, promo codes, delivery and tax
+
+Pure functions over plain values (no Flask, no database) so pricing can be
+benchmarked and tested in isolation. routes/checkout_totals.py loads the
+cart and discount code and feeds them in here.
+"""
+import logging
+from collections import namedtuple
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TAX_RATE = 0.07  # Florida 7%
+
+# ── Tiered auto-discounts (no code needed) ──────────────────
+# Each tier: (min_subtotal, discount_percent, label)
+# Highest qualifying tier wins. Tiers are checked top-down.
+SPEND_TIERS = [
+    (150.0, 8, "8% OFF + FREE Delivery on orders $150+"),
+    (110.0, 5, "5% OFF + FREE Delivery on orders $110+"),
+    (75.0,  8, "8% OFF orders $75+"),
+    (50.0,  5, "5% OFF orders $50+"),
+]
+
+# Free delivery thresholds (subtotal must meet this to qualify)
+FREE_DELIVERY_THRESHOLD = 110.0
+
+# One cart line with its unit price; ``product`` is passed through untouched
+PricedLine = namedtuple('PricedLine', 'product_id variant_id quantity unit_price product')
+
+# A promo code that has already been checked for validity
+DiscountTerms = namedtuple('DiscountTerms', 'code discount_type value')
+
+
+def _round2(x: float) -> float:
+    return float(Decimal(str(x)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+
+
+def resolve_tier(subtotal: float):
+    """Return (discount_pct, tier_label, next_tier_info) for the given subtotal."""
+    matched = None
+    for min_amt, pct, label in SPEND_TIERS:
+        if subtotal >= min_amt:
+            matched = (pct, label)
+            break
+
+    if matched:
+        pct, label = matched
+        # Find next tier above current
+        next_tier = None
+        for min_amt, npct, nlabel in reversed(SPEND_TIERS):
+            if min_amt > subtotal:
+                next_tier = {"spend_more": _round2(min_amt - subtotal), "next_pct": npct, "next_label": nlabel}
+                break
+        return pct, label, next_tier
+
+    # No tier matched — show nudge toward first tier
+    lowest = SPEND_TIERS[-1]  # $50 tier
+    nudge = {"spend_more": _round2(lowest[0] - subtotal), "next_pct": lowest[1], "next_label": lowest[2]}
+    return 0, None, nudge
+
+
+def code_is_valid(dc, now) -> bool:
+    """Check a DiscountCode-like object (is_active, starts_at, ends_at, max_uses, current_uses)."""
+    if not dc or not dc.is_active:
+        return False
+    if dc.starts_at and now < dc.starts_at:
+        return False
+    if dc.ends_at and now > dc.ends_at:
+        return False
+    if dc.max_uses is not None and (dc.current_uses or 0) >= (dc.max_uses or 0):
+        return False
+    return True
+
+
+def code_discount(subtotal: float, terms: Optional[DiscountTerms], preview=None):
+    """
+    Return (discount_amount, code) for a promo code against a subtotal.
+    A positive preview amount (saved when the code was applied) caps the result.
+    """
+    discount_amount = 0.0
+    code = None
+    if terms:
+        code = terms.code
+        if terms.discount_type == "percentage":
+            discount_amount = _round2(subtotal * (float(terms.value) / 100.0))
+        else:
+            discount_amount = _round2(float(terms.value))
+
+    # Cap by preview only if preview is a positive number
+    try:
+        preview_val = float(preview)
+        if preview_val > 0:
+            discount_amount = min(preview_val, discount_amount or subtotal)
+    except (TypeError, ValueError):
+        pass
+
+    return min(subtotal, discount_amount), code
+
+
+@dataclass(frozen=True)
+class CartTotals:
+    """Immutable pricing breakdown; also readable like the dict compute_totals used to return."""
+    items: tuple
+    subtotal: float
+    discount_amount: float
+    discount_code: Optional[str]
+    discount_source: Optional[str]
+    tier_pct: int
+    tier_label: Optional[str]
+    next_tier: Optional[dict]
+    free_delivery: bool
+    delivery_fee: float
+    tax: float
+    total: float
+    amount_cents: int
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+
+EMPTY_NEXT_TIER = {"spend_more": 50.0, "next_pct": 5, "next_label": "5% OFF orders $50+"}
+
+
+def price_cart(lines, discount: Optional[DiscountTerms] = None, delivery_type: str = "pickup",
+               delivery_quote: Optional[dict] = None, discount_preview=None) -> CartTotals:
+    """
+    Price a cart from PricedLine values.
+
+    Tax base: (discounted_subtotal + delivery_fee)
+
+    Delivery behavior:
+    - If delivery_type is 'delivery' AND quote is provided: use quote fee
+    - If delivery_type is 'delivery' BUT no quote yet: $0 (user hasn't entered address)
+    - If delivery_type is 'pickup': delivery_fee = $0
+    """
+    lines = tuple(lines)
+    if not lines:
+        return CartTotals(
+            items=(),
+            subtotal=0.0,
+            discount_amount=0.0,
+            discount_code=None,
+            discount_source=None,
+            tier_pct=0,
+            tier_label=None,
+            next_tier=dict(EMPTY_NEXT_TIER),
+            free_delivery=False,
+            delivery_fee=0.0,
+            tax=0.0,
+            total=0.0,
+            amount_cents=0,
+        )
+
+    subtotal = _round2(sum(float(line.unit_price) * line.quantity for line in lines))
+
+    # 1) Check tiered auto-discount
+    tier_pct, tier_label, next_tier = resolve_tier(subtotal)
+    tier_discount = _round2(subtotal * (tier_pct / 100.0)) if tier_pct else 0.0
+
+    # 2) Check promo code discount
+    promo_discount, discount_code = code_discount(subtotal, discount, discount_preview)
+
+    # Use whichever is greater (no stacking)
+    if promo_discount >= tier_discount:
+        discount_amount = promo_discount
+        discount_source = "code"
+    else:
+        discount_amount = tier_discount
+        discount_code = None  # tier wins, don't attribute to code
+        discount_source = "tier"
+
+    free_delivery = subtotal >= FREE_DELIVERY_THRESHOLD
+
+    delivery_fee = 0.0
+    if delivery_type == "delivery":
+        if free_delivery:
+            logger.info(f"🚚 FREE delivery — subtotal ${subtotal:.2f} >= ${FREE_DELIVERY_THRESHOLD}")
+        elif delivery_quote and "fee_dollars" in delivery_quote:
+            try:
+                delivery_fee = _round2(float(delivery_quote["fee_dollars"]))
+                logger.info(f"✅ Delivery fee from quote: ${delivery_fee:.2f}")
+            except Exception as e:
+                logger.warning(f"⚠️  Failed to parse delivery_quote fee: {str(e)}")
+                delivery_fee = 0.0
+        else:
+            logger.info("📍 Delivery selected but no quote yet - showing $0 until address is entered")
+
+    discounted_subtotal = _round2(max(0.0, subtotal - discount_amount))
+    tax_base = discounted_subtotal + delivery_fee
+    tax = _round2(tax_base * TAX_RATE)
+    total = _round2(discounted_subtotal + delivery_fee + tax)
+
+    items = tuple(
+        {
+            "product": line.product,
+            "product_id": line.product_id,
+            "variant_id": line.variant_id,
+            "quantity": line.quantity,
+            "unit_price": float(line.unit_price),
+        }
+        for line in lines
+    )
+
+    return CartTotals(
+        items=items,
+        subtotal=subtotal,
+        discount_amount=discount_amount,
+        discount_code=discount_code,
+        discount_source=discount_source,
+        tier_pct=tier_pct,
+        tier_label=tier_label,
+        next_tier=next_tier,
+        free_delivery=free_delivery,
+        delivery_fee=delivery_fee,
+        tax=tax,
+        total=total,
+        amount_cents=int(round(total * 100)),
+    )
@@ -47,15 +47,42 @@ class Config:
     STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
     STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
     STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
-    
+
+    # How long checkout holds stock for a shopper who hasn't paid yet (seconds)
+    INVENTORY_RESERVATION_TTL_SECONDS = int(os.getenv('INVENTORY_RESERVATION_TTL_SECONDS', '900'))
+
+    # Signed-in users and their cart/wishlist counts, cached per worker
+    IDENTITY_CACHE_TTL_SECONDS = int(os.getenv('IDENTITY_CACHE_TTL_SECONDS', '300'))
+    USER_COUNTS_TTL_SECONDS = int(os.getenv('USER_COUNTS_TTL_SECONDS', '90'))
+    IDENTITY_CACHE_MAX_USERS = int(os.getenv('IDENTITY_CACHE_MAX_USERS', '10000'))
+
+    # Shared full-page cache for the homepage and listings (per worker, stale-while-revalidate)
+    PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    PAGE_CACHE_TTL_SECONDS = int(os.getenv('PAGE_CACHE_TTL_SECONDS', '60'))
+    PAGE_CACHE_STALE_SECONDS = int(os.getenv('PAGE_CACHE_STALE_SECONDS', '600'))
+    PAGE_CACHE_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '256'))
+
     # Domain configuration
     DOMAIN = os.getenv('DOMAIN', 'http://127.0.0.1:9000')
     
+    # Canonical site URL used in sitemap.xml
+    SITEMAP_BASE_URL = os.getenv('SITEMAP_BASE_URL', 'https://lovemenowmiami.com')
+    
     # Email configuration
     SENDLAYER_API_KEY = os.getenv('SENDLAYER_API_KEY')
     
     # Rate limiting
     RATELIMIT_STORAGE_URL = os.getenv('REDIS_URL', 'memory://')
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'sqlite')  # 'sqlite' (shared by workers) or 'memory'
+    RATE_LIMIT_STORE_PATH = os.getenv('RATE_LIMIT_STORE_PATH')  # defaults to /dev/shm or the temp dir
+    RATE_LIMIT_DEFAULT = (int(os.getenv('RATE_LIMIT_DEFAULT_PER_MINUTE', '60')), 60)
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '1'))  # Render's load balancer
+    
+    # Suspicious-request scanner: only the first SUSPICIOUS_SCAN_BODY_LIMIT bytes of a body are inspected
+    SUSPICIOUS_SCAN_BODY_LIMIT = int(os.getenv('SUSPICIOUS_SCAN_BODY_LIMIT', str(16 * 1024)))
+    SUSPICIOUS_SCAN_MAX_BUFFERED_BODY = int(os.getenv('SUSPICIOUS_SCAN_MAX_BUFFERED_BODY', str(1024 * 1024)))  # larger bodies aren't read
+    SUSPICIOUS_SCAN_SKIP_PREFIXES = ('/static/', '/webhooks/stripe')  # signature-verified or static
     
     # CSRF Protection
     WTF_CSRF_ENABLED = True
@@ -67,6 +94,14 @@ class Config:
     UBER_CLIENT_SECRET = os.getenv('UBER_CLIENT_SECRET')
     UBER_CUSTOMER_ID = os.getenv('UBER_CUSTOMER_ID')
     UBER_SANDBOX = os.getenv('UBER_SANDBOX', 'true').lower() == 'true'
+    UBER_TOKEN_CACHE_PATH = os.getenv('UBER_TOKEN_CACHE_PATH')  # shared by workers; defaults to the temp dir
+    UBER_CONNECT_TIMEOUT = float(os.getenv('UBER_CONNECT_TIMEOUT', '3.05'))
+    UBER_READ_TIMEOUT = float(os.getenv('UBER_READ_TIMEOUT', '15'))
+    
+    # Shared geocode/distance/quote cache lifetimes (seconds)
+    GEO_CACHE_GEOCODE_TTL = int(os.getenv('GEO_CACHE_GEOCODE_TTL', str(30 * 24 * 3600)))
+    GEO_CACHE_DISTANCE_TTL = int(os.getenv('GEO_CACHE_DISTANCE_TTL', str(6 * 3600)))
+    GEO_CACHE_QUOTE_TTL = int(os.getenv('GEO_CACHE_QUOTE_TTL', '300'))
     
     # Google Maps API configuration
     GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
@@ -85,6 +120,54 @@ class Config:
     
     # Slack integration
     SLACK_WEBHOOK_URL = os.getenv('SLACK_WEBHOOK_URL')
+
+    # Notification outbox (Slack/email are queued in the DB and sent by a background worker)
+    NOTIFICATION_WORKER_ENABLED = os.getenv('NOTIFICATION_WORKER_ENABLED', 'true').lower() == 'true'
+    NOTIFICATION_WORKER_THREADS = int(os.getenv('NOTIFICATION_WORKER_THREADS', '2'))
+    NOTIFICATION_POLL_SECONDS = float(os.getenv('NOTIFICATION_POLL_SECONDS', '5'))
+    NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', '20'))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '8'))
+    NOTIFICATION_BACKOFF_SECONDS = int(os.getenv('NOTIFICATION_BACKOFF_SECONDS', '30'))
+    NOTIFICATION_BACKOFF_MAX_SECONDS = int(os.getenv('NOTIFICATION_BACKOFF_MAX_SECONDS', '3600'))
+    NOTIFICATION_LEASE_SECONDS = int(os.getenv('NOTIFICATION_LEASE_SECONDS', '120'))
+    # Delivery-order notifications wait this long for the Uber step to add the tracking link
+    ORDER_NOTIFICATION_HOLD_SECONDS = int(os.getenv('ORDER_NOTIFICATION_HOLD_SECONDS', '60'))
+
+    # Marketing campaigns (recipients streamed in batches, sent on a bounded pool)
+    EMAIL_CAMPAIGN_BATCH_SIZE = int(os.getenv('EMAIL_CAMPAIGN_BATCH_SIZE', '500'))
+    EMAIL_CAMPAIGN_CONCURRENCY = int(os.getenv('EMAIL_CAMPAIGN_CONCURRENCY', '8'))
+    EMAIL_CAMPAIGN_RATE_PER_SECOND = float(os.getenv('EMAIL_CAMPAIGN_RATE_PER_SECOND', '10'))
+    EMAIL_CAMPAIGN_MAX_ATTEMPTS = int(os.getenv('EMAIL_CAMPAIGN_MAX_ATTEMPTS', '3'))
+    # Must outlast one batch (batch size / rate, plus retries); an expired lease lets another process resume
+    EMAIL_CAMPAIGN_LEASE_SECONDS = int(os.getenv('EMAIL_CAMPAIGN_LEASE_SECONDS', '600'))
+
+    # Database health: a background SELECT 1 probe; the breaker opens after consecutive failures
+    DB_HEALTH_ENABLED = os.getenv('DB_HEALTH_ENABLED', 'true').lower() == 'true'
+    DB_HEALTH_PROBE_SECONDS = float(os.getenv('DB_HEALTH_PROBE_SECONDS', '5'))
+    DB_HEALTH_PROBE_OPEN_SECONDS = float(os.getenv('DB_HEALTH_PROBE_OPEN_SECONDS', '2'))  # while open
+    DB_HEALTH_FAILURE_THRESHOLD = int(os.getenv('DB_HEALTH_FAILURE_THRESHOLD', '3'))
+
+    # Stripe webhook ledger: deliveries are recorded and acknowledged, then processed by a worker pool
+    STRIPE_EVENT_WORKER_ENABLED = os.getenv('STRIPE_EVENT_WORKER_ENABLED', 'true').lower() == 'true'
+    STRIPE_EVENT_WORKER_THREADS = int(os.getenv('STRIPE_EVENT_WORKER_THREADS', '2'))
+    STRIPE_EVENT_POLL_SECONDS = float(os.getenv('STRIPE_EVENT_POLL_SECONDS', '5'))
+    STRIPE_EVENT_BATCH_SIZE = int(os.getenv('STRIPE_EVENT_BATCH_SIZE', '20'))
+    STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENT_MAX_ATTEMPTS', '10'))
+    STRIPE_EVENT_BACKOFF_SECONDS = int(os.getenv('STRIPE_EVENT_BACKOFF_SECONDS', '15'))
+    STRIPE_EVENT_BACKOFF_MAX_SECONDS = int(os.getenv('STRIPE_EVENT_BACKOFF_MAX_SECONDS', '1800'))
+    STRIPE_EVENT_LEASE_SECONDS = int(os.getenv('STRIPE_EVENT_LEASE_SECONDS', '300'))
+
+    # Audit log: entries are buffered in memory and bulk-inserted by a background thread
+    AUDIT_ASYNC_ENABLED = os.getenv('AUDIT_ASYNC_ENABLED', 'true').lower() == 'true'
+    AUDIT_BUFFER_MAX = int(os.getenv('AUDIT_BUFFER_MAX', '10000'))  # newest entries are dropped past this
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '200'))
+    AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '2'))
+
+    # Guest cart storage: 'sql' is shared by all workers, 'memory' is per-process (local dev only)
+    CART_STORE_BACKEND = os.getenv('CART_STORE_BACKEND', 'sql')
+    CART_STORE_MEMORY_MAX_CARTS = int(os.getenv('CART_STORE_MEMORY_MAX_CARTS', '10000'))
+    # Guest carts untouched this long are purged (sql backend)
+    GUEST_CART_MAX_AGE_DAYS = int(os.getenv('GUEST_CART_MAX_AGE_DAYS', '30'))
     
     @staticmethod
     def validate_config():
@@ -151,6 +234,11 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    NOTIFICATION_WORKER_ENABLED = False
+    STRIPE_EVENT_WORKER_ENABLED = False  # webhooks are processed inline
+    RATE_LIMIT_ENABLED = False
+    DB_HEALTH_ENABLED = False
+    AUDIT_ASYNC_ENABLED = False  # the in-memory sqlite DB isn't visible to the writer thread's connection
 
 # Configuration dictionary
 config = {
@@ -8,6 +8,15 @@ from sqlalchemy import text, inspect
 
 logger = logging.getLogger(__name__)
 
+# Rows seeded into catalog_versions; each scope invalidates one family of caches
+CATALOG_VERSION_SCOPES = ('catalog', 'related', 'identity')
+
+# Initial listing groups (slug -> display name, category ids); "gender" is seeded as their union
+DEFAULT_CATEGORY_GROUPS = {
+    'men': ('Men', [34, 60, 35, 33, 55, 56, 57, 4, 11, 37, 53, 38, 51, 61, 62]),
+    'women': ('Women', [36, 39, 5, 33, 54, 1, 7, 10, 40, 50, 4, 55, 56, 57, 58, 11, 38, 61, 62]),
+}
+
 def ensure_discount_usages_created_at(db):
     """
     Ensure discount_usages table has created_at column.
@@ -114,6 +123,423 @@ def ensure_product_variant_stock_columns(db):
         return False
 
 
+def ensure_product_image_rendition_columns(db):
+    """
+    Ensure product_images has the responsive rendition columns (srcset data and LQIP).
+    Filled in by optimize_images.py; templates fall back to the original URL while empty.
+    """
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('product_images')]
+
+        wanted = (
+            ('content_hash', "VARCHAR(64) NULL COMMENT 'sha256 of the source file the renditions were built from'"),
+            ('width', "INT NULL COMMENT 'Source width in pixels'"),
+            ('height', "INT NULL COMMENT 'Source height in pixels'"),
+            ('renditions', "TEXT NULL COMMENT 'JSON size ladder per format (webp, avif)'"),
+            ('lqip', "TEXT NULL COMMENT 'Low-quality placeholder data URI'"),
+        )
+        fixed = False
+        for name, definition in wanted:
+            if name not in columns:
+                logger.warning(f"⚠️  Missing '{name}' column in product_images table - FIXING...")
+                db.session.execute(text(f"ALTER TABLE product_images ADD COLUMN {name} {definition}"))
+                fixed = True
+                logger.info(f"✅ Added '{name}' column to product_images table")
+
+        if fixed:
+            db.session.commit()
+        else:
+            logger.debug("✓ product_images rendition columns exist")
+
+        return fixed
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring product_images rendition columns: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_catalog_versions_table(db):
+    """
+    Ensure the catalog_versions table exists and has its seed rows.
+    Workers compare these counters to decide when to reload in-process caches.
+    """
+    try:
+        from models import CatalogVersion
+
+        inspector = inspect(db.engine)
+        fixed = False
+
+        if 'catalog_versions' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing catalog_versions table - FIXING...")
+            CatalogVersion.__table__.create(db.engine, checkfirst=True)
+            fixed = True
+            logger.info("✅ Created catalog_versions table")
+
+        existing = {row[0] for row in db.session.execute(text("SELECT scope FROM catalog_versions"))}
+        for scope in CATALOG_VERSION_SCOPES:
+            if scope not in existing:
+                db.session.execute(
+                    text("INSERT INTO catalog_versions (scope, version, updated_at) VALUES (:scope, 1, CURRENT_TIMESTAMP)"),
+                    {'scope': scope},
+                )
+                fixed = True
+                logger.info(f"✅ Seeded catalog_versions row '{scope}'")
+
+        if fixed:
+            db.session.commit()
+        else:
+            logger.debug("✓ catalog_versions table exists")
+
+        return fixed
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring catalog_versions table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_category_index_tables(db):
+    """
+    Ensure category_closure and category_groups exist and are populated.
+    The closure is rebuilt from categories; groups are seeded from the
+    men/women mappings the products page used to hard-code.
+    """
+    try:
+        from models import CategoryClosure, CategoryGroup
+        from services.category_index import rebuild_category_closure
+
+        inspector = inspect(db.engine)
+        tables = inspector.get_table_names()
+        fixed = False
+
+        for model in (CategoryClosure, CategoryGroup):
+            if model.__tablename__ not in tables:
+                logger.warning(f"⚠️  Missing {model.__tablename__} table - FIXING...")
+                model.__table__.create(db.engine, checkfirst=True)
+                fixed = True
+                logger.info(f"✅ Created {model.__tablename__} table")
+
+        if not db.session.execute(text("SELECT COUNT(*) FROM category_closure")).scalar():
+            count = rebuild_category_closure(db.session.connection())
+            fixed = True
+            logger.info(f"✅ Built category_closure ({count} rows)")
+
+        if not db.session.execute(text("SELECT COUNT(*) FROM category_groups")).scalar():
+            groups = dict(DEFAULT_CATEGORY_GROUPS)
+            groups['gender'] = ('Gender', sorted(set(groups['men'][1]) | set(groups['women'][1])))
+            for slug, (name, category_ids) in groups.items():
+                for category_id in category_ids:
+                    db.session.execute(
+                        text("INSERT INTO category_groups (slug, name, category_id) VALUES (:slug, :name, :cid)"),
+                        {'slug': slug, 'name': name, 'cid': category_id},
+                    )
+            fixed = True
+            logger.info("✅ Seeded category_groups")
+
+        if fixed:
+            db.session.commit()
+        else:
+            logger.debug("✓ category index tables exist")
+
+        return fixed
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring category index tables: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_guest_cart_items_table(db):
+    """
+    Ensure the guest_cart_items table exists (server-side guest carts).
+    """
+    try:
+        from models import GuestCartItem
+
+        inspector = inspect(db.engine)
+        if 'guest_cart_items' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing guest_cart_items table - FIXING...")
+            GuestCartItem.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created guest_cart_items table")
+            return True
+
+        logger.debug("✓ guest_cart_items table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring guest_cart_items table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_notification_outbox_table(db):
+    """
+    Ensure the notification_outbox table exists (queued Slack/email sends).
+    """
+    try:
+        from models import NotificationOutbox
+
+        inspector = inspect(db.engine)
+        if 'notification_outbox' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing notification_outbox table - FIXING...")
+            NotificationOutbox.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created notification_outbox table")
+            return True
+
+        logger.debug("✓ notification_outbox table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring notification_outbox table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_email_campaigns_table(db):
+    """
+    Ensure the email_campaigns table exists (marketing send checkpoints).
+    """
+    try:
+        from models import EmailCampaign
+
+        inspector = inspect(db.engine)
+        if 'email_campaigns' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing email_campaigns table - FIXING...")
+            EmailCampaign.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created email_campaigns table")
+            return True
+
+        logger.debug("✓ email_campaigns table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring email_campaigns table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_email_campaign_lease_columns(db):
+    """
+    Ensure email_campaigns has the lease columns that keep two processes from sending one campaign.
+    """
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('email_campaigns')]
+
+        wanted = (
+            ('locked_by', "VARCHAR(100) NULL COMMENT 'Process currently sending the campaign'"),
+            ('locked_until', "DATETIME NULL COMMENT 'Send lease, renewed after every batch'"),
+        )
+        fixed = False
+        for name, definition in wanted:
+            if name not in columns:
+                logger.warning(f"⚠️  Missing '{name}' column in email_campaigns table - FIXING...")
+                db.session.execute(text(f"ALTER TABLE email_campaigns ADD COLUMN {name} {definition}"))
+                fixed = True
+                logger.info(f"✅ Added '{name}' column to email_campaigns table")
+
+        if fixed:
+            db.session.commit()
+        else:
+            logger.debug("✓ email_campaigns lease columns exist")
+
+        return fixed
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring email_campaigns lease columns: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_geo_cache_table(db):
+    """
+    Ensure the geo_cache table exists (geocode, distance and quote cache).
+    """
+    try:
+        from models import GeoCacheEntry
+
+        inspector = inspect(db.engine)
+        if 'geo_cache' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing geo_cache table - FIXING...")
+            GeoCacheEntry.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created geo_cache table")
+            return True
+
+        logger.debug("✓ geo_cache table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring geo_cache table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_product_detail_features_table(db):
+    """
+    Ensure the product_detail_features table exists (precomputed product page text).
+    """
+    try:
+        from models import ProductDetailFeatures
+
+        inspector = inspect(db.engine)
+        if 'product_detail_features' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing product_detail_features table - FIXING...")
+            ProductDetailFeatures.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created product_detail_features table (run backfill_features.py --details to fill it)")
+            return True
+
+        logger.debug("✓ product_detail_features table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring product_detail_features table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_product_neighbors_table(db):
+    """
+    Ensure the product_neighbors table exists (related-products index).
+    """
+    try:
+        from models import ProductNeighbors
+
+        inspector = inspect(db.engine)
+        if 'product_neighbors' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing product_neighbors table - FIXING...")
+            ProductNeighbors.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created product_neighbors table (built on first use or by build_related_index.py)")
+            return True
+
+        logger.debug("✓ product_neighbors table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring product_neighbors table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_inventory_tables(db):
+    """
+    Ensure inventory_reservations and inventory_commits exist (checkout holds, once-per-payment stock).
+    """
+    try:
+        from models import InventoryReservation, InventoryCommit
+
+        inspector = inspect(db.engine)
+        tables = inspector.get_table_names()
+        fixed = False
+
+        for model in (InventoryReservation, InventoryCommit):
+            if model.__tablename__ not in tables:
+                logger.warning(f"⚠️  Missing {model.__tablename__} table - FIXING...")
+                model.__table__.create(db.engine, checkfirst=True)
+                fixed = True
+                logger.info(f"✅ Created {model.__tablename__} table")
+
+        if not fixed:
+            logger.debug("✓ inventory tables exist")
+        return fixed
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring inventory tables: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_stripe_events_table(db):
+    """
+    Ensure the stripe_events table exists (webhook ledger processed by the event worker).
+    """
+    try:
+        from models import StripeEvent
+
+        inspector = inspect(db.engine)
+        if 'stripe_events' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing stripe_events table - FIXING...")
+            StripeEvent.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created stripe_events table")
+            return True
+
+        logger.debug("✓ stripe_events table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring stripe_events table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def ensure_stats_hourly_table(db):
+    """
+    Ensure the stats_hourly table exists (admin dashboard rollups),
+    seeding it from existing orders, users and audit logs when first created.
+    """
+    try:
+        from models import StatsHourly
+
+        inspector = inspect(db.engine)
+        if 'stats_hourly' not in inspector.get_table_names():
+            logger.warning("⚠️  Missing stats_hourly table - FIXING...")
+            StatsHourly.__table__.create(db.engine, checkfirst=True)
+            logger.info("✅ Created stats_hourly table")
+
+            from services.stats_rollup import rebuild_rollups
+            rows = rebuild_rollups()
+            logger.info(f"✅ Seeded stats_hourly with {rows} hourly counters")
+            return True
+
+        logger.debug("✓ stats_hourly table exists")
+        return False
+
+    except Exception as e:
+        logger.error(f"❌ Error ensuring stats_hourly table: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
 def run_all_migrations(db, app):
     """
     Run all database migrations.
@@ -126,6 +552,19 @@ def run_all_migrations(db, app):
             ('discount_usages.created_at', ensure_discount_usages_created_at),
             ('products.features', ensure_products_features),
             ('product_variants.stock_columns', ensure_product_variant_stock_columns),
+            ('product_images.renditions', ensure_product_image_rendition_columns),
+            ('catalog_versions', ensure_catalog_versions_table),
+            ('category_index', ensure_category_index_tables),
+            ('guest_cart_items', ensure_guest_cart_items_table),
+            ('notification_outbox', ensure_notification_outbox_table),
+            ('email_campaigns', ensure_email_campaigns_table),
+            ('email_campaigns.lease', ensure_email_campaign_lease_columns),
+            ('geo_cache', ensure_geo_cache_table),
+            ('stats_hourly', ensure_stats_hourly_table),
+            ('product_detail_features', ensure_product_detail_features_table),
+            ('product_neighbors', ensure_product_neighbors_table),
+            ('inventory', ensure_inventory_tables),
+            ('stripe_events', ensure_stripe_events_table),
         ]
         
         fixed_count = 0
@@ -7,53 +7,52 @@ from functools import wraps
 from sqlalchemy.exc import OperationalError, DisconnectionError
 from flask import current_app
 
+from services.db_health import (
+    DatabaseUnavailable, database_available, db_health_stats, ensure_database_available, report_db_failure,
+)
+
 logger = logging.getLogger(__name__)
 
 def retry_db_operation(max_retries=3, delay=1):
     """
-    Decorator to retry database operations on connection failures
+    Decorator to retry database operations on connection failures.
+    Fails fast with DatabaseUnavailable while the health breaker is open,
+    and stops retrying as soon as it opens.
     """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
-            
             for attempt in range(max_retries):
+                ensure_database_available()
                 try:
                     return func(*args, **kwargs)
                 except (OperationalError, DisconnectionError) as e:
-                    last_exception = e
-                    if attempt < max_retries - 1:
+                    if isinstance(e, DatabaseUnavailable):
+                        raise
+                    report_db_failure(e)
+                    if attempt < max_retries - 1 and database_available():
                         logger.warning(f"Database operation failed (attempt {attempt + 1}/{max_retries}): {str(e)}")
-                        time.sleep(delay * (attempt + 1))  # Exponential backoff
+                        time.sleep(delay * (attempt + 1))  # Linear backoff
                         continue
-                    else:
-                        logger.error(f"Database operation failed after {max_retries} attempts: {str(e)}")
-                        raise
+                    logger.error(f"Database operation failed after {attempt + 1} attempts: {str(e)}")
+                    raise
                 except Exception as e:
                     # For non-connection errors, don't retry
                     logger.error(f"Non-connection database error: {str(e)}")
                     raise
-            
-            # This should never be reached, but just in case
-            raise last_exception
-        
+
         return wrapper
     return decorator
 
 def test_database_connection():
     """
-    Test database connection and return status
+    Database status from the background health probe (no round trip).
+    Returns (connected, message).
     """
-    try:
-        from routes import db
-        # Simple query to test connection
-        from sqlalchemy import text
-        db.session.execute(text('SELECT 1'))
-        db.session.commit()
+    if database_available():
         return True, "Database connection successful"
-    except Exception as e:
-        return False, f"Database connection failed: {str(e)}"
+    stats = db_health_stats() or {}
+    return False, f"Database circuit open: {stats.get('last_error')}"
 
 def get_fallback_data():
     """
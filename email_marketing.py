@@ -2,7 +2,8 @@
 from datetime import datetime
 from flask import render_template, current_app
 from models import User, Product, db
-from email_utils import send_email_sendlayer
+from services.notification_outbox import enqueue_email
+from services.email_campaigns import start_campaign, run_campaign, resume_unfinished_campaigns
 
 
 class EmailMarketing:
@@ -19,18 +20,20 @@ class EmailMarketing:
         try:
             html_body = render_template("emails/welcome.html", user=user)
             
-            result = send_email_sendlayer(
+            queued = enqueue_email(
                 to_name=user.full_name,
                 to_email=user.email,
                 subject="🎉 Welcome to LoveMeNow VIP Club!",
                 html_body=html_body
             )
+            db.session.commit()
             
-            current_app.logger.info(f"Welcome email sent to {user.email}")
-            return result
+            current_app.logger.info(f"Welcome email queued for {user.email}")
+            return queued
             
         except Exception as e:
-            current_app.logger.error(f"Failed to send welcome email to {user.email}: {e}")
+            db.session.rollback()
+            current_app.logger.error(f"Failed to queue welcome email to {user.email}: {e}")
             return None
     
     @staticmethod
@@ -41,95 +44,48 @@ class EmailMarketing:
             current_app.logger.error(f"Product {product_id} not found")
             return
         
-        users = EmailMarketing.get_opted_in_users()
-        sent_count = 0
+        campaign = start_campaign('new_product', f"🆕 New Arrival: {product.name}",
+                                  {'product_id': product.id})
+        campaign = run_campaign(campaign.id)
         
-        for user in users:
-            try:
-                html_body = render_template("emails/new_product.html", 
-                                          user=user, 
-                                          product=product)
-                
-                send_email_sendlayer(
-                    to_name=user.full_name,
-                    to_email=user.email,
-                    subject=f"🆕 New Arrival: {product.name}",
-                    html_body=html_body
-                )
-                sent_count += 1
-                
-            except Exception as e:
-                current_app.logger.error(f"Failed to send new product email to {user.email}: {e}")
-        
-        current_app.logger.info(f"New product announcement sent to {sent_count} users")
-        return sent_count
+        current_app.logger.info(f"New product announcement sent to {campaign.sent_count} users")
+        return campaign.sent_count
     
     @staticmethod
     def send_sale_announcement(sale_title, sale_description, discount_percent=None, products=None):
         """Send sale announcement to all opted-in users"""
-        users = EmailMarketing.get_opted_in_users()
-        sent_count = 0
-        
-        # If specific products aren't provided, get featured products
-        if not products:
-            products = Product.query.limit(6).all()
+        subject = f"🔥 {sale_title}"
+        if discount_percent:
+            subject += f" - {discount_percent}% OFF!"
         
-        for user in users:
-            try:
-                html_body = render_template("emails/sale.html", 
-                                          user=user,
-                                          sale_title=sale_title,
-                                          sale_description=sale_description,
-                                          discount_percent=discount_percent,
-                                          products=products)
-                
-                subject = f"🔥 {sale_title}"
-                if discount_percent:
-                    subject += f" - {discount_percent}% OFF!"
-                
-                send_email_sendlayer(
-                    to_name=user.full_name,
-                    to_email=user.email,
-                    subject=subject,
-                    html_body=html_body
-                )
-                sent_count += 1
-                
-            except Exception as e:
-                current_app.logger.error(f"Failed to send sale email to {user.email}: {e}")
+        # If specific products aren't provided, the campaign falls back to featured products
+        campaign = start_campaign('sale', subject, {
+            'sale_title': sale_title,
+            'sale_description': sale_description,
+            'discount_percent': discount_percent,
+            'product_ids': [p.id for p in products or []],
+        })
+        campaign = run_campaign(campaign.id)
         
-        current_app.logger.info(f"Sale announcement sent to {sent_count} users")
-        return sent_count
+        current_app.logger.info(f"Sale announcement sent to {campaign.sent_count} users")
+        return campaign.sent_count
     
     @staticmethod
     def send_newsletter(subject, content, featured_products=None):
         """Send custom newsletter to all opted-in users"""
-        users = EmailMarketing.get_opted_in_users()
-        sent_count = 0
-        
-        if not featured_products:
-            featured_products = Product.query.limit(4).all()
+        campaign = start_campaign('newsletter', subject, {
+            'content': content,
+            'product_ids': [p.id for p in featured_products or []],
+        })
+        campaign = run_campaign(campaign.id)
         
-        for user in users:
-            try:
-                html_body = render_template("emails/newsletter.html", 
-                                          user=user,
-                                          content=content,
-                                          featured_products=featured_products)
-                
-                send_email_sendlayer(
-                    to_name=user.full_name,
-                    to_email=user.email,
-                    subject=subject,
-                    html_body=html_body
-                )
-                sent_count += 1
-                
-            except Exception as e:
-                current_app.logger.error(f"Failed to send newsletter to {user.email}: {e}")
-        
-        current_app.logger.info(f"Newsletter sent to {sent_count} users")
-        return sent_count
+        current_app.logger.info(f"Newsletter sent to {campaign.sent_count} users")
+        return campaign.sent_count
+    
+    @staticmethod
+    def resume_campaigns():
+        """Finish campaigns interrupted by a crash or deploy, from their last checkpoint"""
+        return resume_unfinished_campaigns()
     
     @staticmethod
     def send_abandoned_cart_reminder(user, cart_items):
@@ -139,16 +95,18 @@ class EmailMarketing:
                                       user=user,
                                       cart_items=cart_items)
             
-            send_email_sendlayer(
+            enqueue_email(
                 to_name=user.full_name,
                 to_email=user.email,
                 subject="💕 You left something special behind...",
                 html_body=html_body
             )
+            db.session.commit()
             
-            current_app.logger.info(f"Abandoned cart email sent to {user.email}")
+            current_app.logger.info(f"Abandoned cart email queued for {user.email}")
             return True
             
         except Exception as e:
-            current_app.logger.error(f"Failed to send abandoned cart email to {user.email}: {e}")
+            db.session.rollback()
+            current_app.logger.error(f"Failed to queue abandoned cart email to {user.email}: {e}")
             return False
\ No newline at end of file
@@ -7,10 +7,11 @@ SENDLAYER_API_URL = "https://console.sendlayer.com/api/v1/email"
 
 def send_email_sendlayer(to_name: str, to_email: str,
                          subject: str, html_body: str,
-                         plain_body: str = "") -> dict:
+                         plain_body: str = "", session=None) -> dict:
     """
     Fire a single transactional email via SendLayer JSON API.
     Returns the parsed JSON response (or raises for HTTP errors).
+    Pass a requests.Session to reuse its keep-alive connection across sends.
     """
 
     api_key = os.getenv("SENDLAYER_API_KEY")
@@ -44,7 +45,7 @@ def send_email_sendlayer(to_name: str, to_email: str,
     except Exception:
         pass
 
-    resp = requests.post(
+    resp = (session or requests).post(
         SENDLAYER_API_URL,
         headers=headers,
         data=json.dumps(payload),
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from flask_login import UserMixin
 from routes import db, bcrypt
@@ -43,6 +44,11 @@ class User(db.Model, UserMixin):
     def check_password(self, plain_pw: str) -> bool:
         return bcrypt.check_password_hash(self.password_hash, plain_pw)
 
+    @property
+    def is_active(self):
+        # Flask-Login won't log in deactivated accounts; load_user signs them out
+        return self.active is not False
+
 
 class UserAddress(db.Model):
     __tablename__ = "user_addresses"
@@ -76,6 +82,34 @@ class Category(db.Model):
     products = db.relationship("Product", backref="category", lazy=True)
 
 
+class CategoryClosure(db.Model):
+    """Every (ancestor, descendant) pair in the category tree, including self at depth 0."""
+    __tablename__ = "category_closure"
+
+    # No foreign keys: rows are derived and rebuilt whenever categories change
+    ancestor_id = db.Column(db.Integer, primary_key=True)
+    descendant_id = db.Column(db.Integer, primary_key=True)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("idx_category_closure_descendant", "descendant_id"),
+    )
+
+
+class CategoryGroup(db.Model):
+    """Named listing groups (e.g. men/women) that span categories outside the tree."""
+    __tablename__ = "category_groups"
+
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(50), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    category_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("slug", "category_id", name="unique_category_group_member"),
+    )
+
+
 class ProductVariant(db.Model):
     __tablename__ = "product_variants"
 
@@ -145,33 +179,6 @@ class ProductVariant(db.Model):
             return False, f"Only {available} more item(s) can be added to cart (stock limit: {stock_qty})"
         return True, "Available"
 
-    def decrement_inventory(self, quantity):
-        if quantity <= 0:
-            return False
-
-        if self.uses_product_stock():
-            if (self.product.quantity_on_hand or 0) < quantity:
-                return False
-            self.product.quantity_on_hand -= quantity
-            if self.product.quantity_on_hand <= 0:
-                self.product.in_stock = False
-            return True
-
-        if self.quantity_on_hand is not None:
-            if (self.quantity_on_hand or 0) < quantity:
-                return False
-            self.quantity_on_hand -= quantity
-            if self.quantity_on_hand <= 0:
-                self.in_stock = False
-            return True
-
-        if (self.product.quantity_on_hand or 0) < quantity:
-            return False
-        self.product.quantity_on_hand -= quantity
-        if self.product.quantity_on_hand <= 0:
-            self.product.in_stock = False
-        return True
-
     @property
     def display_name(self):
         if self.product:
@@ -190,8 +197,25 @@ class ProductImage(db.Model):
     sort_order = db.Column(db.Integer, default=0)
     alt_text = db.Column(db.String(255))
 
+    # Responsive renditions filled in by optimize_images.py (services/image_pipeline.py)
+    content_hash = db.Column(db.String(64))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    renditions = db.Column(db.Text)  # JSON: {"webp": [[320, "/static/IMG/optimized/..."], ...], "avif": [...]}
+    lqip = db.Column(db.Text)        # tiny data URI placeholder
+
     variant = db.relationship("ProductVariant", backref="images")
 
+    def srcset(self, fmt="webp"):
+        """'url 320w, url 640w, ...' for one format, or '' until the image has been optimized."""
+        if not self.renditions:
+            return ""
+        try:
+            ladder = json.loads(self.renditions).get(fmt) or []
+        except ValueError:
+            return ""
+        return ", ".join(f"{url} {width}w" for width, url in ladder)
+
 
 product_colors = db.Table(
     "product_colors",
@@ -327,14 +351,6 @@ class Product(db.Model):
             return False, "Product variant not available"
         return dv.can_add_to_cart(requested_quantity, current_cart_quantity)
 
-    def decrement_inventory(self, quantity):
-        if quantity <= 0 or self.quantity_on_hand < quantity:
-            return False
-        self.quantity_on_hand -= quantity
-        if self.quantity_on_hand <= 0:
-            self.in_stock = False
-        return True
-
     def variant_display_name(self, variant=None, preferred_label=None):
         base_name = (self.name or "").strip()
         label = preferred_label
@@ -407,6 +423,23 @@ class Cart(db.Model):
         return float(self.product.price) * self.quantity if self.product else 0.0
 
 
+class GuestCartItem(db.Model):
+    """Server-side guest cart line, keyed by the opaque token kept in the session."""
+    __tablename__ = "guest_cart_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    cart_token = db.Column(db.String(64), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    variant_id = db.Column(db.Integer, db.ForeignKey("product_variants.id"), nullable=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("cart_token", "product_id", "variant_id", name="unique_guest_cart_line"),
+    )
+
+
 # ─────────────────────────────────────────────────────────────
 # Orders & Delivery
 # ─────────────────────────────────────────────────────────────
@@ -595,16 +628,15 @@ class AuditLog(db.Model):
     @staticmethod
     def log_action(action, user_id=None, resource_type=None, resource_id=None,
                    details=None, ip_address=None, user_agent=None, status="success"):
-        log_entry = AuditLog(
-            user_id=user_id,
-            action=action,
-            resource_type=resource_type,
-            resource_id=str(resource_id) if resource_id else None,
-            details=details,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            status=status,
-        )
+        """Queue an audit entry for the background writer; synchronous insert if it isn't running."""
+        from services.audit_writer import audit_row, enqueue_audit
+
+        row = audit_row(action, user_id=user_id, resource_type=resource_type,
+                        resource_id=resource_id, details=details, ip_address=ip_address,
+                        user_agent=user_agent, status=status)
+        if enqueue_audit(row):
+            return
+        log_entry = AuditLog(**row)
         db.session.add(log_entry)
         try:
             db.session.commit()
@@ -620,3 +652,178 @@ class AuditLog(db.Model):
     @property
     def is_completed(self):
         return self.status in ["delivered", "cancelled"]
+
+
+# ─────────────────────────────────────────────────────────────
+# Outbound notifications
+# ─────────────────────────────────────────────────────────────
+
+class NotificationOutbox(db.Model):
+    """Slack/email notifications written with the business transaction and sent by a background worker."""
+    __tablename__ = "notification_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_notification_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+
+class EmailCampaign(db.Model):
+    """A marketing send to all opted-in users, checkpointed so a crash resumes instead of restarting."""
+    __tablename__ = "email_campaigns"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)      # new_product, sale, newsletter
+    subject = db.Column(db.String(255), nullable=False)
+    params = db.Column(db.Text)                          # JSON template inputs
+    status = db.Column(db.String(20), nullable=False, default="running")  # running, completed
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(100))                # host:pid:thread currently sending
+    locked_until = db.Column(db.DateTime)                # lease; renewed after every batch
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+
+# ─────────────────────────────────────────────────────────────
+# External lookups cache
+# ─────────────────────────────────────────────────────────────
+
+class GeoCacheEntry(db.Model):
+    """Shared TTL cache for geocodes, driving distances and delivery quotes."""
+    __tablename__ = "geo_cache"
+
+    id = db.Column(db.Integer, primary_key=True)
+    namespace = db.Column(db.String(20), nullable=False)   # geocode, distance, quote
+    cache_key = db.Column(db.String(64), nullable=False)   # sha256 of the normalized input
+    value = db.Column(db.Text, nullable=False)             # JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("namespace", "cache_key", name="unique_geo_cache_key"),
+    )
+
+
+# ─────────────────────────────────────────────────────────────
+# Precomputed product page data
+# ─────────────────────────────────────────────────────────────
+
+class ProductDetailFeatures(db.Model):
+    """Features/specs/dims extracted from a product's text, valid while content_hash matches."""
+    __tablename__ = "product_detail_features"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON: {"features": [...], "specs": [...], "dims": [...]}
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ProductNeighbors(db.Model):
+    """Offline-built related-products list for one product, best first."""
+    __tablename__ = "product_neighbors"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    neighbors = db.Column(db.Text, nullable=False)  # JSON: [[product_id, score], ...]
+    built_through_order_id = db.Column(db.Integer, nullable=False, default=0)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# ─────────────────────────────────────────────────────────────
+# Inventory
+# ─────────────────────────────────────────────────────────────
+
+class InventoryReservation(db.Model):
+    """Stock held for an in-progress checkout until it is paid or expires."""
+    __tablename__ = "inventory_reservations"
+
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_key = db.Column(db.String(100), nullable=False, index=True)  # user:<id> or guest:<cart token>
+    target_type = db.Column(db.String(10), nullable=False)                    # product, variant
+    target_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("idx_reservation_target", "target_type", "target_id", "expires_at"),
+    )
+
+
+class InventoryCommit(db.Model):
+    """One row per payment whose stock has been taken; the primary key makes it happen once."""
+    __tablename__ = "inventory_commits"
+
+    payment_key = db.Column(db.String(255), primary_key=True)  # PaymentIntent or Checkout Session id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# ─────────────────────────────────────────────────────────────
+# Stripe events
+# ─────────────────────────────────────────────────────────────
+
+class StripeEvent(db.Model):
+    """Every verified Stripe webhook delivery, recorded before processing; the event id makes duplicates no-ops."""
+    __tablename__ = "stripe_events"
+
+    event_id = db.Column(db.String(255), primary_key=True)      # evt_...
+    event_type = db.Column(db.String(100), nullable=False)
+    ordering_key = db.Column(db.String(255), nullable=False)    # PaymentIntent id (else the object id)
+    stripe_created = db.Column(db.Integer, nullable=False, default=0)  # event.created, orders events per key
+    payload = db.Column(db.Text, nullable=False)                # raw event JSON
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, processing, processed, ignored, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_stripe_events_due', 'status', 'next_attempt_at'),
+        db.Index('idx_stripe_events_ordering', 'ordering_key', 'stripe_created'),
+    )
+
+
+# ─────────────────────────────────────────────────────────────
+# Admin statistics
+# ─────────────────────────────────────────────────────────────
+
+class StatsHourly(db.Model):
+    """Per-hour event counters maintained incrementally for the admin dashboards."""
+    __tablename__ = "stats_hourly"
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)        # UTC hour start
+    metric = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("bucket", "metric", name="unique_stats_hourly_bucket_metric"),
+    )
+
+
+# ─────────────────────────────────────────────────────────────
+# Cache versioning
+# ─────────────────────────────────────────────────────────────
+
+class CatalogVersion(db.Model):
+    """Monotonic version counters used to invalidate per-worker caches."""
+    __tablename__ = "catalog_versions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(50), unique=True, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
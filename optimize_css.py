@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 """
-CSS Optimization Script
-Splits large CSS files into critical and non-critical parts for better performance
+CSS/JS Optimization Script
+Builds minified, bundled, content-hashed and precompressed CSS/JS into
+static/dist (see services/asset_pipeline.py); templates resolve them with
+asset_url(). With --critical it first splits styles.css into critical.css
+and styles.min.css.
 """
 
+import argparse
 import os
 import re
+import sys
 from pathlib import Path
 
+# Ensure project root on path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.asset_pipeline import build_assets, minify_css
+
 def extract_critical_css(css_content):
     """
     Extract critical CSS rules (above-the-fold content)
@@ -54,22 +64,6 @@ def extract_critical_css(css_content):
     
     return '\n'.join(critical_css)
 
-def minify_css(css_content):
-    """
-    Basic CSS minification
-    """
-    # Remove comments
-    css_content = re.sub(r'/\*[^*]*\*+(?:[^/*][^*]*\*+)*/', '', css_content)
-    
-    # Remove unnecessary whitespace
-    css_content = re.sub(r'\s+', ' ', css_content)
-    css_content = re.sub(r'\s*([{}:;,])\s*', r'\1', css_content)
-    
-    # Remove trailing semicolon before closing brace
-    css_content = re.sub(r';\}', '}', css_content)
-    
-    return css_content.strip()
-
 def split_css_file(input_path, output_dir):
     """
     Split CSS file into critical and non-critical parts
@@ -110,25 +104,33 @@ def split_css_file(input_path, output_dir):
 
 def main():
     """
-    Main function to optimize CSS files
+    Main function to optimize CSS/JS files
     """
-    project_root = Path(__file__).parent
-    css_dir = project_root / 'static' / 'CSS'
-    
-    # Check if styles.css exists
-    styles_css = css_dir / 'styles.css'
-    if not styles_css.exists():
-        print(f"❌ Error: {styles_css} not found!")
-        return
-    
-    print("🚀 Starting CSS optimization...")
-    split_css_file(styles_css, css_dir)
-    
-    print("\n✨ CSS optimization complete!")
-    print("\n📝 Next steps:")
-    print("1. Test the site with ?perf=1 query parameter to use optimized template")
-    print("2. Inline critical.css in the <head> for best performance")
-    print("3. Load styles.min.css asynchronously")
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed CSS/JS")
+    parser.add_argument("--static", default=str(Path(__file__).parent / "static"),
+                        help="static folder containing CSS/ and js/ (default: ./static)")
+    parser.add_argument("--critical", action="store_true",
+                        help="also regenerate critical.css and styles.min.css from styles.css")
+    args = parser.parse_args()
+    static_root = Path(args.static)
+
+    if args.critical:
+        styles_css = static_root / 'CSS' / 'styles.css'
+        if not styles_css.exists():
+            print(f"❌ Error: {styles_css} not found!")
+            return 1
+        print("🚀 Starting CSS optimization...")
+        split_css_file(styles_css, static_root / 'CSS')
+
+    print("🚀 Building static assets...")
+    manifest, stats = build_assets(static_root)
+
+    print("\n📊 Asset Statistics:")
+    print(f"  Assets: {stats['assets']}  (re)written: {stats['written']}")
+    print(f"  Minified: {stats['bytes']:,} bytes  gzip: {stats['gzip_bytes']:,} bytes"
+          + (f"  brotli: {stats['br_bytes']:,} bytes" if stats['br_bytes'] else "  (brotli not installed)"))
+    print("\n✨ Asset build complete!")
+    return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -56,12 +56,6 @@ def get_fallback_data():
     }
 
 def test_database_connection():
-    """Test database connection"""
-    try:
-        from models import db
-        from sqlalchemy import text
-        # Simple query to test connection
-        db.session.execute(text('SELECT 1'))
-        return True, "Database connection successful"
-    except Exception as e:
-        return False, str(e)
\ No newline at end of file
+    """Test database connection (answered by the background health probe)"""
+    from database_utils import test_database_connection as probe_status
+    return probe_status()
\ No newline at end of file
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Inspect and replay the Stripe webhook ledger (stripe_events)
+
+  --list [--status dead]     show recent events and a count per status
+  --requeue evt_1 evt_2      run these events again (safe: fulfillment is idempotent)
+  --requeue-dead             run every dead-lettered event again
+  --fetch evt_1 evt_2        pull events from the Stripe API that never reached
+                             the webhook and record them
+  --drain                    process everything due now, in this process
+
+Requeued and fetched events are picked up by the running app's worker; add
+--drain to process them here instead.
+"""
+import argparse
+import json
+import sys
+import os
+
+# Ensure project root on path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stripe
+from sqlalchemy import func
+
+from app import app
+from routes import db
+from models import StripeEvent
+from services.stripe_events import StripeEventWorker, record_event, requeue_events
+
+
+def list_events(status=None, limit=50):
+    counts = dict(db.session.query(StripeEvent.status, func.count()).group_by(StripeEvent.status).all())
+    print("📊 " + ", ".join(f"{name}: {count}" for name, count in sorted(counts.items())) if counts else "📊 Ledger is empty")
+
+    query = StripeEvent.query
+    if status:
+        query = query.filter_by(status=status)
+    for row in query.order_by(StripeEvent.received_at.desc()).limit(limit):
+        error = (row.last_error or '').splitlines()[0][:80] if row.last_error else ''
+        print(f"  {row.event_id}  {row.event_type:<28} {row.status:<10} attempts={row.attempts} "
+              f"key={row.ordering_key} received={row.received_at:%Y-%m-%d %H:%M:%S} {error}")
+
+
+def fetch_events(event_ids):
+    for event_id in event_ids:
+        try:
+            event = stripe.Event.retrieve(event_id)
+        except stripe.error.StripeError as e:
+            print(f"❌ {event_id}: {e}")
+            continue
+        payload = str(event)
+        if record_event(json.loads(payload), payload):
+            print(f"✅ Recorded {event_id} ({event['type']})")
+        else:
+            print(f"ℹ️  {event_id} already in the ledger; use --requeue to run it again")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay recorded Stripe webhook events")
+    parser.add_argument("--list", action="store_true", help="show recent events and status counts")
+    parser.add_argument("--status", help="with --list, only show events in this status")
+    parser.add_argument("--limit", type=int, default=50, help="with --list, how many events to show")
+    parser.add_argument("--requeue", nargs="+", metavar="EVENT_ID", help="reset these events to pending")
+    parser.add_argument("--requeue-dead", action="store_true", help="reset every dead event to pending")
+    parser.add_argument("--fetch", nargs="+", metavar="EVENT_ID", help="record events retrieved from the Stripe API")
+    parser.add_argument("--drain", action="store_true", help="process all due events in this process")
+    args = parser.parse_args()
+
+    if not any((args.list, args.requeue, args.requeue_dead, args.fetch, args.drain)):
+        parser.print_help()
+        return
+
+    with app.app_context():
+        if args.fetch:
+            fetch_events(args.fetch)
+        if args.requeue:
+            count = requeue_events(args.requeue)
+            db.session.commit()
+            print(f"✅ Requeued {count} event(s)")
+        if args.requeue_dead:
+            count = requeue_events(dead_only=True)
+            db.session.commit()
+            print(f"✅ Requeued {count} dead event(s)")
+        if args.drain:
+            processed = StripeEventWorker(app).drain()
+            print(f"✅ Processed {processed} event(s)")
+        if args.list:
+            list_events(status=args.status, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
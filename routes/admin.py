@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from routes import db
 from models import User, Product, Order, AuditLog, Cart, Wishlist
 from security import admin_required
+from services.stats_rollup import window_counts
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -31,7 +32,7 @@ def dashboard():
         
         # Get user registration stats for the last 30 days
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        new_users_count = User.query.filter(User.created_at >= thirty_days_ago).count()
+        new_users_count = window_counts(thirty_days_ago, ('registrations',))['registrations']
         
         return render_template('admin/dashboard.html',
                              total_users=total_users,
@@ -149,14 +150,11 @@ def api_stats():
             'wishlist_items': Wishlist.query.count(),
         }
         
-        # Get recent activity counts
-        last_24h = datetime.utcnow() - timedelta(hours=24)
-        stats['recent_registrations'] = User.query.filter(User.created_at >= last_24h).count()
-        stats['recent_orders'] = Order.query.filter(Order.created_at >= last_24h).count()
-        stats['recent_logins'] = AuditLog.query.filter(
-            AuditLog.action == 'user_login',
-            AuditLog.created_at >= last_24h
-        ).count()
+        # Get recent activity counts from the hourly rollups
+        recent = window_counts(datetime.utcnow() - timedelta(hours=24), ('registrations', 'orders', 'logins'))
+        stats['recent_registrations'] = recent['registrations']
+        stats['recent_orders'] = recent['orders']
+        stats['recent_logins'] = recent['logins']
         
         return jsonify(stats)
     
@@ -258,7 +256,7 @@ def security_monitoring():
         age_verifications = AuditLog.query.filter(
             AuditLog.action.in_(['age_verification', 'age_verification_denied']),
             AuditLog.created_at >= seven_days_ago
-        ).all()
+        ).order_by(desc(AuditLog.created_at)).limit(50).all()
         
         # Get admin access logs
         admin_access = AuditLog.query.filter(
@@ -266,13 +264,14 @@ def security_monitoring():
             AuditLog.created_at >= seven_days_ago
         ).order_by(desc(AuditLog.created_at)).limit(30).all()
         
-        # Calculate statistics
+        # Calculate statistics from the hourly rollups rather than the capped lists above
+        counts = window_counts(seven_days_ago)
         stats = {
-            'suspicious_requests': len([log for log in suspicious_logs if log.action == 'suspicious_request']),
-            'rate_limit_violations': len([log for log in suspicious_logs if log.action == 'rate_limit_exceeded']),
-            'failed_logins': len(failed_logins),
-            'age_verifications_success': len([log for log in age_verifications if log.action == 'age_verification']),
-            'age_verifications_denied': len([log for log in age_verifications if log.action == 'age_verification_denied']),
+            'suspicious_requests': counts['suspicious_requests'],
+            'rate_limit_violations': counts['rate_limit_hits'],
+            'failed_logins': counts['failed_logins'],
+            'age_verifications_success': counts['age_verifications'],
+            'age_verifications_denied': counts['age_verification_denials'],
             'admin_access_attempts': len(admin_access)
         }
         
@@ -301,30 +300,15 @@ def api_security_stats():
         
         stats = {}
         
-        # Get stats for each time period
+        # Get stats for each time period (each is at most 720 hourly rows per metric)
         for period, start_time in [('24h', last_24h), ('7d', last_7d), ('30d', last_30d)]:
+            counts = window_counts(start_time)
             stats[period] = {
-                'suspicious_requests': AuditLog.query.filter(
-                    AuditLog.action == 'suspicious_request',
-                    AuditLog.created_at >= start_time
-                ).count(),
-                'rate_limit_violations': AuditLog.query.filter(
-                    AuditLog.action == 'rate_limit_exceeded',
-                    AuditLog.created_at >= start_time
-                ).count(),
-                'failed_logins': AuditLog.query.filter(
-                    AuditLog.action == 'user_login',
-                    AuditLog.status == 'failed',
-                    AuditLog.created_at >= start_time
-                ).count(),
-                'age_verifications': AuditLog.query.filter(
-                    AuditLog.action == 'age_verification',
-                    AuditLog.created_at >= start_time
-                ).count(),
-                'age_verification_denials': AuditLog.query.filter(
-                    AuditLog.action == 'age_verification_denied',
-                    AuditLog.created_at >= start_time
-                ).count()
+                'suspicious_requests': counts['suspicious_requests'],
+                'rate_limit_violations': counts['rate_limit_hits'],
+                'failed_logins': counts['failed_logins'],
+                'age_verifications': counts['age_verifications'],
+                'age_verification_denials': counts['age_verification_denials']
             }
         
         # Get top suspicious IPs
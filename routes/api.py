@@ -9,21 +9,28 @@ import stripe
 from flask import Blueprint, jsonify, url_for, current_app, request, session
 from flask_login import login_required, current_user
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func, text
-from flask import render_template
-from types import SimpleNamespace
-from email_utils import send_email_sendlayer as send_email_sendlayer_console
+from sqlalchemy import func
 
 from routes import db
 from models import (
-    Product, ProductVariant, ProductImage, Color, User, Cart, Wishlist, UserAddress,
+    ProductVariant, ProductImage, Color, User, Cart, Wishlist, UserAddress,
     Order, OrderItem, UberDelivery, DiscountCode, DiscountUsage
 )
 from .discount_utils import record_discount_redemption
 from security import sanitize_input, validate_input
 from routes.discount import discount_bp
 from .discount_utils import get_redemptions_for
-from services.slack_notifications import send_order_notification, send_manual_delivery_alert
+from services.notification_outbox import (
+    enqueue_order_confirmation, enqueue_order_notification, enqueue_manual_delivery_alert,
+    release_notifications,
+)
+from services.catalog_snapshot import get_catalog_snapshot
+from services.cart_store import guest_cart_token, clear_guest_cart
+from services.search_index import get_search_index
+from services.db_health import database_available, db_health_stats
+from services.inventory import (
+    InsufficientStock, StockAlreadyCommitted, commit_order_stock, describe_shortages, reserve_stock,
+)
 
 # IMPORTANT: mount all routes under /api
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -38,36 +45,12 @@ def _to_money(val) -> float:
     return float(Decimal(str(val)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
 
 
-def _cart_items_for_request():
-    """
-    Return a list of simple items {product, product_id, quantity} for either
-    a logged-in user's DB cart or a guest cart stored in session['cart'].
-    """
-    items = []
+def checkout_reservation_key():
+    """Stable per-shopper key for stock holds, so each new checkout replaces the last one."""
     if current_user.is_authenticated:
-        db_items = (
-            Cart.query.options(joinedload(Cart.product))
-            .filter(Cart.user_id == current_user.id)
-            .all()
-        )
-        for it in db_items:
-            if it.product:
-                items.append({
-                    "product": it.product,
-                    "product_id": it.product.id,
-                    "quantity": int(it.quantity or 0),
-                })
-    else:
-        cart_map = session.get('cart', {}) or {}
-        for key, qty in cart_map.items():
-            try:
-                product_id = int(key.split(':', 1)[0]) if ':' in str(key) else int(key)
-            except (TypeError, ValueError):
-                continue
-            prod = Product.query.get(product_id)
-            if prod:
-                items.append({"product": prod, "product_id": prod.id, "quantity": int(qty or 0)})
-    return items
+        return f"user:{current_user.id}"
+    token = guest_cart_token()
+    return f"guest:{token}" if token else None
 
 
 # -------------------------
@@ -87,15 +70,10 @@ def get_csrf_token():
 def single_product_json(product_id: int):
     """Get single product data as JSON with variant information"""
     try:
-        product = (
-            Product.query
-            .options(
-                joinedload(Product.variants).joinedload(ProductVariant.images),
-                joinedload(Product.variants).joinedload(ProductVariant.color)
-            )
-            .filter(Product.id == product_id, Product.in_active.is_(False))
-            .first_or_404()
-        )
+        # Derived views (default variant, images, availability) are precomputed on the snapshot
+        product = get_catalog_snapshot().products_by_id.get(product_id)
+        if product is None or product.in_active:
+            return jsonify({'error': 'Product not found'}), 404
 
         default_variant = product.default_variant
 
@@ -121,7 +99,7 @@ def single_product_json(product_id: int):
                         "sort_order": img.sort_order,
                         "alt_text": img.alt_text
                     }
-                    for img in sorted(variant.images, key=lambda i: i.sort_order)
+                    for img in variant.sorted_images
                 ]
             }
             variants.append(variant_data)
@@ -229,14 +207,13 @@ def get_deferred_content():
     from flask import render_template_string
 
     try:
-        featured_products = (
-            Product.query
-            .options(joinedload(Product.variants), joinedload(Product.category), joinedload(Product.colors))
-            .filter(Product.in_stock.is_(True), Product.quantity_on_hand > 0, Product.in_active.is_(False))
-            .order_by(Product.created_at.desc())
-            .limit(8)
-            .all()
-        )
+        snapshot = get_catalog_snapshot()
+        featured_products = sorted(
+            (p for p in snapshot.products
+             if p.in_stock and (p.quantity_on_hand or 0) > 0 and not p.in_active),
+            key=lambda p: p.created_at or datetime.min,
+            reverse=True,
+        )[:8]
 
         deferred_html = render_template_string('''
         <!-- Featured Products (trimmed) -->
@@ -298,6 +275,46 @@ def get_colors():
         return jsonify({'error': 'Failed to fetch colors'}), 500
 
 
+@api_bp.route('/search')
+def search_products():
+    """Ranked product search with typo tolerance and prefix autocomplete"""
+    try:
+        query = (request.args.get('q') or '').strip()
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        if not query:
+            return jsonify({'query': query, 'results': [], 'suggestions': []})
+
+        errors = validate_input({'q': query}, max_lengths={'q': 100})
+        if errors:
+            return jsonify({'error': 'Invalid search query'}), 400
+
+        index, snapshot = get_search_index()
+
+        results = []
+        for product_id, score in index.search(query, limit=limit):
+            product = snapshot.products_by_id.get(product_id)
+            if not product:
+                continue
+            results.append({
+                "id": product.id,
+                "name": product.name,
+                "price": float(product.price),
+                "image_url": product.main_image_url or product.image_url,
+                "is_available": product.is_available,
+                "url": url_for('main.product_detail', product_id=product.id),
+                "score": round(score, 4),
+            })
+
+        return jsonify({
+            'query': query,
+            'results': results,
+            'suggestions': index.complete(query),
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error searching products: {str(e)}")
+        return jsonify({'error': 'Search failed'}), 500
+
+
 # -------------------------
 # Discount endpoints (NEW)
 # -------------------------
@@ -416,6 +433,7 @@ def create_checkout_session():
             'subtotal': str(totals.get('subtotal', 0)),
             'request_pin': '1' if data.get('request_pin') else '0',
             'user_id': str(current_user.id) if current_user.is_authenticated else 'guest',
+            'cart_token': guest_cart_token() or '',
         }
 
         # Add items to metadata for webhook-based recovery
@@ -427,6 +445,23 @@ def create_checkout_session():
             pid = prod.id if hasattr(prod, 'id') else prod.get('id')
             metadata[f'item_{i}_product_id'] = str(pid)
             metadata[f'item_{i}_quantity'] = str(it['quantity'])
+            if it.get('variant_id'):
+                metadata[f'item_{i}_variant_id'] = str(it['variant_id'])
+
+        # Hold the stock while the shopper pays; a repeat checkout replaces the earlier hold
+        reservation_key = checkout_reservation_key()
+        if reservation_key and items:
+            try:
+                reserve_stock(reservation_key, items)
+                db.session.commit()
+            except InsufficientStock as e:
+                db.session.rollback()
+                current_app.logger.info(f"Checkout blocked for {reservation_key}: {e.shortages}")
+                return jsonify({
+                    'error': 'Some items in your cart are no longer available in the requested quantity.',
+                    'unavailable': describe_shortages(e.shortages),
+                }), 409
+            metadata['reservation_key'] = reservation_key
 
         # Create fresh PaymentIntent with CARD ONLY
         intent = stripe.PaymentIntent.create(
@@ -546,18 +581,13 @@ def create_order():
         db.session.add(order)
         db.session.flush()  # get order.id
 
-        # Items + inventory updates (same as before)
-        if current_user.is_authenticated:
-            items_for_inv = Cart.query.filter_by(user_id=current_user.id).all()
-        else:
-            # reconstruct from session the same way totals did
-            from routes.checkout_totals import get_cart_items_for_request
-            items_for_inv = get_cart_items_for_request()
+        # Order items from the lines the totals were priced from (no second cart load)
+        items_for_inv = list(totals['items'])
 
         for it in items_for_inv:
-            prod = it.product if hasattr(it, 'product') else it["product"]
-            qty = int(it.quantity if hasattr(it, 'quantity') else it["quantity"])
-            unit_price = float(prod.price)
+            prod = it["product"]
+            qty = int(it["quantity"])
+            unit_price = float(it["unit_price"])
 
             db.session.add(OrderItem(
                 order_id=order.id,
@@ -568,14 +598,23 @@ def create_order():
                 total=unit_price * qty
             ))
 
-            # decrement product-level inventory
-            if (prod.quantity_on_hand or 0) >= qty:
-                prod.quantity_on_hand = (prod.quantity_on_hand or 0) - qty
-                if prod.quantity_on_hand <= 0:
-                    prod.in_stock = False
-            else:
-                prod.quantity_on_hand = 0
-                prod.in_stock = False
+        # Take the stock (variant-aware, one UPDATE per table). The webhook may be
+        # fulfilling this same PI right now; whichever commits first wins.
+        try:
+            commit_order_stock(pi_id, totals['items'], allow_oversell=True,
+                               reservation_key=intent.metadata.get('reservation_key'))
+        except StockAlreadyCommitted:
+            db.session.rollback()
+            existing_order = Order.query.filter_by(stripe_session_id=pi_id).first()
+            current_app.logger.warning(f"⚠️  PI {pi_id} was fulfilled concurrently; returning existing order")
+            if existing_order:
+                return jsonify({
+                    'success': True,
+                    'order_number': existing_order.order_number,
+                    'message': 'Order already exists for this payment',
+                    'order_id': existing_order.id
+                }), 200
+            return jsonify({'error': 'Order is already being processed for this payment'}), 409
 
         # Record discount redemption (fix call signature)
         try:
@@ -592,7 +631,7 @@ def create_order():
         # Clear cart
         if current_user.is_authenticated:
             Cart.query.filter_by(user_id=current_user.id).delete()
-        session.pop('cart', None)
+        clear_guest_cart(commit=False)
         session.pop('discount', None)
         session.pop('discount_code', None)
         session.pop('discount_amount', None)
@@ -600,6 +639,26 @@ def create_order():
         # 🔒 Clear the PaymentIntent from session so it can't be reused
         session.pop('active_pi_id', None)
 
+        # Queue the Slack alert and confirmation email with the order itself. Delivery
+        # orders hold them while Uber is dispatched below, so they go out with the
+        # tracking link; the worker reads it from the order at send time.
+        hold_seconds = current_app.config['ORDER_NOTIFICATION_HOLD_SECONDS'] if delivery_type == 'delivery' else 0
+        held_notifications = [enqueue_order_notification(order, hold_seconds=hold_seconds)]
+        if (order.email or '').strip():
+            email_items = [
+                {"name": it["product"].name, "quantity": int(it["quantity"]), "unit_price": float(it["unit_price"])}
+                for it in items_for_inv
+            ]
+            email_totals = {
+                "subtotal": float(totals['subtotal']),
+                "discount_amount": float(totals.get('discount_amount', 0) or 0),
+                "discount_code": totals.get('discount_code'),
+                "delivery_fee": float(totals.get('delivery_fee', 0) or 0),
+                "tax": float(totals.get('tax', 0) or 0),
+                "total": float(totals['total']),
+            }
+            held_notifications.append(enqueue_order_confirmation(order, email_items, email_totals, hold_seconds))
+
         db.session.commit()
         
         current_app.logger.info(f"✅ Order created successfully: {order.order_number} (PI: {pi_id})")
@@ -729,95 +788,17 @@ def create_order():
                 tracking_url = None
                 # Don't fail the order creation
 
-        # 5) Send order confirmation email (guest or signed-in)
+        # 5) Release the held notifications now that the tracking link (if any) is saved
         try:
-            buyer_email = (order.email or '').strip()
-            if buyer_email:
-                # Build a light-weight items list from what we just saved
-                # (avoids another query; uses the same data we inserted)
-                email_items = []
-                for it in items_for_inv:
-                    prod = it.product if hasattr(it, 'product') else it["product"]
-                    qty = int(it.quantity if hasattr(it, 'quantity') else it["quantity"])
-                    unit_price = float(prod.price)
-                    email_items.append({
-                        "name": prod.name,
-                        "quantity": qty,
-                        "unit_price": unit_price
-                    })
-
-                # Delivery address for template
-                delivery_address = {
-                    "address": order.shipping_address,
-                    "suite": order.shipping_suite or '',
-                    "city": order.shipping_city,
-                    "state": order.shipping_state,
-                    "zip": order.shipping_zip
-                }
-
-                # Context mirrors your success page
-                # Wrap to avoid Jinja colliding with dict.items; expose attributes like order.items
-                order_ns = SimpleNamespace(
-                    public_id=order.order_number,
-                    items=email_items,
-                    delivery_type=order.delivery_type,
-                    delivery_address=delivery_address,
-                    tracking_url=tracking_url,  # ← NOW INCLUDES TRACKING URL
-                    pin_code=order.pin_code,    # ← ADD PIN CODE
-                )
-                totals_ns = SimpleNamespace(
-                    subtotal=totals['subtotal'],
-                    discount_amount=totals.get('discount_amount', 0),
-                    discount_code=totals.get('discount_code'),
-                    delivery_fee=totals.get('delivery_fee', 0),
-                    tax=totals.get('tax', 0),
-                    total=totals['total'],
-                )
-
-                ctx = {
-                    "customer_name": order.full_name or None,
-                    "order": order_ns,
-                    "totals": totals_ns,
-                    "now": datetime.utcnow,  # expose callable for {{ now().year }} in template
-                }
-
-                html_body = render_template("email_confirmation.html", **ctx)
-
-                subject = f"Order #{order.order_number} confirmed — {current_app.config.get('BRAND_NAME', 'LoveMeNow Miami')}"
-                send_email_sendlayer_console(order.full_name or "Customer", buyer_email, subject, html_body)
-                current_app.logger.info(f"✅ Confirmation email sent to {buyer_email}")
-        except Exception as e:
-            # Don't fail the order if email send has issues
-            current_app.logger.exception(f"❌ Failed to send order confirmation email: {e}")
-
-        # 6) Send Slack notification
-        try:
-            # Get order items for Slack (with full product objects)
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            slack_items = []
-            for item in order_items:
-                product = Product.query.get(item.product_id)
-                if product:
-                    slack_items.append({
-                        "product": product,
-                        "quantity": item.quantity
-                    })
-            
-            if slack_items:
-                success = send_order_notification(order, slack_items)
-                if success:
-                    current_app.logger.info(f"✅ Slack notification sent for order {order.order_number}")
-                else:
-                    current_app.logger.warning(f"⚠️ Slack notification may have failed for order {order.order_number}")
+            if manual_dispatch_required:
+                enqueue_manual_delivery_alert(order, manual_dispatch_reason or "Manual delivery required", manual_quote_id)
+            if hold_seconds:
+                release_notifications(held_notifications)
+            db.session.commit()
         except Exception as e:
-            # Don't fail the order if Slack send has issues
-            current_app.logger.exception(f"❌ Failed to send Slack notification: {e}")
-
-        if manual_dispatch_required:
-            try:
-                send_manual_delivery_alert(order, manual_dispatch_reason or "Manual delivery required", manual_quote_id)
-            except Exception as alert_err:
-                current_app.logger.error(f"Failed to send manual delivery alert: {alert_err}")
+            # The order's notifications are already committed; they go out when the hold expires
+            db.session.rollback()
+            current_app.logger.exception(f"❌ Failed to release order notifications: {e}")
 
         return jsonify({
             'success': True,
@@ -855,13 +836,10 @@ def discount_stats():
 # -------------------------
 @api_bp.route('/health')
 def health_check():
-    """Health check endpoint"""
-    try:
-        db.session.execute(text('SELECT 1'))
-        return jsonify({'status': 'healthy', 'database': 'connected'})
-    except Exception as e:
-        current_app.logger.error(f"Health check failed: {str(e)}")
-        return jsonify({'status': 'unhealthy', 'database': 'disconnected'}), 500
+    """Health check endpoint (background probe state; no query)"""
+    if database_available():
+        return jsonify({'status': 'healthy', 'database': 'connected', 'metrics': db_health_stats()})
+    return jsonify({'status': 'unhealthy', 'database': 'disconnected', 'metrics': db_health_stats()}), 500
 
 
 @api_bp.route('/orders/<int:order_id>/status', methods=['PUT'])
@@ -11,7 +11,7 @@ from flask import make_response
 from routes import db, bcrypt
 from models import User, UserAddress, AuditLog
 from security import validate_input, is_safe_url
-from email_utils import send_email_sendlayer
+from services.notification_outbox import enqueue_email
 
 
 auth_bp = Blueprint('auth', __name__)
@@ -189,6 +189,13 @@ def login():
                 flash('Invalid email or password', 'error')
                 return redirect(url_for('main.index'))
         
+        if not user.is_active:
+            if request.is_json:
+                return jsonify({'error': 'This account has been deactivated'}), 403
+            else:
+                flash('This account has been deactivated', 'error')
+                return redirect(url_for('main.index'))
+
         # Log the user in
         remember = data.get('remember', False)
         login_user(user, remember=remember)
@@ -465,35 +472,11 @@ def profile():
 def merge_guest_data(user):
     """Merge guest cart and wishlist data with user account"""
     try:
-        from models import Cart, Wishlist, Product
+        from models import Wishlist
+        from services.cart_store import merge_guest_cart, clear_guest_cart
         
-        # Merge cart data
-        guest_cart = session.get('cart', {})
-        for product_id_str, quantity in guest_cart.items():
-            try:
-                product_id = int(product_id_str)
-                product = Product.query.get(product_id)
-                
-                if product:  # Allow merging regardless of stock status
-                    existing_cart = Cart.query.filter_by(
-                        user_id=user.id, 
-                        product_id=product_id
-                    ).first()
-                    
-                    if existing_cart:
-                        existing_cart.quantity = min(
-                            existing_cart.quantity + quantity,
-                            product.quantity_on_hand
-                        )
-                    else:
-                        cart_item = Cart(
-                            user_id=user.id,
-                            product_id=product_id,
-                            quantity=min(quantity, product.quantity_on_hand)
-                        )
-                        db.session.add(cart_item)
-            except (ValueError, TypeError):
-                continue
+        # Merge cart data (bulk insert/update of the guest store's lines)
+        merge_guest_cart(user.id)
         
         # Merge wishlist data
         guest_wishlist = session.get('wishlist', [])
@@ -517,7 +500,7 @@ def merge_guest_data(user):
         db.session.commit()
         
         # Clear guest data
-        session.pop('cart', None)
+        clear_guest_cart()
         session.pop('wishlist', None)
         
     except Exception as e:
@@ -539,16 +522,18 @@ def send_welcome_email(user):
         <p>The LoveMeNow Team</p>
         """
 
-        result = send_email_sendlayer(
+        enqueue_email(
             user.full_name or user.email,
             user.email,
             subject,
             html_content
         )
-        current_app.logger.info(f"Welcome email queued/sent via SendLayer for {user.email}: {result}")
+        db.session.commit()
+        current_app.logger.info(f"Welcome email queued for {user.email}")
 
     except Exception as e:
-        current_app.logger.warning(f"Failed to send welcome email: {str(e)}")
+        db.session.rollback()
+        current_app.logger.warning(f"Failed to queue welcome email: {str(e)}")
 
 # Modal routes for backward compatibility
 @auth_bp.route('/login_modal', methods=['GET', 'POST'])
@@ -719,6 +704,8 @@ def verify_age():
                 current_user.age_verification_date = datetime.utcnow()
                 db.session.commit()
 
+            _log_age_verification('age_verification', 'success')
+
             # Build redirect response
             resp = make_response(redirect(next_page))
 
@@ -748,6 +735,7 @@ def verify_age():
             return resp
 
         # Not verified (under age path)
+        _log_age_verification('age_verification_denied', 'failed')
         return redirect('https://www.google.com')
 
     except Exception as e:
@@ -758,6 +746,20 @@ def verify_age():
 
 
 
+def _log_age_verification(action, status):
+    """Audit the age gate outcome (feeds the security dashboard counters)"""
+    try:
+        AuditLog.log_action(
+            action=action,
+            user_id=current_user.id if current_user.is_authenticated else None,
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get('User-Agent'),
+            status=status
+        )
+    except Exception as e:
+        current_app.logger.error(f"Failed to log age verification: {e}")
+
+
 def require_age_verification(f):
     """Decorator to require age verification for routes"""
     from functools import wraps
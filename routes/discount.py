@@ -3,11 +3,10 @@ from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
 
 from flask import Blueprint, jsonify, request, session
-from flask_login import current_user
-from sqlalchemy.orm import joinedload
 
 from routes import db
-from models import Product, Cart, DiscountCode  # ← use DiscountCode
+from models import DiscountCode
+from services.cart_hydration import cart_items
 
 discount_bp = Blueprint("discount", __name__)  # ← this blueprint is used everywhere in this file
 
@@ -19,40 +18,8 @@ def _round2(x) -> float:
     return float(Decimal(str(x)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
 
 
-def _get_cart_items():
-    """
-    Return list: {'product': Product, 'product_id': int, 'quantity': int}
-    Supports logged-in carts (DB) and guest carts (session['cart'])
-    """
-    items = []
-    if current_user.is_authenticated:
-        rows = (
-            Cart.query.options(joinedload(Cart.product))
-            .filter(Cart.user_id == current_user.id)
-            .all()
-        )
-        for r in rows:
-            if r.product:
-                items.append({
-                    "product": r.product,
-                    "product_id": r.product_id,
-                    "quantity": int(r.quantity or 0)
-                })
-    else:
-        raw = session.get("cart", {}) or {}
-        for cart_key, qty in raw.items():
-            try:
-                product_id = int(str(cart_key).split(":", 1)[0])
-            except Exception:
-                continue
-            p = Product.query.get(product_id)
-            if p:
-                items.append({"product": p, "product_id": p.id, "quantity": int(qty or 0)})
-    return items
-
-
 def _cart_subtotal() -> float:
-    items = _get_cart_items()
+    items = cart_items()
     return _round2(sum(float(it["product"].price) * it["quantity"] for it in items))
 
 
@@ -126,17 +93,17 @@ def discount_status():
     code = (sess_disc.get("code") or session.get("discount_code") or "").strip().upper()
 
     if not code:
-        return jsonify({"success": True, "has_discount": False, "applied": False, "state": "none", "cart_items": sum(i["quantity"] for i in _get_cart_items())})
+        return jsonify({"success": True, "has_discount": False, "applied": False, "state": "none", "cart_items": sum(i["quantity"] for i in cart_items())})
 
     dc = DiscountCode.query.filter(DiscountCode.code.ilike(code)).first()
     if not _code_is_valid(dc):
         # drop stale code
         session.pop("discount", None)
         session.pop("discount_code", None)
-        return jsonify({"success": True, "has_discount": False, "applied": False, "state": "none", "cart_items": sum(i["quantity"] for i in _get_cart_items())})
+        return jsonify({"success": True, "has_discount": False, "applied": False, "state": "none", "cart_items": sum(i["quantity"] for i in cart_items())})
 
     amount = _preview_discount(dc, subtotal)
-    state = "applied" if sum(i["quantity"] for i in _get_cart_items()) > 0 else "saved"
+    state = "applied" if sum(i["quantity"] for i in cart_items()) > 0 else "saved"
 
     return jsonify({
         "success": True,
@@ -147,7 +114,7 @@ def discount_status():
             "code": dc.code,
             "discount_amount": amount
         },
-        "cart_items": sum(i["quantity"] for i in _get_cart_items())
+        "cart_items": sum(i["quantity"] for i in cart_items())
     })
 
 
@@ -4,56 +4,41 @@ Main application routes
 from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, session, flash, \
     make_response
 from flask_login import current_user, login_required
-from sqlalchemy.orm import joinedload, selectinload, defer
-from sqlalchemy import func, desc
+from sqlalchemy.orm import joinedload, defer
 from sqlalchemy.exc import OperationalError, DisconnectionError
 import stripe
 import stripe.checkout
 
 from routes import db, csrf
 from routes.auth import require_age_verification
-from models import Product, ProductVariant, Category, Color, Wishlist, Cart, Order, OrderItem, UberDelivery, UserAddress
+from models import Product, ProductVariant, Category, Cart, Order, OrderItem, UberDelivery, UserAddress
 from security import validate_input
 from database_utils import retry_db_operation, test_database_connection, get_fallback_data
 from holiday_hours import get_today_closure_info
+from services.catalog_snapshot import get_catalog_snapshot, SnapshotPagination
+from services.search_index import get_search_index, words
+from services.cart_store import guest_cart, clear_guest_cart
+from services.cart_hydration import hydrate_cart
+from services.product_details import get_product_details
+from services.related_products import get_related_products
+from services.page_cache import cached_page, skip_page_cache, rendering_page_skeleton, page_cache_stats
+from services.db_health import database_available, db_health_stats, report_db_failure
+from services.audit_writer import audit_writer_stats
+from services.identity_cache import get_user_counts, invalidate_user_counts
 
 main_bp = Blueprint('main', __name__)
 
 
 def get_cached_user_counts():
-    """Get cached cart and wishlist counts for performance optimization"""
+    """Cart and wishlist counts; signed-in counts come from the per-worker identity cache"""
     if not current_user.is_authenticated:
-        # For guest users, get from session
-        cart_count = sum(session.get('cart', {}).values())
+        # For guest users, count the server-side guest cart
+        cart_count = guest_cart().count()
         wishlist_count = len(session.get('wishlist', []))
         return cart_count, wishlist_count
 
-    # Check if we have cached counts in session
-    cache_key = f'user_counts_{current_user.id}'
-    cached_counts = session.get(cache_key)
-
-    # Cache for 90 seconds for better performance
-    import time
-    current_time = time.time()
-
-    if cached_counts and (current_time - cached_counts.get('timestamp', 0)) < 90:
-        return cached_counts['cart_count'], cached_counts['wishlist_count']
-
-    # Optimized database queries
     try:
-        # Use more efficient queries with explicit scalar operations
-        cart_count = db.session.query(func.coalesce(func.sum(Cart.quantity), 0)).filter_by(
-            user_id=current_user.id).scalar()
-        wishlist_count = db.session.query(func.count(Wishlist.id)).filter_by(user_id=current_user.id).scalar()
-
-        # Cache the results with proper type conversion
-        session[cache_key] = {
-            'cart_count': int(cart_count or 0),
-            'wishlist_count': int(wishlist_count or 0),
-            'timestamp': current_time
-        }
-
-        return int(cart_count or 0), int(wishlist_count or 0)
+        return get_user_counts(current_user.id)
     except Exception as e:
         current_app.logger.error(f"Error getting user counts: {str(e)}")
         return 0, 0
@@ -62,28 +47,26 @@ def get_cached_user_counts():
 def invalidate_user_counts_cache():
     """Invalidate cached user counts when cart/wishlist changes"""
     if current_user.is_authenticated:
-        cache_key = f'user_counts_{current_user.id}'
-        session.pop(cache_key, None)
+        invalidate_user_counts(current_user.id)
 
 
 # Health check endpoint for Render
 @main_bp.route('/api/health')
 def health_check():
-    """Health check endpoint for deployment monitoring"""
-    try:
-        # Test database connection
-        db.session.execute(db.text('SELECT 1'))
-        return jsonify({
-            'status': 'healthy',
-            'database': 'connected',
-            'timestamp': db.func.now()
-        }), 200
-    except Exception as e:
-        return jsonify({
-            'status': 'unhealthy',
-            'database': 'disconnected',
-            'error': str(e)
-        }), 503
+    """
+    Health check endpoint for deployment monitoring. Reports the background
+    probe's view of the database rather than querying it, plus worker metrics.
+    """
+    connected = database_available()
+    return jsonify({
+        'status': 'healthy' if connected else 'unhealthy',
+        'database': 'connected' if connected else 'disconnected',
+        'metrics': {
+            'database': db_health_stats(),
+            'audit_writer': audit_writer_stats(),
+            'page_cache': page_cache_stats(),
+        },
+    }), 200 if connected else 503
 
 
 
@@ -97,6 +80,7 @@ def is_age_verified():
 
 
 @main_bp.route('/')
+@cached_page
 def index():
     """
     Home page with featured products.
@@ -109,6 +93,7 @@ def index():
         db_connected, db_message = test_database_connection()
         if not db_connected:
             current_app.logger.warning(f"DB down: {db_message}")
+            skip_page_cache()
             fb = get_fallback_data()
             resp = make_response(render_template(
                 "index.html",
@@ -144,7 +129,11 @@ def index():
         )
         categories = Category.query.filter(Category.parent_id.is_(None)).limit(8).all()
 
-        cart_count, wishlist_count = get_cached_user_counts()
+        # The shared copy carries no counts; the navbar fetches them client-side
+        if rendering_page_skeleton():
+            cart_count, wishlist_count = 0, 0
+        else:
+            cart_count, wishlist_count = get_cached_user_counts()
 
         # Use performance template if requested via query param
         template = "index_performance.html" if request.args.get('perf') else "index.html"
@@ -169,6 +158,8 @@ def index():
 
     except (OperationalError, DisconnectionError) as e:
         current_app.logger.error(f"DB error on home: {e}")
+        report_db_failure(e)
+        skip_page_cache()
         fb = get_fallback_data()
         resp = make_response(render_template(
             "index.html",
@@ -192,6 +183,7 @@ def index():
 
 
 @main_bp.route('/products')
+@cached_page
 def products():
     """Products listing page with filtering and pagination"""
     try:
@@ -204,122 +196,84 @@ def products():
         else:
             per_page = 48  # Default pagination for other categories
 
-        # Build query - show all products including out of stock
-        query = Product.query.filter(Product.in_active.is_(False))
-        
+        # Filter, sort and paginate against the in-process catalog snapshot;
+        # show all products including out of stock
+        snapshot = get_catalog_snapshot()
+        category_ids = None
+        exclude_category_ids = ()
+
         # Hide Sexual Enhancements (cat 59) from default "All Products" view
         # so Google Ads crawler doesn't flag for recreational drugs / supplements.
         # Products still visible when browsing the category directly.
         if not request.args.get('category') or request.args.get('category', '').lower() == 'all':
-            query = query.filter(Product.category_id != 59)
+            exclude_category_ids = (59,)
 
         # Apply filters
-        category_id = None
         category = None
         
-        # SPECIAL HANDLING for gender slugs (these are not database categories)
-        # These map to specific product category IDs
-        gender_mappings = {
-            'men': [34, 60, 35, 33, 55, 56, 57, 4, 11, 37, 53, 38, 51, 61, 62],
-            'women': [36, 39, 5, 33, 54, 1, 7, 10, 40, 50, 4, 55, 56, 57, 58, 11, 38, 61, 62]
-        }
-        
         if category_param:
-            # Check if it's a special gender slug first
-            if category_param in gender_mappings:
-                # Gender filter: map to product category IDs
-                all_category_ids = list(set(gender_mappings[category_param]))
-                query = query.filter(Product.category_id.in_(all_category_ids))
+            # Listing groups (men/women/gender) span categories outside the tree
+            group = snapshot.get_group(category_param)
+            if group:
+                group_name, category_ids = group
                 # Set category for display purposes
                 category = type('obj', (object,), {
                     'slug': category_param,
                     'id': None,
-                    'name': category_param.capitalize()
-                })()
-            elif category_param == 'gender':
-                # "All Gender" - show products from both men AND women
-                all_gender_ids = list(set(gender_mappings['men'] + gender_mappings['women']))
-                query = query.filter(Product.category_id.in_(all_gender_ids))
-                category = type('obj', (object,), {
-                    'slug': 'gender',
-                    'id': None,
-                    'name': 'Gender'
+                    'name': group_name
                 })()
             else:
-                # Try to parse as integer first (numeric category ID)
-                try:
-                    category_id = int(category_param)
-                    category = Category.query.get(category_id)
-                except (ValueError, TypeError):
-                    # If not an integer, try to find by slug
-                    category = Category.query.filter_by(slug=category_param).first()
-                
+                # Numeric category ID or slug
+                category = snapshot.get_category(category_param)
                 if category:
-                    def get_all_subcategory_ids(cat):
-                        ids = [cat.id]
-                        for child in cat.children:
-                            ids.extend(get_all_subcategory_ids(child))
-                        return ids
-
-                    all_category_ids = get_all_subcategory_ids(category)
-                    query = query.filter(Product.category_id.in_(all_category_ids))
+                    category_ids = snapshot.descendant_ids(category)
 
         color_id = request.args.get('color', type=int)
-        if color_id:
-            query = query.join(Product.colors).filter(Color.id == color_id)
-
         min_price = request.args.get('min_price', type=float)
-        if min_price:
-            query = query.filter(Product.price >= min_price)
-
         max_price = request.args.get('max_price', type=float)
-        if max_price:
-            query = query.filter(Product.price <= max_price)
 
         search = request.args.get('search', '').strip()
+        ranking = None
+        ranked = False
         if search:
             # Validate search input
             errors = validate_input({'search': search}, max_lengths={'search': 100})
-            if not errors:
-                query = query.filter(Product.name.contains(search))
+            if not errors and words(search):
+                index, _ = get_search_index()
+                ranking = dict(index.search(search))
+                ranked = True
+            elif not errors:
+                # Only stopwords or punctuation: match on the name, as the old LIKE did
+                needle = search.casefold()
+                ranking = {p.id: 0 for p in snapshot.products if needle in p.name_key}
 
         # In stock filter - check product-level inventory
         in_stock_only = request.args.get('in_stock', '').lower() == 'true'
-        if in_stock_only:
-            query = query.filter(
-                Product.in_stock == True,
-                Product.quantity_on_hand > 0
-            )
 
         # Brand filter (extract from product name)
         brand = request.args.get('brand', '').strip()
-        if brand:
-            query = query.filter(Product.name.ilike(f'{brand}%'))
 
-        # Apply sorting - Always prioritize in-stock products first
+        # Sorting always prioritizes in-stock products first; searches
+        # without an explicit sort are ordered by relevance
         sort_by = request.args.get('sort', 'name')
-        if sort_by == 'low-high':
-            query = query.order_by(Product.in_stock.desc(), Product.price.asc())
-        elif sort_by == 'high-low':
-            query = query.order_by(Product.in_stock.desc(), Product.price.desc())
-        elif sort_by == 'newest':
-            query = query.order_by(Product.in_stock.desc(), desc(Product.id))
-        else:
-            query = query.order_by(Product.in_stock.desc(), Product.name.asc())
-
-        # Paginate results with optimized query loading
-        # Use selectinload for collections (not joinedload) to avoid cartesian products
-        products = query.options(
-            selectinload(Product.variants).selectinload(ProductVariant.images),
-            selectinload(Product.colors)
-        ).paginate(
-            page=page, per_page=per_page, error_out=False
+        order_by = 'relevance' if ranked and 'sort' not in request.args else sort_by
+
+        matches = snapshot.filter_products(
+            category_ids=category_ids,
+            exclude_category_ids=exclude_category_ids,
+            color_id=color_id,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock_only=in_stock_only,
+            brand=brand,
+            sort_by=order_by,
+            ranking=ranking,
         )
+        products = SnapshotPagination(matches, page, per_page)
 
-        # Get filter options - only main categories (parent categories) with their children
-        # Query fresh each time - no session caching of models
-        categories = Category.query.filter(Category.parent_id.is_(None)).options(selectinload(Category.children)).all()
-        colors = Color.query.join(Color.products).distinct().all()
+        # Filter options - main categories with their children, and colors in use
+        categories = snapshot.root_categories
+        colors = snapshot.colors
 
         return render_template('products.html',
                                products=products,
@@ -342,339 +296,6 @@ def products():
         return render_template('errors/500.html'), 500
 
 
-def process_product_details(product):
-    """Process product data to extract the most important features, specifications, and dimensions"""
-    import re
-
-    # Check if this is a lubricant product
-    lubricant_categories = [4, 55, 56, 57]  # lubricant, water-based, oil-based, massage oil
-    is_lubricant = product.category_id in lubricant_categories
-
-    def smart_shorten_text(text, max_length=35):
-        """Intelligently shorten text by summarizing instead of just truncating"""
-        if len(text) <= max_length:
-            return text
-
-        # If it has a colon, preserve the key and create a meaningful summary
-        if ':' in text:
-            key, value = text.split(':', 1)
-            key = key.strip()
-            value = value.strip()
-
-            # Special handling for lubricants - avoid "waterproof" and focus on relevant info
-            if is_lubricant:
-                if 'water resistance' in key.lower() or 'waterproof' in key.lower():
-                    # For lubricants, show formula type instead of water resistance
-                    if 'not water resistant' in value.lower():
-                        return f"{key}: Formula-based"
-                    else:
-                        return f"{key}: Specialty formula"
-                elif 'type' in key.lower():
-                    # Show lubricant type clearly
-                    if 'water' in value.lower():
-                        return f"{key}: Water-based"
-                    elif 'silicone' in value.lower():
-                        return f"{key}: Silicone-based"
-                    elif 'hybrid' in value.lower():
-                        return f"{key}: Hybrid formula"
-                    elif 'oil' in value.lower():
-                        return f"{key}: Oil-based"
-                    else:
-                        return f"{key}: {value[:15]}"
-                elif 'size' in key.lower() or 'fluid' in key.lower():
-                    return f"{key}: {value}"
-                elif 'collection' in key.lower() or 'category' in key.lower():
-                    # Simplify collection/category info
-                    if 'lubricant' in value.lower():
-                        return f"{key}: Premium line"
-                    else:
-                        return f"{key}: {value[:15]}"
-
-            # Create intelligent summaries based on content (for non-lubricants)
-            if 'dual-density' in key.lower():
-                return "Dual-density construction"
-            elif 'material' in value.lower():
-                # Extract material type
-                if 'silicone' in value.lower():
-                    return f"{key}: Silicone"
-                elif 'tpe' in value.lower() or 'elastomer' in value.lower():
-                    return f"{key}: TPE elastomer"
-                else:
-                    return f"{key}: Premium material"
-            elif 'soft' in value.lower() and 'firm' in value.lower():
-                return f"{key}: Soft & firm design"
-            elif not is_lubricant and ('waterproof' in value.lower() or 'water' in value.lower()):
-                return f"{key}: Waterproof"
-            elif 'rechargeable' in value.lower() or 'usb' in value.lower():
-                return f"{key}: USB rechargeable"
-            else:
-                # Keep key and first meaningful words
-                words = [w for w in value.split() if len(w) > 2]
-                if len(words) >= 2:
-                    return f"{key}: {' '.join(words[:2])}"
-                else:
-                    return f"{key}: {value[:15]}"
-        else:
-            # For regular text without colon, create meaningful summaries
-            text_lower = text.lower()
-            if 'dual-density' in text_lower:
-                return "Dual-density design"
-            elif 'soft' in text_lower and 'firm' in text_lower:
-                return "Soft exterior, firm core"
-            elif not is_lubricant and 'waterproof' in text_lower:
-                return "Waterproof design"
-            elif 'rechargeable' in text_lower:
-                return "Rechargeable battery"
-            elif 'silicone' in text_lower:
-                return "Premium silicone material"
-            else:
-                # Keep first meaningful words
-                words = [w for w in text.split() if len(w) > 2]
-                if len(words) >= 3:
-                    return ' '.join(words[:3])
-                elif len(words) >= 2:
-                    return ' '.join(words[:2])
-                else:
-                    return text[:max_length]
-
-    # Process Features (prefer DB field, fall back to computed from description)
-    features = []
-    # If DB-backed features provided, split into a clean list (supports newline or semicolon-separated)
-    if getattr(product, 'features', None) and product.features and product.features.strip():
-        parts = re.split(r'[\n;]+', product.features)
-        features = [p.strip() for p in parts if p and p.strip()]
-    elif product.description:
-        desc_text = product.description.lower()
-
-        # Different feature keywords for lubricants vs other products
-        if is_lubricant:
-            # Lubricant-specific features - focus on formula, safety, and benefits
-            feature_keywords = {
-                'long-lasting': 'Long-Lasting Formula',
-                'glycerin-free': 'Glycerin-Free',
-                'paraben-free': 'Paraben-Free',
-                'toy-safe': 'Toy-Safe',
-                'latex-safe': 'Latex Compatible',
-                'water-based': 'Water-Based Formula',
-                'silicone-based': 'Silicone-Based',
-                'hybrid': 'Hybrid Formula',
-                'oil-based': 'Oil-Based',
-                'natural': 'Natural Ingredients',
-                'flavored': 'Flavored',
-                'warming': 'Warming Sensation',
-                'cooling': 'Cooling Effect',
-                'edible': 'Edible Formula',
-                'massage': 'Massage Oil',
-                'premium': 'Premium Quality',
-                'smooth': 'Smooth Glide',
-                'slippery': 'Silky Feel',
-                'non-sticky': 'Non-Sticky',
-                'easy cleanup': 'Easy Cleanup',
-                'body-safe': 'Body-Safe',
-                'usa': 'Made in USA'
-            }
-        else:
-            # Standard features for non-lubricant products
-            feature_keywords = {
-                'rechargeable': 'USB Rechargeable',
-                'waterproof': 'Waterproof Design',
-                'quiet': 'Quiet Operation',
-                'body-safe': 'Body-Safe Materials',
-                'silicone': 'Premium Silicone',
-                'multiple': 'Multiple Settings',
-                'remote': 'Remote Control',
-                'suction': 'Suction Cup Base',
-                'harness': 'Harness Compatible',
-                'flexible': 'Flexible Design',
-                'realistic': 'Lifelike Feel',
-                'textured': 'Textured Surface',
-                'vibrating': 'Vibrating Function',
-                'adjustable': 'Adjustable Fit',
-                'beginner': 'Beginner Friendly',
-                'comfortable': 'Comfortable Fit',
-                'elegant': 'Elegant Design',
-                'beautiful': 'Beautiful Aesthetics',
-                'soft': 'Soft Touch',
-                'silk': 'Silk Material',
-                'metal': 'Metal Accents',
-                'lined': 'Lined Interior',
-                'wire': 'Structured Support',
-                'light': 'Light Control',
-                'senses': 'Sensory Enhancement'
-            }
-
-        for keyword, feature in feature_keywords.items():
-            if keyword in desc_text and feature not in features:
-                features.append(feature)
-                if len(features) >= 4:
-                    break
-
-        # Extract key phrases from description if we don't have enough features
-        if len(features) < 4:
-            # Look for descriptive phrases that could be features
-            desc_sentences = product.description.split('.')
-            for sentence in desc_sentences:
-                sentence = sentence.strip()
-                if sentence and len(sentence) < 50:  # Keep it concise
-                    # Clean up the sentence to make it feature-like
-                    if 'allow' in sentence.lower():
-                        feature = sentence.replace('allow women to', '').replace('allows', '').strip()
-                        if feature and len(feature) < 40:
-                            features.append(feature.capitalize())
-                    elif any(word in sentence.lower() for word in ['made from', 'material', 'fabric']):
-                        features.append(sentence.strip().capitalize())
-                    elif any(word in sentence.lower() for word in ['comfortable', 'elegant', 'beautiful', 'soft']):
-                        features.append(sentence.strip().capitalize())
-
-                    if len(features) >= 4:
-                        break
-
-        # If we still don't have enough features, add some generic ones
-        if len(features) < 4:
-            if is_lubricant:
-                # Lubricant-specific generic features
-                generic_features = ['Premium Formula', 'Body-Safe', 'Easy Application', 'Discreet Packaging']
-            else:
-                # Standard generic features
-                generic_features = ['Premium Quality', 'Easy to Clean', 'Discreet Packaging', 'Body-Safe Design']
-
-            for feature in generic_features:
-                if feature not in features:
-                    features.append(feature)
-                    if len(features) >= 4:
-                        break
-
-    # Check if material is already mentioned in features
-    material_in_features = any(
-        'material' in feature.lower() or 'silicone' in feature.lower() or 'tpe' in feature.lower()
-        for feature in (features if features else []))
-
-    # Check if this is a dildo product (category ID 33)
-    is_dildo_product = product.category_id == 33
-
-    # Process Specifications
-    specs = []
-    dimensions_keywords = ['insertable', 'length', 'width', 'height', 'diameter', 'weight', 'total']
-
-    if product.specifications:
-        spec_lines = product.specifications.split('\n')
-
-        # Priority specifications - NEVER include dimensions in specs for ANY product
-        if is_lubricant:
-            # Lubricant-specific priority specs - avoid "Water Resistance" which is misleading
-            priority_specs = ['Type:', 'Brand:', 'Size:', 'Collection:', 'Category:', 'Manufacturer:']
-        else:
-            # Standard priority specs for other products
-            priority_specs = ['Brand:', 'Power:', 'Water Resistance:', 'Collection:', 'Color:', 'Warranty:']
-
-        # Don't add material to specs if it's already in features
-        if not material_in_features:
-            priority_specs.insert(1, 'Material:')
-
-        for line in spec_lines:
-            line = line.strip()
-            if line and any(priority in line for priority in priority_specs):
-                # ALWAYS skip ALL dimensions for ALL products (including width for dildos)
-                if any(dim_word in line.lower() for dim_word in dimensions_keywords):
-                    continue
-
-                # Skip material if it's already mentioned in features
-                if material_in_features and line.lower().startswith('material:'):
-                    continue
-
-                # Clean up the line and keep it concise using smart shortening
-                specs.append(smart_shorten_text(line, 35))
-
-                if len(specs) >= 4:
-                    break
-
-        # If we don't have enough specs, add remaining non-dimension lines
-        if len(specs) < 4:
-            for line in spec_lines:
-                line = line.strip()
-                if (line and line not in specs and
-                        not any(spec.split(':')[0].strip() == line.split(':')[0].strip() for spec in specs if
-                                ':' in spec and ':' in line)):
-
-                    # NEVER allow dimensions in specs for ANY product
-                    if not any(dim_word in line.lower() for dim_word in dimensions_keywords):
-                        # Skip material if already in features
-                        if material_in_features and line.lower().startswith('material:'):
-                            continue
-                        specs.append(smart_shorten_text(line, 35))
-
-                    if len(specs) >= 4:
-                        break
-
-    # Process Dimensions - Extract ALL dimensional data from specifications first
-    dims = []
-
-    if product.specifications:
-        spec_lines = product.specifications.split('\n')
-        dimension_patterns = [
-            r'Insertable.*?:\s*([^;,\n]+)',
-            r'Total.*?length:\s*([^;,\n]+)',
-            r'Length:\s*([^;,\n]+)',
-            r'Width:\s*([^;,\n]+)',
-            r'Diameter:\s*([^;,\n]+)',
-            r'Height:\s*([^;,\n]+)',
-            r'Weight:\s*([^;,\n]+)'
-        ]
-
-        for line in spec_lines:
-            line = line.strip()
-            for pattern in dimension_patterns:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match and len(dims) < 4:
-                    dim_value = match.group(0).strip()
-                    # Avoid duplicates by checking if similar dimension already exists
-                    is_duplicate = False
-                    for existing_dim in dims:
-                        if (dim_value.lower().replace(' ', '') in existing_dim.lower().replace(' ', '') or
-                                existing_dim.lower().replace(' ', '') in dim_value.lower().replace(' ', '')):
-                            is_duplicate = True
-                            break
-                    if not is_duplicate:
-                        dims.append(dim_value)
-
-    # Then check dimensions field for additional info
-    if product.dimensions and len(dims) < 4:
-        dim_text = product.dimensions
-
-        # If dimensions field contains descriptive text, intelligently shorten it
-        separators = ['\n\n', '\n', ';', ',']
-        for sep in separators:
-            if sep in dim_text:
-                parts = dim_text.split(sep)
-                for part in parts:
-                    part = part.strip()
-                    if part and len(dims) < 4:
-                        dims.append(smart_shorten_text(part, 35))
-                break
-
-        # If still no dimensions from descriptive text, use the whole string (but shorten intelligently)
-        if len(dims) < 4 and not any(sep in dim_text for sep in separators) and dim_text.strip():
-            dims.append(smart_shorten_text(dim_text.strip(), 35))
-
-    # Ensure we have exactly 4 items in each list (or whatever is available)
-    if is_lubricant:
-        # Lubricant-specific defaults
-        features = features[:4] if features else ['Premium Formula', 'Body-Safe', 'Easy Application',
-                                                  'Discreet Packaging']
-        specs = specs[:4] if specs else ['Professional Grade', 'Quality Formula', 'Tested & Certified',
-                                         'Satisfaction Guaranteed']
-        dims = dims[:4] if dims else ['Standard Size', 'Portable Design', 'Easy Storage', 'Travel Friendly']
-    else:
-        # Standard defaults for other products
-        features = features[:4] if features else ['Premium Quality', 'Body-Safe Design', 'Easy to Clean',
-                                                  'Discreet Packaging']
-        specs = specs[:4] if specs else ['Professional Grade', 'Quality Assured', 'Manufacturer Warranty',
-                                         'Tested & Certified']
-        dims = dims[:4] if dims else ['Standard Size', 'Ergonomic Design', 'Lightweight', 'Compact Storage']
-
-    return features, specs, dims
-
-
 @main_bp.route('/product/<int:product_id>')
 def product_detail(product_id):
     """Product detail page"""
@@ -690,18 +311,11 @@ def product_detail(product_id):
             .first_or_404()
         )
 
-        # Process product details to extract features, specs, and dimensions
-        features, specs, dims = process_product_details(product)
+        # Features, specs and dimensions, precomputed per content hash
+        features, specs, dims = get_product_details(product)
 
-        # Get related products from same category that are in stock
-        related_products = (
-            Product.query
-            .filter(Product.category_id == product.category_id)
-            .filter(Product.id != product_id)
-            .filter(Product.in_stock == True, Product.quantity_on_hand > 0, Product.in_active.is_(False))
-            .limit(4)
-            .all()
-        )
+        # Related products from the in-memory index, filtered for stock at read time
+        related_products = get_related_products(product.id, limit=4)
 
         return render_template('product_detail.html',
                                product=product,
@@ -888,36 +502,12 @@ def checkout():
     """Enhanced checkout page with Uber Direct integration"""
     # Simple checkout - no complex redirect logic
 
-    # Check if cart has items
-    cart_items = []
-    if current_user.is_authenticated:
-        # Get cart from database for logged-in users
-        cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-        current_app.logger.info(f"Authenticated user cart items: {len(cart_items)}")
-    else:
-        # Get cart from session for guest users
-        cart_data = session.get('cart', {})
-        current_app.logger.info(f"Guest user cart data: {cart_data}")
-        if cart_data:
-            for cart_key, quantity in cart_data.items():
-                try:
-                    # Handle both formats: "product_id" and "product_id:variant_id"
-                    if ':' in str(cart_key):
-                        product_id = int(cart_key.split(':')[0])
-                    else:
-                        product_id = int(cart_key)
-
-                    product = Product.query.get(product_id)
-                    if product:
-                        cart_items.append({
-                            'product': product,
-                            'quantity': quantity
-                        })
-                except (ValueError, TypeError):
-                    continue
+    # One pass over the cart: lines, products, variants, images and stock
+    cart_lines = hydrate_cart()
+    current_app.logger.info(f"Checkout cart lines: {len(cart_lines)}")
 
     # If cart is empty, redirect to cart page - simple and predictable
-    if not cart_items:
+    if not cart_lines:
         current_app.logger.warning("Cart is empty, redirecting to cart page")
         return redirect(url_for('main.cart_page'))
 
@@ -929,117 +519,13 @@ def checkout():
 
     # Prepare cart data for template
     cart_data = {
-        'items': [],
-        'subtotal': 0,
+        'items': [line.as_item() for line in cart_lines],
+        'subtotal': sum(line.item_total for line in cart_lines),
         'shipping': 0,
         'total': 0,
         'count': 0
     }
 
-    if current_user.is_authenticated:
-        # Get cart from database for logged-in users
-        cart_items_db = (
-            db.session.query(Cart, Product)
-            .join(Product)
-            .filter(Cart.user_id == current_user.id)
-            .options(joinedload(Cart.product))
-            .all()
-        )
-
-        for cart_item, product in cart_items_db:
-            quantity = int(cart_item.quantity or 0)
-            if quantity <= 0:
-                continue
-            item_total = float(product.price) * quantity
-            cart_data['subtotal'] += item_total
-
-            variant = cart_item.variant if cart_item.variant_id else None
-            variant_color = variant.color.name if variant and variant.color else None
-            variant_name = variant.variant_name if variant else None
-            display_name = product.variant_display_name(variant=variant) if variant else product.name
-
-            cart_data['items'].append({
-                'id': product.id,
-                'variant_id': cart_item.variant_id,
-                'name': display_name,
-                'price': float(product.price),
-                'quantity': quantity,
-                'image_url': product.main_image_url,
-                'description': product.description or '',
-                'in_stock': product.is_available,
-                'max_quantity': product.quantity_on_hand,
-                'item_total': item_total,
-                'variant_color': variant_color,
-                'variant_name': variant_name,
-                'variant_label': variant_color or variant_name
-            })
-    else:
-        cart_session = session.get('cart', {})
-        if cart_session:
-            cart_entries = []
-            product_ids = set()
-            for cart_key, cart_quantity in cart_session.items():
-                try:
-                    key_str = str(cart_key)
-                    if ':' in key_str:
-                        product_part, variant_part = key_str.split(':', 1)
-                    else:
-                        product_part, variant_part = key_str, None
-                    product_id = int(product_part)
-                    variant_id = None
-                    if variant_part not in (None, '', 'None', 'null'):
-                        variant_id = int(variant_part)
-                    quantity = int(cart_quantity or 0)
-                except (ValueError, TypeError):
-                    continue
-                if quantity <= 0:
-                    continue
-                cart_entries.append((product_id, variant_id, quantity))
-                product_ids.add(product_id)
-
-            if cart_entries:
-                cart_products = (
-                    Product.query
-                    .filter(Product.id.in_(list(product_ids)))
-                    .options(joinedload(Product.variants).joinedload(ProductVariant.color))
-                    .all()
-                )
-                product_lookup = {p.id: p for p in cart_products}
-
-                for product_id, variant_id, quantity in cart_entries:
-                    product = product_lookup.get(product_id)
-                    if not product:
-                        continue
-
-                    variant = None
-                    variant_color = None
-                    variant_name = None
-                    if variant_id:
-                        variant = next((v for v in product.variants if v.id == variant_id), None)
-                        if variant:
-                            variant_color = variant.color.name if variant.color else None
-                            variant_name = variant.variant_name
-
-                    display_name = product.variant_display_name(variant=variant) if variant else product.name
-                    item_total = float(product.price) * quantity
-                    cart_data['subtotal'] += item_total
-
-                    cart_data['items'].append({
-                        'id': product.id,
-                        'variant_id': variant_id,
-                        'name': display_name,
-                        'price': float(product.price),
-                        'quantity': quantity,
-                        'image_url': product.main_image_url,
-                        'description': product.description or '',
-                        'in_stock': product.is_available,
-                        'max_quantity': product.quantity_on_hand,
-                        'item_total': item_total,
-                        'variant_color': variant_color,
-                        'variant_name': variant_name,
-                        'variant_label': variant_color or variant_name
-                    })
-
     # Calculate shipping - will be determined at checkout based on delivery method
     cart_data['shipping'] = 0
     cart_data['total'] = cart_data['subtotal'] + cart_data['shipping']
@@ -1416,7 +902,7 @@ def checkout_return():
                 Cart.query.filter_by(user_id=current_user.id).delete()
                 db.session.commit()
             else:
-                session.pop('cart', None)
+                clear_guest_cart()
 
             return render_template('checkout_success.html',
                                    session_id=session_id,
@@ -1487,44 +973,9 @@ def user_profile():
 def checkout_test():
     """Test Stripe Embedded Checkout"""
     # Get cart data (same logic as regular checkout)
-    cart_items = []
-    if current_user.is_authenticated:
-        cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-    else:
-        cart_data = session.get('cart', {})
-        if cart_data:
-            for cart_key, quantity in cart_data.items():
-                try:
-                    if ':' in str(cart_key):
-                        product_id = int(cart_key.split(':')[0])
-                    else:
-                        product_id = int(cart_key)
-
-                    product = Product.query.get(product_id)
-                    if product:
-                        cart_items.append({
-                            'product': product,
-                            'quantity': quantity
-                        })
-                except (ValueError, TypeError):
-                    continue
-
-    # Calculate totals
-    subtotal = 0
-    items = []
-    for item in cart_items:
-        if hasattr(item, 'product'):
-            product = item.product
-            quantity = item.quantity
-        else:
-            product = item['product']
-            quantity = item['quantity']
-
-        subtotal += product.price * quantity
-        items.append({
-            'product': product,
-            'quantity': quantity
-        })
+    cart_lines = hydrate_cart()
+    subtotal = sum(line.product.price * line.quantity for line in cart_lines)
+    items = [{'product': line.product, 'quantity': line.quantity} for line in cart_lines]
 
     cart_data = {
         'items': items,
@@ -1549,52 +1000,23 @@ def create_checkout_session_embedded():
 
         stripe.api_key = stripe_secret_key
 
-        # Get cart data (same logic as regular checkout)
-        cart_items = []
-        if current_user.is_authenticated:
-            cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-        else:
-            # Handle session cart
-            cart_data = session.get('cart', {})
-            if cart_data:
-                for cart_key, quantity in cart_data.items():
-                    try:
-                        if ':' in str(cart_key):
-                            product_id = int(cart_key.split(':')[0])
-                        else:
-                            product_id = int(cart_key)
-
-                        product = Product.query.get(product_id)
-                        if product:
-                            cart_items.append({
-                                'product': product,
-                                'quantity': quantity
-                            })
-                    except (ValueError, TypeError):
-                        continue
-
-        # Create line items from cart
+        # Create line items from cart (same logic as regular checkout)
         line_items = []
-        if cart_items:
-            for item in cart_items:
-                if hasattr(item, 'product'):
-                    product = item.product
-                    quantity = item.quantity
-                else:
-                    product = item['product']
-                    quantity = item['quantity']
-
-                line_items.append({
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': product.name,
-                            'description': product.description[:100] if product.description else '',
-                        },
-                        'unit_amount': int(product.price * 100),
+        for line in hydrate_cart():
+            product = line.product
+            quantity = line.quantity
+
+            line_items.append({
+                'price_data': {
+                    'currency': 'usd',
+                    'product_data': {
+                        'name': product.name,
+                        'description': product.description[:100] if product.description else '',
                     },
-                    'quantity': quantity,
-                })
+                    'unit_amount': int(product.price * 100),
+                },
+                'quantity': quantity,
+            })
 
         # If no cart items, create test item
         if not line_items:
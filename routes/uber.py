@@ -4,7 +4,7 @@ Uber Direct integration routes
 import json
 import logging
 from datetime import datetime
-from flask import Blueprint, request, jsonify, current_app, session
+from flask import Blueprint, request, jsonify, current_app
 from flask_login import current_user
 
 from routes import db
@@ -14,6 +14,7 @@ from uber_service import (
     format_address_for_uber, create_manifest_items, calculate_distance, 
     geocode_address, get_driving_distance, get_hybrid_delivery_quote
 )
+from services.geo_cache import NAMESPACE_QUOTE, address_key, cache_get, cache_set, quote_ttl
 
 uber_bp = Blueprint('uber', __name__)
 logger = logging.getLogger(__name__)
@@ -116,16 +117,12 @@ def get_delivery_quote():
             logger.error(f"❌ Quote request missing delivery_address field")
             return jsonify({'error': 'Missing delivery_address'}), 400
         
-        # Cache check
-        address_key = f"{data['delivery_address'].get('address', '').strip().lower()}-{data['delivery_address'].get('city', '').strip().lower()}-{data['delivery_address'].get('zip', '').strip()}"
-        cache_key = f"quote_cache_{hash(address_key)}"
-        
-        if cache_key in session:
-            cached_quote = session[cache_key]
-            cache_time = datetime.fromisoformat(cached_quote['timestamp'])
-            if (datetime.now() - cache_time).total_seconds() < 300:
-                logger.info(f"⚡ Returning cached quote for: {address_key} (age: {(datetime.now() - cache_time).total_seconds():.0f}s)")
-                return jsonify({'success': True, 'quote': cached_quote['quote']})
+        # Shared quote cache, keyed by a stable digest of the normalized address
+        quote_key = address_key(data['delivery_address'])
+        cached_quote = cache_get(NAMESPACE_QUOTE, quote_key)
+        if cached_quote:
+            logger.info(f"⚡ Returning cached quote for: {quote_key}")
+            return jsonify({'success': True, 'quote': cached_quote})
         
         # Initial area check
         is_valid, error_msg = is_in_delivery_area(data['delivery_address'])
@@ -174,10 +171,7 @@ def get_delivery_quote():
         logger.info(f"✅ Quote generated: ${quote_data['fee_dollars']:.2f} via {quote_data['source']}")
         
         # Cache and return
-        session[cache_key] = {
-            'quote': quote_data,
-            'timestamp': datetime.now().isoformat()
-        }
+        cache_set(NAMESPACE_QUOTE, quote_key, quote_data, ttl=quote_ttl(quote_data))
         
         return jsonify({'success': True, 'quote': quote_data})
         
@@ -264,9 +258,9 @@ def create_delivery():
         if quote_id.startswith('manual_'):
             logger.info(f"Manual dispatch requested for order {order_id} (Quote: {quote_id})")
             
-            # Send Slack alert for manual dispatch
-            from services.slack_notifications import send_manual_delivery_alert
-            send_manual_delivery_alert(order, reason="Long distance delivery (>10 miles) or Uber API unavailable", quote_id=quote_id)
+            # Queue the Slack alert for manual dispatch; it commits with the delivery record below
+            from services.notification_outbox import enqueue_manual_delivery_alert
+            enqueue_manual_delivery_alert(order, reason="Long distance delivery (>10 miles) or Uber API unavailable", quote_id=quote_id)
             
             # Create a "manual" delivery record in database
             uber_delivery = UberDelivery(
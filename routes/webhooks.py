@@ -12,15 +12,21 @@ from types import SimpleNamespace
 
 from routes import db
 from models import Product, Cart, Order, OrderItem, User, UberDelivery
-from flask import session as flask_session
-from services.slack_notifications import send_order_notification, send_manual_delivery_alert
+from services.notification_outbox import enqueue_order_notification, enqueue_delivery_notification
+from services.cart_store import clear_guest_cart
+from services.inventory import StockAlreadyCommitted, commit_order_stock
+from services.stripe_events import (
+    STATUS_IGNORED, STATUS_PROCESSED, process_event_inline, record_event, stripe_event_worker_running,
+)
 
 webhooks_bp = Blueprint('webhooks', __name__)
 
-def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_details=None):
+def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_details=None, commit=True):
     """
     Unified fulfillment logic for both frontend API and Webhooks.
     Ensures idempotency and proper order creation/Uber/Slack.
+    With commit=False the order is only flushed, so the Stripe event ledger
+    can commit it together with the event's processed mark.
     """
     try:
         # 1. Idempotency check: Does this order already exist?
@@ -37,15 +43,27 @@ def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_deta
         for i in range(item_count):
             pid = metadata.get(f'item_{i}_product_id')
             qty = int(metadata.get(f'item_{i}_quantity', 0))
+            vid = metadata.get(f'item_{i}_variant_id')
             if pid and qty > 0:
                 product = Product.query.get(int(pid))
                 if product:
-                    cart_items.append({'product': product, 'quantity': qty})
+                    cart_items.append({'product': product, 'variant_id': int(vid) if vid else None, 'quantity': qty})
 
         if not cart_items:
             current_app.logger.error(f"No items found in metadata for PI {payment_intent_id}")
             return False, None
 
+        # Take the stock first: a parallel delivery of this PI (or the client's
+        # create-order call) waits here and then sees StockAlreadyCommitted
+        try:
+            commit_order_stock(payment_intent_id, cart_items, allow_oversell=True,
+                               reservation_key=metadata.get('reservation_key'))
+        except StockAlreadyCommitted:
+            db.session.rollback()
+            existing_order = Order.query.filter_by(stripe_session_id=payment_intent_id).first()
+            current_app.logger.info(f"PI {payment_intent_id} was fulfilled concurrently")
+            return existing_order is not None, existing_order
+
         # 3. Create Order record
         delivery_type = metadata.get('delivery_type', 'pickup')
         user_id_str = metadata.get('user_id', 'guest')
@@ -99,7 +117,7 @@ def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_deta
         db.session.add(order)
         db.session.flush()
 
-        # 4. Create items and update inventory
+        # 4. Create items (stock was taken above)
         for item in cart_items:
             prod = item['product']
             qty = item['quantity']
@@ -113,19 +131,20 @@ def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_deta
                 total=float(prod.price) * qty
             ))
 
-            # Decrement stock
-            if (prod.quantity_on_hand or 0) >= qty:
-                prod.quantity_on_hand -= qty
-                if prod.quantity_on_hand <= 0:
-                    prod.in_stock = False
-            else:
-                prod.quantity_on_hand = 0
-                prod.in_stock = False
+        # Guest carts live server-side, so the webhook can clear them by token
+        if metadata.get('cart_token'):
+            clear_guest_cart(metadata['cart_token'], commit=False)
 
-        db.session.commit()
+        # 5. Slack Notification, queued in the same transaction as the order
+        enqueue_order_notification(order, cart_items)
+
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
         current_app.logger.info(f"✅ Order {order.order_number} fulfilled via webhook/recovery")
 
-        # 5. Handle Uber if needed
+        # 6. Handle Uber if needed
         if delivery_type == 'delivery':
             try:
                 from uber_service import uber_service, create_manifest_items, format_address_for_uber, get_miami_store_address, get_miami_store_coordinates, is_store_open
@@ -139,12 +158,6 @@ def fulfill_order(payment_intent_id, metadata, customer_info=None, shipping_deta
             except Exception as e:
                 current_app.logger.error(f"Error checking Uber in fulfillment: {e}")
 
-        # 6. Slack Notification
-        try:
-            send_order_notification(order, cart_items)
-        except Exception as e:
-            current_app.logger.error(f"Slack fail in fulfillment: {e}")
-
         return True, order
 
     except Exception as e:
@@ -173,46 +186,23 @@ def stripe_webhook():
             current_app.logger.info("Development mode: Skipping webhook signature verification")
             event = json.loads(payload)
         
-        current_app.logger.info(f"Received Stripe webhook: {event['type']}")
-        
-        # Handle the event
-        if event['type'] == 'checkout.session.completed':
-            session_obj = event['data']['object']
-            current_app.logger.info(f"Payment successful for session: {session_obj['id']}")
-            
-            # Process the successful payment (legacy support for Sessions)
-            success = process_successful_payment(session_obj)
-            if not success:
-                current_app.logger.error(f"Failed to process payment for session: {session_obj['id']}")
-                return jsonify({'error': 'Failed to process payment'}), 500
-                
-        elif event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            current_app.logger.info(f"Payment intent succeeded: {payment_intent['id']}")
-            
-            # Use unified fulfillment logic (Fix for Zombie Payments)
-            # Reconstruct customer info from PI
-            customer_info = {
-                'email': payment_intent.get('receipt_email'),
-                'name': payment_intent.get('shipping', {}).get('name') or 'Stripe Customer',
-                'phone': payment_intent.get('shipping', {}).get('phone') or 'N/A'
-            }
-            shipping_details = payment_intent.get('shipping') or {}
-            
-            success, order = fulfill_order(
-                payment_intent_id=payment_intent['id'],
-                metadata=payment_intent.get('metadata', {}),
-                customer_info=customer_info,
-                shipping_details=shipping_details
-            )
-            
-            if not success:
-                current_app.logger.error(f"Failed to process fulfillment for payment intent: {payment_intent['id']}")
-                return jsonify({'error': 'Fulfillment failed'}), 500
-            
-        else:
-            current_app.logger.info(f"Unhandled event type: {event['type']}")
-        
+        current_app.logger.info(f"Received Stripe webhook: {event['type']} ({event['id']})")
+
+        # Acknowledge as soon as the event is durable; the ledger worker
+        # processes it (in order per PaymentIntent) outside the request
+        if not record_event(event, payload):
+            current_app.logger.info(f"Duplicate Stripe event {event['id']}, already recorded")
+            if stripe_event_worker_running():
+                return jsonify({'status': 'duplicate'})
+
+        if not stripe_event_worker_running():
+            # No worker in this process (tests, local dev): process inline, and
+            # let Stripe retry if it fails
+            status = process_event_inline(event['id'])
+            if status not in (STATUS_PROCESSED, STATUS_IGNORED):
+                current_app.logger.error(f"Failed to process Stripe event {event['id']} ({status})")
+                return jsonify({'error': 'Event processing failed'}), 500
+
         return jsonify({'status': 'success'})
         
     except ValueError as e:
@@ -225,8 +215,8 @@ def stripe_webhook():
         current_app.logger.error(f"Webhook error: {str(e)}")
         return jsonify({'error': 'Webhook processing failed'}), 500
 
-def process_successful_payment(stripe_session):
-    """Process a successful payment and update inventory"""
+def process_successful_payment(stripe_session, commit=True):
+    """Process a successful payment and update inventory (flush only when commit=False)"""
     try:
         session_id = stripe_session['id']
         customer_email = stripe_session.get('customer_details', {}).get('email', '')
@@ -251,12 +241,14 @@ def process_successful_payment(stripe_session):
         for i in range(item_count):
             product_id = metadata.get(f'item_{i}_product_id')
             quantity = metadata.get(f'item_{i}_quantity')
+            variant_id = metadata.get(f'item_{i}_variant_id')
             
             if product_id and quantity:
                 product = Product.query.get(int(product_id))
                 if product:
                     cart_items.append({
                         'product': product,
+                        'variant_id': int(variant_id) if variant_id else None,
                         'quantity': int(quantity)
                     })
                 else:
@@ -266,38 +258,22 @@ def process_successful_payment(stripe_session):
             current_app.logger.warning(f"No cart items found for session {session_id}")
             return True
         
+        # Take the stock once per session; Stripe retries and parallel deliveries stop here
+        try:
+            commit_order_stock(session_id, cart_items, allow_oversell=True,
+                               reservation_key=metadata.get('reservation_key'))
+        except StockAlreadyCommitted:
+            db.session.rollback()
+            current_app.logger.info(f"Session {session_id} was already processed")
+            return True
+        
         # Create order record
         order = create_order_from_stripe_session(stripe_session, user, cart_items)
         if not order:
             return False
         
-        # Process each cart item and update inventory
         for item in cart_items:
             product = item['product']
-            quantity = item['quantity']
-            
-            # Check if we have enough stock
-            if product.quantity_on_hand < quantity:
-                current_app.logger.error(
-                    f"Insufficient stock for product {product.id}: "
-                    f"requested {quantity}, available {product.quantity_on_hand}"
-                )
-                # In a real system, you might want to handle this more gracefully
-                # For now, we'll decrement what we can
-                quantity = max(0, product.quantity_on_hand)
-            
-            # Decrement inventory using the Product method
-            if quantity > 0:
-                success = product.decrement_inventory(quantity)
-                if success:
-                    current_app.logger.info(
-                        f"Decremented inventory for product {product.id}: "
-                        f"new quantity = {product.quantity_on_hand}, in_stock = {product.in_stock}"
-                    )
-                else:
-                    current_app.logger.error(
-                        f"Failed to decrement inventory for product {product.id}"
-                    )
             
             # Create order item
             order_item = OrderItem(
@@ -313,30 +289,18 @@ def process_successful_payment(stripe_session):
         # Clear user's cart after successful payment
         if user:
             Cart.query.filter_by(user_id=user.id).delete()
-        else:
-            # For guest users, clear session cart
-            # Note: This will only work if the webhook is called in the same session
-            # For better handling, we'll also clear it in the frontend after successful payment
-            if 'cart' in flask_session:
-                flask_session.pop('cart', None)
-                flask_session.modified = True
+        elif metadata.get('cart_token'):
+            # Guest carts live server-side, so the webhook can clear them by token
+            clear_guest_cart(metadata['cart_token'], commit=False)
         
-        # Commit all changes
-        db.session.commit()
+        # Queue the Slack notification with the order; the outbox worker sends it after commit
+        enqueue_order_notification(order, cart_items)
         
-        # Send Slack notification after successful order processing
-        try:
-            current_app.logger.info(f"Attempting to send Slack notification for order {order.order_number}")
-            success = send_order_notification(order, cart_items)
-            if success:
-                current_app.logger.info(f"Slack notification sent successfully for order {order.order_number}")
-            else:
-                current_app.logger.warning(f"Slack notification failed for order {order.order_number}")
-        except Exception as e:
-            # Don't fail the webhook if Slack notification fails
-            current_app.logger.error(f"Failed to send Slack notification for order {order.order_number}: {str(e)}")
-            import traceback
-            current_app.logger.error(f"Slack notification traceback: {traceback.format_exc()}")
+        # Commit all changes
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
         
         current_app.logger.info(f"Successfully processed payment for session {session_id}")
         return True
@@ -506,10 +470,9 @@ def process_uber_webhook_event(delivery, event_type, event):
             try:
                 order = delivery.order
                 if order:
-                    from services.slack_notifications import send_delivery_notification
-                    send_delivery_notification(order, delivery, 'driver_assigned')
+                    enqueue_delivery_notification(order, delivery, 'driver_assigned')
             except Exception as e:
-                current_app.logger.error(f"Failed to send Slack notification for driver assignment: {e}")
+                current_app.logger.error(f"Failed to queue Slack notification for driver assignment: {e}")
         
         elif event_type == 'delivery.driver_arrived':
             current_app.logger.info(f"🚗 Driver arrived for delivery {delivery.delivery_id}")
@@ -523,10 +486,9 @@ def process_uber_webhook_event(delivery, event_type, event):
                 order = delivery.order
                 if order:
                     order.status = 'delivered'
-                    from services.slack_notifications import send_delivery_notification
-                    send_delivery_notification(order, delivery, 'delivery_completed')
+                    enqueue_delivery_notification(order, delivery, 'delivery_completed')
             except Exception as e:
-                current_app.logger.error(f"Failed to send Slack notification for delivery completion: {e}")
+                current_app.logger.error(f"Failed to queue Slack notification for delivery completion: {e}")
         
         elif event_type == 'delivery.cancelled':
             current_app.logger.error(f"🚫 DELIVERY CANCELLED: {delivery.delivery_id}")
@@ -540,11 +502,10 @@ def process_uber_webhook_event(delivery, event_type, event):
                 order = delivery.order
                 if order:
                     order.status = 'delivery_cancelled'
-                    from services.slack_notifications import send_delivery_notification
-                    send_delivery_notification(order, delivery, 'delivery_cancelled')
-                    current_app.logger.error(f"🚨 SLACK ALERT SENT: Order {order.order_number} delivery cancelled!")
+                    enqueue_delivery_notification(order, delivery, 'delivery_cancelled')
+                    current_app.logger.error(f"🚨 SLACK ALERT QUEUED: Order {order.order_number} delivery cancelled!")
             except Exception as e:
-                current_app.logger.error(f"Failed to send Slack notification for delivery cancellation: {e}")
+                current_app.logger.error(f"Failed to queue Slack notification for delivery cancellation: {e}")
         
         # Save changes
         db.session.commit()
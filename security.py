@@ -3,10 +3,8 @@ Security utilities and middleware for LoveMeNow application
 """
 import re
 from functools import wraps
-from flask import request, jsonify, current_app, g
+from flask import request, jsonify, current_app
 from flask_login import current_user
-import time
-from collections import defaultdict, deque
 
 class SecurityMiddleware:
     """Security middleware for Flask application"""
@@ -18,21 +16,33 @@ class SecurityMiddleware:
     
     def init_app(self, app):
         """Initialize security middleware with Flask app"""
+        from services.rate_limiter import RateLimiter
+        from services.request_scanner import RequestScanner, DEFAULT_BODY_LIMIT, DEFAULT_SKIP_PREFIXES
+        self.rate_limiter = RateLimiter(app)
+        self.scanner = RequestScanner(
+            body_limit=app.config.get('SUSPICIOUS_SCAN_BODY_LIMIT', DEFAULT_BODY_LIMIT),
+            skip_prefixes=app.config.get('SUSPICIOUS_SCAN_SKIP_PREFIXES', DEFAULT_SKIP_PREFIXES),
+        )
+        self.max_buffered_body = app.config.get('SUSPICIOUS_SCAN_MAX_BUFFERED_BODY', 1024 * 1024)
         app.before_request(self.before_request)
         app.after_request(self.after_request)
     
     def before_request(self):
         """Security checks before each request"""
+        # Rate limiting first, so throttled clients never reach the database
+        allowed, retry_after = self.check_rate_limit()
+        if not allowed:
+            response = jsonify({'error': 'Rate limit exceeded'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        
         # Log request for monitoring
         self.log_request()
         
         # Check for suspicious patterns in request
         if self.check_suspicious_requests():
             return jsonify({'error': 'Suspicious request detected'}), 400
-        
-        # Rate limiting (basic implementation)
-        if not self.check_rate_limit():
-            return jsonify({'error': 'Rate limit exceeded'}), 429
     
     def after_request(self, response):
         """Add security headers after each request"""
@@ -70,85 +80,55 @@ class SecurityMiddleware:
             current_app.logger.warning(f"Failed to log request: {e}")
     
     def check_suspicious_requests(self):
-        """Check for suspicious request patterns"""
-        suspicious_patterns = [
-            r'<script',
-            r'javascript:',
-            r'vbscript:',
-            r'onload=',
-            r'onerror=',
-            r'eval\(',
-            r'expression\(',
-            r'url\(',
-            r'import\(',
-            r'\.\./',  # Path traversal
-            r'union.*select',  # SQL injection
-            r'drop.*table',  # SQL injection
-        ]
+        """Check the URL and a capped body prefix against the precompiled signature scanner"""
+        if self.scanner.skips(request.path):
+            return False
         
-        # Check URL and query parameters
         full_url = request.url
-        request_data = str(request.get_data())
-        
-        for pattern in suspicious_patterns:
-            if re.search(pattern, full_url, re.IGNORECASE) or re.search(pattern, request_data, re.IGNORECASE):
-                current_app.logger.warning(f"Suspicious request detected: {request.remote_addr} - {full_url}")
-                
-                # Log to audit log
-                try:
-                    from models import AuditLog
-                    from flask_login import current_user
-                    
-                    AuditLog.log_action(
-                        action='suspicious_request',
-                        user_id=current_user.id if current_user.is_authenticated else None,
-                        details=f"Pattern: {pattern}, URL: {full_url}, Data: {request_data[:500]}",
-                        ip_address=request.remote_addr,
-                        user_agent=request.headers.get('User-Agent'),
-                        status='warning'
-                    )
-                except Exception as e:
-                    current_app.logger.error(f"Failed to log suspicious request: {e}")
-                
-                return True  # Suspicious request detected
-        
-        return False  # No suspicious patterns found
-    
-    def check_rate_limit(self):
-        """Basic rate limiting implementation"""
-        if not hasattr(g, 'rate_limiter'):
-            g.rate_limiter = defaultdict(lambda: deque())
-        
-        client_ip = request.remote_addr
-        now = time.time()
+        body = self._body_prefix()
+        rule_id = self.scanner.first_match(full_url, body)
+        if rule_id is None:
+            return False
         
-        # Clean old requests (older than 1 minute)
-        while g.rate_limiter[client_ip] and g.rate_limiter[client_ip][0] < now - 60:
-            g.rate_limiter[client_ip].popleft()
+        rule_ids = self.scanner.matches(full_url, body)
+        current_app.logger.warning(f"Suspicious request detected ({', '.join(rule_ids)}): {request.remote_addr} - {full_url}")
         
-        # Check if rate limit exceeded (60 requests per minute)
-        if len(g.rate_limiter[client_ip]) >= 60:
-            # Log rate limit violation
-            try:
-                from models import AuditLog
-                from flask_login import current_user
-                
-                AuditLog.log_action(
-                    action='rate_limit_exceeded',
-                    user_id=current_user.id if current_user.is_authenticated else None,
-                    details=f"IP: {client_ip}, Requests: {len(g.rate_limiter[client_ip])}, URL: {request.url}",
-                    ip_address=request.remote_addr,
-                    user_agent=request.headers.get('User-Agent'),
-                    status='warning'
-                )
-            except Exception as e:
-                current_app.logger.error(f"Failed to log rate limit violation: {e}")
+        # Log to audit log
+        try:
+            from models import AuditLog
+            from flask_login import current_user
             
-            return False
+            AuditLog.log_action(
+                action='suspicious_request',
+                user_id=current_user.id if current_user.is_authenticated else None,
+                resource_type='request_scanner',
+                resource_id=rule_id,
+                details=f"Rules: {', '.join(rule_ids)}, URL: {full_url}, Data: {body[:500]!r}",
+                ip_address=request.remote_addr,
+                user_agent=request.headers.get('User-Agent'),
+                status='warning'
+            )
+        except Exception as e:
+            current_app.logger.error(f"Failed to log suspicious request: {e}")
         
-        # Add current request
-        g.rate_limiter[client_ip].append(now)
-        return True
+        return True  # Suspicious request detected
+    
+    def _body_prefix(self):
+        """
+        Raw body bytes for scanning, without buffering uploads.
+        
+        Small bodies go through get_data(cache=True), which the view reuses for
+        get_json()/form parsing, so nothing is read twice. Multipart and large
+        bodies are left to stream to the view unscanned.
+        """
+        length = request.content_length
+        if not length or request.mimetype == 'multipart/form-data' or length > self.max_buffered_body:
+            return b''
+        return request.get_data(cache=True)
+    
+    def check_rate_limit(self):
+        """Return (allowed, retry_after_seconds) from the shared sliding-window limiter"""
+        return self.rate_limiter.check()
 
 def admin_required(f):
     """Decorator to require admin privileges"""
@@ -0,0 +1,205 @@
+"""
+Content-hashed, bundled and precompressed CSS/JS under static/dist, resolved through a manifest
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from flask import current_app, request, send_from_directory, url_for
+
+# Bump when minification or output layout changes
+PIPELINE_VERSION = 1
+
+ASSET_DIRS = ('CSS', 'js')
+ASSET_EXTENSIONS = ('.css', '.js')
+
+# Bundles are concatenated in order, so they must match the order pages load
+# the parts in. index.js stays separate: its 'use strict' only holds at the
+# top of a script.
+BUNDLES = {
+    'bundles/core.js': ('js/csrf-handler.js', 'js/toast.js', 'js/mobile-menu.js'),
+    'bundles/listing.css': ('CSS/styles.css', 'CSS/mobile-optimizations.css', 'CSS/filters-sheet.css'),
+}
+
+# Built files live at static/dist/<logical dir>/<stem>.<12 hex>.<ext>, with .gz/.br siblings
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# ─────────────────────────────────────────────────────────────
+# Build
+# ─────────────────────────────────────────────────────────────
+
+def minify_css(css_content):
+    """
+    Comment and whitespace removal. Space before ':' is kept because it is
+    significant in selectors ('.nav :hover' is not '.nav:hover').
+    """
+    css_content = re.sub(r'/\*[^*]*\*+(?:[^/*][^*]*\*+)*/', '', css_content)
+    css_content = re.sub(r'\s+', ' ', css_content)
+    css_content = re.sub(r'\s*([{};,])\s*', r'\1', css_content)
+    css_content = re.sub(r':\s+', ':', css_content)
+    css_content = re.sub(r';\}', '}', css_content)
+    return css_content.strip()
+
+
+def minify_js(js_content):
+    """rjsmin when installed; otherwise the source is shipped as-is (still hashed and compressed)."""
+    try:
+        import rjsmin
+    except ImportError:
+        return js_content
+    return rjsmin.jsmin(js_content)
+
+
+def _minify(logical, content):
+    return minify_css(content) if logical.endswith('.css') else minify_js(content)
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _write_if_missing(path, data):
+    if path.exists():
+        return False
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return True
+
+
+def iter_assets(static_root):
+    for dirname in ASSET_DIRS:
+        for path in sorted((static_root / dirname).glob('*')):
+            if path.suffix in ASSET_EXTENSIONS and path.is_file():
+                yield path.relative_to(static_root).as_posix()
+
+
+def build_assets(static_root, log=print):
+    """
+    Minify, bundle and fingerprint every CSS/JS file, write .gz (and .br
+    when the brotli package is installed) next to each, and save the
+    manifest. Returns (manifest, stats).
+
+    Output names are content hashes, so unchanged assets keep their URL
+    and builds from earlier deploys are left in place for pages still
+    referencing them.
+    """
+    static_root = Path(static_root)
+    dist = static_root / DIST_DIRNAME
+    brotli = _brotli()
+    stats = {'assets': 0, 'written': 0, 'bytes': 0, 'gzip_bytes': 0, 'br_bytes': 0}
+
+    sources = {logical: (logical,) for logical in iter_assets(static_root)}
+    sources.update(BUNDLES)
+
+    assets = {}
+    for logical, parts in sources.items():
+        texts = [_minify(part, (static_root / part).read_text(encoding='utf-8')) for part in parts]
+        # ';' guards against a bundled script that ends without one
+        separator = '\n' if logical.endswith('.css') else ';\n'
+        data = separator.join(texts).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        logical_path = Path(logical)
+        built = Path(DIST_DIRNAME) / logical_path.parent / f"{logical_path.stem}.{digest}{logical_path.suffix}"
+        target = static_root / built
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        written = _write_if_missing(target, data)
+        gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+        written |= _write_if_missing(target.with_name(target.name + '.gz'), gzipped)
+        stats['gzip_bytes'] += len(gzipped)
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=11)
+            written |= _write_if_missing(target.with_name(target.name + '.br'), compressed)
+            stats['br_bytes'] += len(compressed)
+
+        assets[logical] = built.relative_to(DIST_DIRNAME).as_posix()
+        stats['assets'] += 1
+        stats['bytes'] += len(data)
+        if written:
+            stats['written'] += 1
+            log(f"✅ {logical} -> {built.as_posix()}")
+
+    manifest = {'version': PIPELINE_VERSION, 'assets': assets}
+    tmp = dist / f"{MANIFEST_NAME}.tmp"
+    dist.mkdir(parents=True, exist_ok=True)
+    with open(tmp, 'w') as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+    os.replace(tmp, dist / MANIFEST_NAME)
+    return manifest, stats
+
+
+# ─────────────────────────────────────────────────────────────
+# Serving
+# ─────────────────────────────────────────────────────────────
+
+_manifest = None
+
+
+def _load_manifest():
+    global _manifest
+    if _manifest is None:
+        path = Path(current_app.static_folder) / DIST_DIRNAME / MANIFEST_NAME
+        try:
+            with open(path) as handle:
+                loaded = json.load(handle)
+            _manifest = loaded['assets'] if loaded.get('version') == PIPELINE_VERSION else {}
+        except (OSError, ValueError, KeyError):
+            _manifest = {}
+        if not _manifest:
+            current_app.logger.warning("⚠️ No static asset manifest; serving unhashed CSS/JS (run optimize_css.py)")
+    return _manifest
+
+
+def asset_url(name):
+    """
+    URL for a logical asset ('js/index.js'): the hashed build when the
+    manifest has it, else the plain static file.
+    """
+    built = _load_manifest().get(name)
+    if built is not None:
+        return url_for('dist_asset', filename=built)
+    return url_for('static', filename=name)
+
+
+def asset_urls(name):
+    """
+    URLs to load for a bundle ('bundles/core.js'): the one built file, or
+    each part in order when there's no build (local dev).
+    """
+    built = _load_manifest().get(name)
+    if built is not None:
+        return [url_for('dist_asset', filename=built)]
+    return [url_for('static', filename=part) for part in BUNDLES.get(name, (name,))]
+
+
+def send_built_asset(filename):
+    """Serve a hashed build, picking the best precompressed sibling the client accepts."""
+    directory = os.path.join(current_app.static_folder, DIST_DIRNAME)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding, suffix = None, ''
+    for candidate, candidate_suffix in ENCODINGS:
+        if request.accept_encodings[candidate] > 0 and os.path.isfile(os.path.join(directory, filename + candidate_suffix)):
+            encoding, suffix = candidate, candidate_suffix
+            break
+
+    response = send_from_directory(directory, filename + suffix, mimetype=mimetype, max_age=31536000)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
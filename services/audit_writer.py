@@ -0,0 +1,150 @@
+"""
+Buffered audit-log writer: request threads enqueue, a background thread bulk-inserts
+"""
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+
+# Column limits from models.AuditLog, applied before insert so one long value can't fail a batch
+_LENGTH_LIMITS = {'action': 100, 'resource_type': 50, 'resource_id': 50,
+                  'ip_address': 45, 'user_agent': 500, 'status': 20}
+
+
+def audit_row(action, user_id=None, resource_type=None, resource_id=None, details=None,
+              ip_address=None, user_agent=None, status="success", created_at=None):
+    """Plain dict for one audit_logs row, stamped now so buffering doesn't skew timestamps."""
+    row = {
+        'user_id': user_id,
+        'action': action,
+        'resource_type': resource_type,
+        'resource_id': str(resource_id) if resource_id else None,
+        'details': details,
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'status': status,
+        'created_at': created_at or datetime.utcnow(),
+    }
+    for field, limit in _LENGTH_LIMITS.items():
+        if isinstance(row[field], str) and len(row[field]) > limit:
+            row[field] = row[field][:limit]
+    return row
+
+
+class AuditWriter:
+    """
+    Bounded in-memory queue of audit rows, flushed in bulk INSERTs when it
+    reaches batch_size or every flush_seconds, whichever comes first. When the
+    buffer is full new rows are dropped and counted rather than blocking requests.
+    The hourly dashboard counters are bumped in the same transaction.
+    """
+
+    def __init__(self, app, max_buffer=10000, batch_size=200, flush_seconds=2.0):
+        self.app = app
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                dropped = self.dropped
+            else:
+                self._buffer.append(row)
+                dropped = None
+                if len(self._buffer) >= self.batch_size:
+                    self._wake.set()
+        if dropped is not None and (dropped == 1 or dropped % 1000 == 0):
+            self.app.logger.warning(f"⚠️ Audit buffer full; {dropped} audit entries dropped so far")
+        return dropped is None
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"❌ Audit log flush failed: {e}")
+
+    def _take(self):
+        with self._lock:
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows inserted."""
+        from routes import db
+        from models import AuditLog
+        from services.stats_rollup import bump_counters, count_audit_rows
+
+        total = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return total
+                try:
+                    with self.app.app_context():
+                        with db.engine.begin() as conn:
+                            conn.execute(AuditLog.__table__.insert(), batch)
+                            bump_counters(conn, count_audit_rows(batch))
+                except Exception as e:
+                    # Losing a batch beats retrying a poison row forever
+                    self.failed_batches += 1
+                    self.app.logger.error(f"❌ Failed to write {len(batch)} audit entries: {e}")
+                    continue
+                self.written += len(batch)
+                total += len(batch)
+
+    def stats(self):
+        with self._lock:
+            queued = len(self._buffer)
+        return {
+            'queued': queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_batches': self.failed_batches,
+        }
+
+
+_writer = None
+
+
+def init_audit_writer(app):
+    """Start the process's audit writer; without it log_action falls back to a synchronous insert."""
+    global _writer
+    if _writer is not None or not app.config.get('AUDIT_ASYNC_ENABLED', True):
+        return _writer
+    _writer = AuditWriter(
+        app,
+        max_buffer=app.config.get('AUDIT_BUFFER_MAX', 10000),
+        batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+        flush_seconds=app.config.get('AUDIT_FLUSH_SECONDS', 2.0),
+    )
+    # Drain what's buffered when a gunicorn worker exits cleanly (max-requests recycling)
+    atexit.register(_writer.flush)
+    app.logger.info("✅ Buffered audit writer started")
+    return _writer
+
+
+def enqueue_audit(row):
+    """Queue a row from audit_row(); returns False if no writer is running."""
+    if _writer is None:
+        return False
+    _writer.submit(row)
+    return True
+
+
+def audit_writer_stats():
+    return _writer.stats() if _writer is not None else None
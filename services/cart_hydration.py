@@ -0,0 +1,117 @@
+"""
+Cart lines with product, variant, image and stock resolved in one pass
+"""
+from collections import namedtuple
+
+from flask import g
+from sqlalchemy.orm import selectinload
+
+from models import Product, ProductVariant
+from services.cart_store import current_cart, cart_version
+from services.catalog_snapshot import get_catalog_snapshot
+
+_LineFields = namedtuple('HydratedLine', 'product_id variant_id quantity product variant name '
+                                         'unit_price image_url is_available max_quantity')
+
+
+class HydratedLine(_LineFields):
+    """One cart line ready for templates and JSON; product/variant are snapshot (or ORM) objects."""
+    __slots__ = ()
+
+    @property
+    def item_total(self):
+        return self.unit_price * self.quantity
+
+    def as_item(self):
+        """The dict shape checkout and the cart API have always rendered."""
+        variant = self.variant
+        variant_color = variant.color.name if variant is not None and variant.color else None
+        variant_name = variant.variant_name if variant is not None else None
+        return {
+            'id': self.product_id,
+            'variant_id': self.variant_id,
+            'name': self.name,
+            'price': self.unit_price,
+            'quantity': self.quantity,
+            'image_url': self.image_url,
+            'description': self.product.description or '',
+            'dimensions': self.product.dimensions or '',
+            'in_stock': self.is_available,
+            'max_quantity': self.max_quantity,
+            'item_total': self.item_total,
+            'variant_color': variant_color,
+            'variant_name': variant_name,
+            'variant_label': variant_color or variant_name,
+        }
+
+
+def _line_image(product, variant):
+    # Variant photos are named after the variant UPC
+    if variant is not None and variant.upc:
+        for url in product.all_image_urls:
+            if variant.upc in url:
+                return url
+    return product.main_image_url
+
+
+def _hydrate(line, product):
+    variant = product.get_variant_by_id(line.variant_id) if line.variant_id else None
+    if variant is not None:
+        return HydratedLine(
+            line.product_id, line.variant_id, line.quantity, product, variant,
+            product.variant_display_name(variant=variant), float(product.price),
+            _line_image(product, variant), variant.is_available, variant.available_stock(),
+        )
+    return HydratedLine(
+        line.product_id, line.variant_id, line.quantity, product, None,
+        product.name, float(product.price),
+        product.main_image_url, product.is_available, product.quantity_on_hand,
+    )
+
+
+def _load_missing(product_ids):
+    """Products this worker's snapshot hasn't seen yet (added moments ago elsewhere)."""
+    rows = (
+        Product.query
+        .filter(Product.id.in_(product_ids))
+        .options(selectinload(Product.variants).selectinload(ProductVariant.images),
+                 selectinload(Product.variants).joinedload(ProductVariant.color))
+        .all()
+    )
+    return {product.id: product for product in rows}
+
+
+def hydrate_cart():
+    """
+    The current shopper's cart lines, each with its product, variant, display
+    name, image and stock.
+
+    Costs the cart-lines query (none for the in-memory guest store); products
+    come from the catalog snapshot, so the cost doesn't grow with the number
+    of lines. Lines whose product no longer exists are dropped. Memoized for
+    the rest of the request until the cart changes.
+    """
+    cart = current_cart()
+    key = (cart.guest, cart.owner, cart_version())
+    memo = g.setdefault('_hydrated_cart', {})
+    if key in memo:
+        return memo[key]
+
+    lines = cart.lines()
+    products = get_catalog_snapshot().products_by_id
+    missing = {line.product_id for line in lines} - products.keys()
+    if missing:
+        products = {**products, **_load_missing(missing)}
+
+    hydrated = [_hydrate(line, products[line.product_id]) for line in lines if line.product_id in products]
+    memo[key] = hydrated
+    return hydrated
+
+
+def cart_items():
+    """[{'product', 'product_id', 'variant_id', 'quantity'}] for code that only needs the basics."""
+    return [
+        {'product': line.product, 'product_id': line.product_id,
+         'variant_id': line.variant_id, 'quantity': line.quantity}
+        for line in hydrate_cart()
+    ]
@@ -0,0 +1,386 @@
+"""
+Server-side cart storage for guests and signed-in users
+"""
+import random
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app, session, g
+from flask_login import current_user
+from sqlalchemy import delete, func, insert, select, update
+
+from routes import db
+from models import Cart, GuestCartItem, Product
+from services.identity_cache import bump_counts_generation
+
+# Session key holding the guest's opaque cart token (the only cart state in the cookie)
+CART_TOKEN_KEY = 'cart_token'
+
+CartLine = namedtuple('CartLine', 'product_id variant_id quantity')
+
+_NO_EXCLUDE = object()
+
+# Chance that a guest cart write also purges abandoned guest carts
+PURGE_PROBABILITY = 0.01
+# Carts deleted per purge, so no single request pays for a large backlog
+PURGE_BATCH_SIZE = 500
+
+
+class CartStore(ABC):
+    """Cart backend interface; ``owner`` is a guest token or a user id."""
+
+    @abstractmethod
+    def lines(self, owner):
+        """The owner's lines as CartLine tuples."""
+
+    @abstractmethod
+    def count(self, owner):
+        """Total units across the owner's lines."""
+
+    @abstractmethod
+    def set_quantity(self, owner, product_id, variant_id, quantity):
+        """Set one line's quantity; zero or less removes the line."""
+
+    def add_quantity(self, owner, product_id, variant_id, quantity):
+        current = next(
+            (line.quantity for line in self.lines(owner)
+             if line.product_id == product_id and line.variant_id == variant_id),
+            0,
+        )
+        self.set_quantity(owner, product_id, variant_id, current + quantity)
+
+    @abstractmethod
+    def clear(self, owner, commit=True):
+        """Remove every line; commit=False leaves the delete in the caller's transaction."""
+
+
+class _SQLLineStore(CartStore):
+    """Shared implementation for tables shaped (owner, product_id, variant_id, quantity)."""
+    model = None
+    owner_column = None
+
+    def _owner_filter(self, owner):
+        return getattr(self.model, self.owner_column) == owner
+
+    def _row(self, owner, product_id, variant_id):
+        query = self.model.query.filter(self._owner_filter(owner), self.model.product_id == product_id)
+        if variant_id is None:
+            query = query.filter(self.model.variant_id.is_(None))
+        else:
+            query = query.filter(self.model.variant_id == variant_id)
+        return query.first()
+
+    def lines(self, owner):
+        rows = (
+            db.session.query(self.model.product_id, self.model.variant_id, self.model.quantity)
+            .filter(self._owner_filter(owner))
+            .order_by(self.model.id)
+            .all()
+        )
+        return [CartLine(pid, vid, int(qty or 0)) for pid, vid, qty in rows if (qty or 0) > 0]
+
+    def count(self, owner):
+        return int(
+            db.session.query(func.coalesce(func.sum(self.model.quantity), 0))
+            .filter(self._owner_filter(owner))
+            .scalar() or 0
+        )
+
+    def _before_write(self):
+        """Hook run once at the start of every line write, in the same transaction."""
+
+    def set_quantity(self, owner, product_id, variant_id, quantity):
+        self._before_write()
+        row = self._row(owner, product_id, variant_id)
+        if quantity <= 0:
+            if row:
+                db.session.delete(row)
+        elif row:
+            row.quantity = quantity
+        else:
+            db.session.add(self.model(**{
+                self.owner_column: owner,
+                'product_id': product_id,
+                'variant_id': variant_id,
+                'quantity': quantity,
+            }))
+        db.session.commit()
+
+    def add_quantity(self, owner, product_id, variant_id, quantity):
+        self._before_write()
+        row = self._row(owner, product_id, variant_id)
+        if row:
+            row.quantity = int(row.quantity or 0) + quantity
+        else:
+            db.session.add(self.model(**{
+                self.owner_column: owner,
+                'product_id': product_id,
+                'variant_id': variant_id,
+                'quantity': quantity,
+            }))
+        db.session.commit()
+
+    def clear(self, owner, commit=True):
+        self.model.query.filter(self._owner_filter(owner)).delete(synchronize_session=False)
+        if commit:
+            db.session.commit()
+
+
+class SQLCartStore(_SQLLineStore):
+    """Guest carts in the guest_cart_items table, shared by every worker."""
+    model = GuestCartItem
+    owner_column = 'cart_token'
+
+    def _before_write(self):
+        # One roll per cart write, whichever write method it is
+        if random.random() < PURGE_PROBABILITY:
+            self.purge_abandoned()
+
+    def purge_abandoned(self, max_age_days=None, limit=PURGE_BATCH_SIZE):
+        """
+        Delete up to limit guest carts with no line touched in max_age_days
+        (GUEST_CART_MAX_AGE_DAYS); a cart with any recent line is kept whole.
+        Caller commits.
+        """
+        if max_age_days is None:
+            max_age_days = current_app.config.get('GUEST_CART_MAX_AGE_DAYS', 30)
+        cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+        stale = [token for (token,) in db.session.execute(
+            select(GuestCartItem.cart_token)
+            .group_by(GuestCartItem.cart_token)
+            .having(func.max(GuestCartItem.updated_at) < cutoff)
+            .limit(limit)
+        )]
+        if not stale:
+            return 0
+        return db.session.execute(
+            delete(GuestCartItem).where(GuestCartItem.cart_token.in_(stale))
+        ).rowcount
+
+
+class UserCartStore(_SQLLineStore):
+    """Signed-in carts in the existing cart table."""
+    model = Cart
+    owner_column = 'user_id'
+
+
+class MemoryCartStore(CartStore):
+    """Per-process LRU of guest carts; carts are lost on restart and not shared across workers."""
+
+    def __init__(self, max_carts=10000):
+        self.max_carts = max_carts
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lines(self, owner):
+        with self._lock:
+            cart = self._carts.get(owner)
+            if cart is None:
+                return []
+            self._carts.move_to_end(owner)
+            return [CartLine(pid, vid, qty) for (pid, vid), qty in cart.items()]
+
+    def count(self, owner):
+        return sum(line.quantity for line in self.lines(owner))
+
+    def set_quantity(self, owner, product_id, variant_id, quantity):
+        with self._lock:
+            cart = self._carts.setdefault(owner, {})
+            self._carts.move_to_end(owner)
+            if quantity <= 0:
+                cart.pop((product_id, variant_id), None)
+            else:
+                cart[(product_id, variant_id)] = quantity
+            while len(self._carts) > self.max_carts:
+                self._carts.popitem(last=False)
+
+    def clear(self, owner, commit=True):
+        with self._lock:
+            self._carts.pop(owner, None)
+
+
+_guest_store = None
+_user_store = UserCartStore()
+
+
+def cart_version():
+    """Per-request counter bumped on every cart write; keys memoized totals."""
+    return g.get('cart_version', 0)
+
+
+def _bump_cart_version():
+    g.cart_version = cart_version() + 1
+    bump_counts_generation()
+
+
+def get_cart_store():
+    """Return the configured guest cart backend."""
+    global _guest_store
+    if _guest_store is None:
+        backend = current_app.config.get('CART_STORE_BACKEND', 'sql')
+        if backend == 'memory':
+            _guest_store = MemoryCartStore(current_app.config.get('CART_STORE_MEMORY_MAX_CARTS', 10000))
+        else:
+            _guest_store = SQLCartStore()
+    return _guest_store
+
+
+class CartHandle:
+    """The current shopper's cart, with one API for guests and signed-in users."""
+
+    def __init__(self, store, owner, guest=False):
+        self.store = store
+        self.owner = owner
+        self.guest = guest
+
+    def _ensure_owner(self):
+        if self.owner is None:
+            self.owner = secrets.token_urlsafe(24)
+            session[CART_TOKEN_KEY] = self.owner
+
+    def lines(self):
+        if self.owner is None:
+            return []
+        return self.store.lines(self.owner)
+
+    def count(self):
+        if self.owner is None:
+            return 0
+        return self.store.count(self.owner)
+
+    def product_quantity(self, product_id, excluding_variant=_NO_EXCLUDE):
+        """Units of a product across all its lines, optionally skipping one variant's line."""
+        return sum(
+            line.quantity for line in self.lines()
+            if line.product_id == product_id and line.variant_id != excluding_variant
+        )
+
+    def add(self, product_id, variant_id, quantity):
+        self._ensure_owner()
+        self.store.add_quantity(self.owner, product_id, variant_id, quantity)
+        _bump_cart_version()
+
+    def set(self, product_id, variant_id, quantity):
+        self._ensure_owner()
+        self.store.set_quantity(self.owner, product_id, variant_id, quantity)
+        _bump_cart_version()
+
+    def remove(self, product_id, variant_id):
+        if self.owner is not None:
+            self.store.set_quantity(self.owner, product_id, variant_id, 0)
+            _bump_cart_version()
+
+    def clear(self):
+        if self.owner is not None:
+            self.store.clear(self.owner)
+            _bump_cart_version()
+
+
+def _parse_legacy_key(cart_key):
+    product_part, _, variant_part = str(cart_key).partition(':')
+    variant_id = int(variant_part) if variant_part not in ('', 'None', 'null') else None
+    return int(product_part), variant_id
+
+
+def _import_legacy_session_cart(handle):
+    """Move a pre-existing cookie cart (session['cart']) into the store once."""
+    legacy = session.pop('cart', None)
+    if not legacy:
+        return
+    for cart_key, quantity in legacy.items():
+        try:
+            product_id, variant_id = _parse_legacy_key(cart_key)
+            quantity = int(quantity or 0)
+        except (TypeError, ValueError):
+            continue
+        if quantity > 0:
+            handle.add(product_id, variant_id, quantity)
+
+
+def guest_cart():
+    """Cart handle for the anonymous visitor, regardless of login state."""
+    handle = CartHandle(get_cart_store(), session.get(CART_TOKEN_KEY), guest=True)
+    if 'cart' in session:
+        _import_legacy_session_cart(handle)
+    return handle
+
+
+def current_cart():
+    """Cart handle for the current request: the user's DB cart or the guest store."""
+    if current_user.is_authenticated:
+        return CartHandle(_user_store, current_user.id)
+    return guest_cart()
+
+
+def guest_cart_token():
+    return session.get(CART_TOKEN_KEY)
+
+
+def clear_guest_cart(token=None, commit=True):
+    """
+    Drop a guest cart by token (defaults to this session's) and forget the token.
+    Pass commit=False to fold the delete into the caller's transaction.
+    """
+    if token is None:
+        token = session.pop(CART_TOKEN_KEY, None)
+        session.pop('cart', None)
+    if token:
+        get_cart_store().clear(token, commit=commit)
+        _bump_cart_version()
+
+
+def merge_guest_cart(user_id):
+    """
+    Fold the guest cart into a user's cart with bulk statements.
+
+    Loads the user's rows and product stock in one query each, then issues a
+    single multi-row INSERT and a single bulk UPDATE. Quantities are capped at
+    product stock, matching the previous per-item merge. Caller commits.
+    """
+    guest_lines = guest_cart().lines()
+    if not guest_lines:
+        return 0
+
+    product_ids = {line.product_id for line in guest_lines}
+    stock = dict(
+        db.session.query(Product.id, Product.quantity_on_hand)
+        .filter(Product.id.in_(product_ids))
+        .all()
+    )
+    existing = {
+        (pid, vid): (row_id, int(qty or 0))
+        for row_id, pid, vid, qty in (
+            db.session.query(Cart.id, Cart.product_id, Cart.variant_id, Cart.quantity)
+            .filter(Cart.user_id == user_id)
+            .all()
+        )
+    }
+
+    inserts, updates = [], []
+    for line in guest_lines:
+        if line.product_id not in stock:
+            continue
+        cap = int(stock[line.product_id] or 0)
+        key = (line.product_id, line.variant_id)
+        if key in existing:
+            row_id, current = existing[key]
+            updates.append({'id': row_id, 'quantity': min(current + line.quantity, cap)})
+        else:
+            quantity = min(line.quantity, cap)
+            if quantity > 0:
+                inserts.append({
+                    'user_id': user_id,
+                    'product_id': line.product_id,
+                    'variant_id': line.variant_id,
+                    'quantity': quantity,
+                })
+
+    if inserts:
+        db.session.execute(insert(Cart), inserts)
+    if updates:
+        db.session.execute(update(Cart), updates)
+    _bump_cart_version()
+    return len(inserts) + len(updates)
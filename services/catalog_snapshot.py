@@ -0,0 +1,456 @@
+"""
+In-process catalog snapshot for listing pages
+"""
+import math
+import threading
+import time
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+
+from routes import db
+from models import Product, ProductVariant, ProductImage, Category, CategoryGroup, Color, CatalogVersion
+from services.category_index import load_closure_map, load_category_groups
+from services.db_health import database_available
+
+CATALOG_SCOPE = 'catalog'
+
+# Seconds between version polls per worker; local writes invalidate immediately
+VERSION_CHECK_INTERVAL = 5
+
+# ORM classes whose writes invalidate the snapshot
+CATALOG_MODELS = (Product, ProductVariant, ProductImage, Category, CategoryGroup, Color)
+
+
+# ─────────────────────────────────────────────────────────────
+# Snapshot records
+# ─────────────────────────────────────────────────────────────
+
+# Model property getters reused so derived values match the ORM exactly
+_variant_is_available = ProductVariant.is_available.fget
+_default_variant = Product.default_variant.fget
+_main_image_url = Product.main_image_url.fget
+_all_image_urls = Product.all_image_urls.fget
+_product_is_available = Product.is_available.fget
+
+
+class CatalogColor:
+    __slots__ = ('id', 'name', 'hex', 'slug')
+
+    def __init__(self, color):
+        self.id = color.id
+        self.name = color.name
+        self.hex = color.hex
+        self.slug = color.slug
+
+
+class CatalogCategory:
+    __slots__ = ('id', 'name', 'slug', 'parent_id', 'parent', 'children')
+
+    def __init__(self, category):
+        self.id = category.id
+        self.name = category.name
+        self.slug = category.slug
+        self.parent_id = category.parent_id
+        self.parent = None
+        self.children = ()
+
+
+class CatalogImage:
+    __slots__ = ('id', 'url', 'is_primary', 'sort_order', 'alt_text', 'width', 'height', 'renditions', 'lqip')
+
+    srcset = ProductImage.srcset
+
+    def __init__(self, image):
+        self.id = image.id
+        self.url = image.url
+        self.is_primary = image.is_primary
+        self.sort_order = image.sort_order
+        self.alt_text = image.alt_text
+        self.width = image.width
+        self.height = image.height
+        self.renditions = image.renditions
+        self.lqip = image.lqip
+
+
+class CatalogVariant:
+    """Read-only mirror of ProductVariant; stock rules are shared with the model."""
+    __slots__ = ('id', 'product_id', 'color_id', 'color', 'variant_name', 'upc',
+                 'in_stock', 'quantity_on_hand', 'images', 'sorted_images', 'product',
+                 'is_available')
+
+    uses_product_stock = ProductVariant.uses_product_stock
+    available_stock = ProductVariant.available_stock
+    effective_in_stock = ProductVariant.effective_in_stock
+    display_name = ProductVariant.display_name
+
+    def __init__(self, variant, product, colors_by_id):
+        self.id = variant.id
+        self.product_id = variant.product_id
+        self.color_id = variant.color_id
+        self.color = colors_by_id.get(variant.color_id)
+        self.variant_name = variant.variant_name
+        self.upc = variant.upc
+        self.in_stock = variant.in_stock
+        self.quantity_on_hand = variant.quantity_on_hand
+        self.images = tuple(CatalogImage(img) for img in variant.images)
+        self.sorted_images = tuple(sorted(self.images, key=lambda img: img.sort_order or 0))
+        self.product = product
+        self.is_available = False
+
+
+class CatalogProduct:
+    """
+    Read-only mirror of Product exposing what listing templates use.
+
+    default_variant, main_image_url, all_image_urls and is_available are
+    derived once per snapshot (see derive()) instead of on every access.
+    """
+    __slots__ = ('id', 'name', 'upc', 'base_upc', 'description', 'features', 'specifications',
+                 'dimensions', 'price', 'compare_at_price', 'image_url',
+                 'in_stock', 'quantity_on_hand', 'in_active', 'rating', 'review_count',
+                 'category_id', 'category', 'created_at', 'updated_at', 'variants', 'colors',
+                 'name_key', 'default_variant', 'main_image_url', 'is_available', '_all_image_urls')
+
+    force_product_inventory = Product.force_product_inventory
+    total_quantity_on_hand = Product.total_quantity_on_hand
+    available_colors = Product.available_colors
+    all_colors = Product.all_colors
+    get_variant_by_color = Product.get_variant_by_color
+    get_variant_by_id = Product.get_variant_by_id
+    variant_display_name = Product.variant_display_name
+    clean_name = Product.clean_name
+
+    def __init__(self, product, categories_by_id, colors_by_id):
+        self.id = product.id
+        self.name = product.name
+        self.upc = product.upc
+        self.base_upc = product.base_upc
+        self.description = product.description
+        self.features = product.features
+        self.specifications = product.specifications
+        self.dimensions = product.dimensions
+        self.price = product.price
+        self.compare_at_price = product.compare_at_price
+        self.image_url = product.image_url
+        self.in_stock = product.in_stock
+        self.quantity_on_hand = product.quantity_on_hand
+        self.in_active = product.in_active
+        self.rating = product.rating
+        self.review_count = product.review_count
+        self.category_id = product.category_id
+        self.category = categories_by_id.get(product.category_id)
+        self.created_at = product.created_at
+        self.updated_at = product.updated_at
+        self.colors = tuple(colors_by_id[c.id] for c in product.colors if c.id in colors_by_id)
+        self.variants = tuple(CatalogVariant(v, self, colors_by_id) for v in product.variants)
+        self.name_key = (product.name or '').casefold()
+        self.derive()
+
+    def derive(self):
+        """Compute the derived views in one pass over the preloaded variants and images."""
+        for variant in self.variants:
+            variant.is_available = _variant_is_available(variant)
+        self.default_variant = _default_variant(self)
+        self.main_image_url = _main_image_url(self)
+        self._all_image_urls = tuple(_all_image_urls(self))
+        self.is_available = _product_is_available(self)
+
+    @property
+    def all_image_urls(self):
+        # Fresh list per access; templates append to it
+        return list(self._all_image_urls)
+
+
+class CatalogSnapshot:
+    """Immutable view of the catalog at one version."""
+
+    def __init__(self, version, products, categories, colors, closure=None, groups=None):
+        self.version = version
+        self.products = products
+        self.products_by_id = {p.id: p for p in products}
+        self.categories_by_id = {c.id: c for c in categories}
+        self.categories_by_slug = {c.slug: c for c in categories}
+        self.root_categories = tuple(c for c in categories if c.parent_id is None)
+        self.closure = closure or {}
+        self.category_groups = groups or {}
+
+        used_color_ids = {c.id for p in products for c in p.colors}
+        self.colors = tuple(c for c in colors if c.id in used_color_ids)
+
+        # Keyed the way templates see image URLs (Product.all_image_urls form)
+        self.images_by_url = {}
+        for p in products:
+            for v in p.variants:
+                for img in v.images:
+                    url = img.url if img.url.startswith(('/static/', 'http')) else f"/static/{img.url}"
+                    self.images_by_url.setdefault(url, img)
+
+    def get_category(self, value):
+        """Look up a category by numeric id or slug."""
+        try:
+            return self.categories_by_id.get(int(value))
+        except (ValueError, TypeError):
+            return self.categories_by_slug.get(value)
+
+    def descendant_ids(self, category):
+        """Return the category id plus the ids of every category beneath it."""
+        if category.id in self.closure:
+            return self.closure[category.id]
+
+        # Closure not built yet; walk the in-memory tree instead
+        ids = []
+        stack = [category]
+        while stack:
+            node = stack.pop()
+            ids.append(node.id)
+            stack.extend(node.children)
+        return ids
+
+    def get_group(self, slug):
+        """Return (name, category ids) for a listing group such as 'men', or None."""
+        return self.category_groups.get(slug)
+
+    def filter_products(self, category_ids=None, exclude_category_ids=(), color_id=None,
+                        min_price=None, max_price=None, in_stock_only=False,
+                        brand=None, sort_by='name', ranking=None):
+        """
+        Apply listing filters and sorting; mirrors the SQL the listing used to run.
+
+        ``ranking`` maps product id to a search score; when given, only those
+        products match and ``sort_by='relevance'`` orders by that score.
+        """
+        category_ids = set(category_ids) if category_ids is not None else None
+        exclude_category_ids = set(exclude_category_ids)
+        min_price = Decimal(str(min_price)) if min_price else None
+        max_price = Decimal(str(max_price)) if max_price else None
+        brand_key = brand.casefold() if brand else None
+
+        results = []
+        for p in self.products:
+            if p.in_active:
+                continue
+            if category_ids is not None and p.category_id not in category_ids:
+                continue
+            if p.category_id in exclude_category_ids:
+                continue
+            if color_id and not any(c.id == color_id for c in p.colors):
+                continue
+            if min_price is not None and p.price < min_price:
+                continue
+            if max_price is not None and p.price > max_price:
+                continue
+            if ranking is not None and p.id not in ranking:
+                continue
+            if in_stock_only and not (p.in_stock and (p.quantity_on_hand or 0) > 0):
+                continue
+            if brand_key and not p.name_key.startswith(brand_key):
+                continue
+            results.append(p)
+
+        # In-stock products first (NULL last, as MySQL orders DESC), then the chosen sort
+        def stock_rank(p):
+            return 0 if p.in_stock else (1 if p.in_stock is not None else 2)
+
+        if sort_by == 'low-high':
+            results.sort(key=lambda p: (stock_rank(p), p.price, p.id))
+        elif sort_by == 'high-low':
+            results.sort(key=lambda p: (stock_rank(p), -p.price, p.id))
+        elif sort_by == 'newest':
+            results.sort(key=lambda p: (stock_rank(p), -p.id))
+        elif sort_by == 'relevance' and ranking is not None:
+            results.sort(key=lambda p: (stock_rank(p), -ranking[p.id], p.id))
+        else:
+            results.sort(key=lambda p: (stock_rank(p), p.name_key, p.id))
+        return results
+
+
+class SnapshotPagination:
+    """Minimal stand-in for Flask-SQLAlchemy's Pagination over an in-memory list."""
+
+    def __init__(self, items, page, per_page):
+        self.page = max(page or 1, 1)
+        self.per_page = per_page
+        self.total = len(items)
+        start = (self.page - 1) * per_page
+        self.items = items[start:start + per_page]
+
+    @property
+    def pages(self):
+        if self.total == 0:
+            return 0
+        return math.ceil(self.total / self.per_page)
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, *, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        pages_end = self.pages + 1
+        if pages_end == 1:
+            return
+
+        left_end = min(1 + left_edge, pages_end)
+        yield from range(1, left_end)
+        if left_end == pages_end:
+            return
+
+        mid_start = max(left_end, self.page - left_current)
+        mid_end = min(self.page + right_current + 1, pages_end)
+        if mid_start - left_end > 0:
+            yield None
+        yield from range(mid_start, mid_end)
+        if mid_end == pages_end:
+            return
+
+        right_start = max(mid_end, pages_end - right_edge)
+        if right_start - mid_end > 0:
+            yield None
+        yield from range(right_start, pages_end)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+# ─────────────────────────────────────────────────────────────
+# Loading and invalidation
+# ─────────────────────────────────────────────────────────────
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _read_version(scope=CATALOG_SCOPE):
+    return db.session.query(CatalogVersion.version).filter_by(scope=scope).scalar() or 0
+
+
+def _build_snapshot(version):
+    categories = [CatalogCategory(c) for c in Category.query.order_by(Category.id).all()]
+    categories_by_id = {c.id: c for c in categories}
+    for c in categories:
+        c.parent = categories_by_id.get(c.parent_id)
+    children = {}
+    for c in categories:
+        if c.parent_id is not None:
+            children.setdefault(c.parent_id, []).append(c)
+    for parent_id, kids in children.items():
+        if parent_id in categories_by_id:
+            categories_by_id[parent_id].children = tuple(kids)
+
+    colors = [CatalogColor(c) for c in Color.query.order_by(Color.id).all()]
+    colors_by_id = {c.id: c for c in colors}
+
+    rows = Product.query.options(
+        selectinload(Product.variants).selectinload(ProductVariant.images),
+        selectinload(Product.colors)
+    ).order_by(Product.id).all()
+    products = tuple(CatalogProduct(p, categories_by_id, colors_by_id) for p in rows)
+
+    return CatalogSnapshot(version, products, categories, colors,
+                           closure=load_closure_map(), groups=load_category_groups())
+
+
+def get_catalog_snapshot():
+    """Return the current snapshot, rebuilding it if another worker bumped the version."""
+    global _snapshot, _checked_at
+
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return snapshot
+    # Keep serving what we have through an outage instead of waiting on the pool
+    if snapshot is not None and not database_available():
+        _checked_at = now
+        return snapshot
+
+    try:
+        version = _read_version()
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ Could not read catalog version: {e}")
+        db.session.rollback()
+        if snapshot is not None:
+            _checked_at = now
+            return snapshot
+        version = 0
+
+    if snapshot is not None and snapshot.version == version:
+        _checked_at = now
+        return snapshot
+
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            started = time.monotonic()
+            _snapshot = _build_snapshot(version)
+            current_app.logger.info(
+                f"✅ Catalog snapshot v{version} loaded: {len(_snapshot.products)} products "
+                f"in {(time.monotonic() - started) * 1000:.0f}ms"
+            )
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def responsive_image(url):
+    """
+    Snapshot image for a template image URL, or None. Templates use it for
+    srcset/LQIP when the image has renditions; the plain URL stays the fallback.
+    """
+    if not url:
+        return None
+    if not url.startswith(('/static/', 'http')):
+        url = f"/static/{url.lstrip('/')}"
+    image = get_catalog_snapshot().images_by_url.get(url)
+    return image if image is not None and image.renditions else None
+
+
+def invalidate_catalog_snapshot():
+    """Force the next read in this worker to re-check the shared version."""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def _version_bump(scope):
+    table = CatalogVersion.__table__
+    return table.update().where(table.c.scope == scope).values(version=table.c.version + 1)
+
+
+def bump_catalog_version(session=None, scope=CATALOG_SCOPE):
+    """Increment the shared version; use after raw SQL writes that bypass the ORM."""
+    (session or db.session).execute(_version_bump(scope))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_catalog_write(session, flush_context):
+    if session.info.get('catalog_bumped'):
+        return
+    touched = any(isinstance(obj, CATALOG_MODELS) for obj in session.new) or \
+        any(isinstance(obj, CATALOG_MODELS) for obj in session.deleted) or \
+        any(isinstance(obj, CATALOG_MODELS) and session.is_modified(obj) for obj in session.dirty)
+    if touched:
+        session.connection().execute(_version_bump(CATALOG_SCOPE))
+        session.info['catalog_bumped'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('catalog_bumped', False):
+        invalidate_catalog_snapshot()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_after_rollback(session):
+    session.info.pop('catalog_bumped', None)
@@ -0,0 +1,81 @@
+"""
+Category closure index and listing groups
+"""
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from routes import db
+from models import Category, CategoryClosure, CategoryGroup
+
+
+def compute_closure(pairs):
+    """
+    Build closure rows from (id, parent_id) pairs.
+
+    Returns a list of (ancestor_id, descendant_id, depth) tuples, including
+    each category as its own ancestor at depth 0. Cycles are cut at the
+    first repeated ancestor rather than looping forever.
+    """
+    parents = dict(pairs)
+    rows = []
+    for category_id in parents:
+        seen = set()
+        node, depth = category_id, 0
+        while node is not None and node not in seen:
+            seen.add(node)
+            rows.append((node, category_id, depth))
+            node, depth = parents.get(node), depth + 1
+    return rows
+
+
+def rebuild_category_closure(connection):
+    """Replace the closure table from the current categories rows."""
+    categories = Category.__table__
+    closure = CategoryClosure.__table__
+
+    pairs = connection.execute(select(categories.c.id, categories.c.parent_id)).all()
+    rows = compute_closure(pairs)
+
+    connection.execute(closure.delete())
+    if rows:
+        connection.execute(
+            closure.insert(),
+            [{'ancestor_id': a, 'descendant_id': d, 'depth': depth} for a, d, depth in rows],
+        )
+    return len(rows)
+
+
+def descendant_ids_query(category_id):
+    """SELECT of the category id and all ids beneath it, for use in IN (...)."""
+    return select(CategoryClosure.descendant_id).where(CategoryClosure.ancestor_id == category_id)
+
+
+def get_descendant_ids(category_id):
+    return [row[0] for row in db.session.execute(descendant_ids_query(category_id))]
+
+
+def load_closure_map():
+    """Map each ancestor id to the ids of its whole subtree."""
+    descendants = {}
+    for ancestor_id, descendant_id in db.session.query(CategoryClosure.ancestor_id,
+                                                        CategoryClosure.descendant_id):
+        descendants.setdefault(ancestor_id, set()).add(descendant_id)
+    return descendants
+
+
+def load_category_groups():
+    """Map group slug to (display name, set of category ids)."""
+    groups = {}
+    for group in CategoryGroup.query.order_by(CategoryGroup.id).all():
+        name, ids = groups.setdefault(group.slug, (group.name, set()))
+        ids.add(group.category_id)
+    return groups
+
+
+@event.listens_for(Session, 'after_flush')
+def _rebuild_on_category_write(session, flush_context):
+    touched = any(isinstance(obj, Category) for obj in session.new) or \
+        any(isinstance(obj, Category) for obj in session.deleted) or \
+        any(isinstance(obj, Category) and session.is_modified(obj) for obj in session.dirty)
+    if touched:
+        rebuild_category_closure(session.connection())
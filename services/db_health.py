@@ -0,0 +1,169 @@
+"""
+Database health monitor: a background probe and a circuit breaker routes check before querying
+"""
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DisconnectionError
+
+STATE_CLOSED = 'closed'   # database reachable, requests query normally
+STATE_OPEN = 'open'       # requests fail fast to fallbacks until a probe succeeds
+
+MAX_ERROR_LENGTH = 300
+
+
+class DatabaseUnavailable(DisconnectionError):
+    """Raised instead of querying while the breaker is open."""
+
+
+class DatabaseHealth:
+    """
+    Runs SELECT 1 on its own connection every probe_seconds (probe_open_seconds
+    while open) and keeps the breaker state. The breaker opens after
+    failure_threshold consecutive failures, counting both probe failures and
+    connection errors reported by requests; only a successful probe closes it,
+    so while the database is down no request waits on a connect timeout.
+    """
+
+    def __init__(self, app, probe_seconds=5.0, probe_open_seconds=2.0, failure_threshold=3):
+        self.app = app
+        self.probe_seconds = probe_seconds
+        self.probe_open_seconds = probe_open_seconds
+        self.failure_threshold = failure_threshold
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.last_latency_ms = None
+        self.avg_latency_ms = None
+        self.last_error = None
+        self.last_success_at = None
+        self.opened_at = None
+        self.probes = 0
+        self.probe_failures = 0
+        self.reported_failures = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='db-health-probe', daemon=True)
+        self._thread.start()
+
+    @property
+    def available(self):
+        return self.state == STATE_CLOSED
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                self.app.logger.error(f"❌ Database probe crashed: {e}")
+            self._wake.wait(self.probe_seconds if self.available else self.probe_open_seconds)
+            self._wake.clear()
+
+    def probe(self):
+        """One SELECT 1 round trip; returns True when the database answered."""
+        from routes import db
+
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                with db.engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+        except Exception as e:
+            with self._lock:
+                self.probes += 1
+                self.probe_failures += 1
+            self._record_failure(e)
+            return False
+
+        latency_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.probes += 1
+            self.last_latency_ms = latency_ms
+            self.avg_latency_ms = latency_ms if self.avg_latency_ms is None else \
+                0.8 * self.avg_latency_ms + 0.2 * latency_ms
+            self.last_success_at = time.time()
+            self.consecutive_failures = 0
+            reopened = self.state == STATE_OPEN
+            if reopened:
+                outage = time.monotonic() - self.opened_at
+                self.state = STATE_CLOSED
+                self.opened_at = None
+        if reopened:
+            self.app.logger.info(f"✅ Database reachable again after {outage:.0f}s; circuit closed")
+        return True
+
+    def report_failure(self, error):
+        """A request hit a connection error; counts toward opening the breaker."""
+        with self._lock:
+            self.reported_failures += 1
+        self._record_failure(error)
+        # Confirm (or clear) quickly rather than waiting out the probe interval
+        self._wake.set()
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:MAX_ERROR_LENGTH]
+            opened = self.state == STATE_CLOSED and self.consecutive_failures >= self.failure_threshold
+            if opened:
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+        if opened:
+            self.app.logger.error(
+                f"❌ Database circuit opened after {self.failure_threshold} consecutive failures: {self.last_error}"
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'last_latency_ms': round(self.last_latency_ms, 1) if self.last_latency_ms is not None else None,
+                'avg_latency_ms': round(self.avg_latency_ms, 1) if self.avg_latency_ms is not None else None,
+                'last_success_at': self.last_success_at,
+                'open_for_seconds': round(time.monotonic() - self.opened_at, 1) if self.opened_at else None,
+                'last_error': self.last_error,
+                'probes': self.probes,
+                'probe_failures': self.probe_failures,
+                'reported_failures': self.reported_failures,
+                'times_opened': self.times_opened,
+            }
+
+
+_monitor = None
+
+
+def init_db_health(app):
+    """Start this process's probe; without it every check reports the database as available."""
+    global _monitor
+    if _monitor is not None or not app.config.get('DB_HEALTH_ENABLED', True):
+        return _monitor
+    _monitor = DatabaseHealth(
+        app,
+        probe_seconds=app.config.get('DB_HEALTH_PROBE_SECONDS', 5.0),
+        probe_open_seconds=app.config.get('DB_HEALTH_PROBE_OPEN_SECONDS', 2.0),
+        failure_threshold=app.config.get('DB_HEALTH_FAILURE_THRESHOLD', 3),
+    )
+    app.logger.info("✅ Database health probe started")
+    return _monitor
+
+
+def database_available():
+    """False while the breaker is open; never touches the database."""
+    return _monitor is None or _monitor.available
+
+
+def ensure_database_available():
+    if not database_available():
+        raise DatabaseUnavailable('Database circuit is open')
+
+
+def report_db_failure(error):
+    if _monitor is not None:
+        _monitor.report_failure(error)
+
+
+def db_health_stats():
+    return _monitor.stats() if _monitor is not None else None
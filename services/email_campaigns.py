@@ -0,0 +1,313 @@
+"""
+Marketing email campaigns: streamed recipients, one render, concurrent rate-limited sends
+"""
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import requests
+from flask import current_app, render_template
+from markupsafe import escape
+from sqlalchemy import or_, update
+
+from routes import db
+from models import EmailCampaign, Product, User
+from email_utils import send_email_sendlayer
+
+CAMPAIGN_TEMPLATES = {
+    'new_product': 'emails/new_product.html',
+    'sale': 'emails/sale.html',
+    'newsletter': 'emails/newsletter.html',
+}
+
+# Stand-ins rendered into the template once, then swapped for each recipient.
+# Plain word characters so Jinja autoescaping leaves them untouched.
+NAME_TOKEN = '__LMN_RECIPIENT_NAME__'
+ID_TOKEN = '__LMN_RECIPIENT_ID__'
+EMAIL_TOKEN = '__LMN_RECIPIENT_EMAIL__'
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Thread-safe token bucket; rate <= 0 disables limiting."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _products_by_ids(ids, fallback_limit):
+    if not ids:
+        return Product.query.limit(fallback_limit).all()
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+    return [products[i] for i in ids if i in products]
+
+
+def _template_context(kind, params):
+    if kind == 'new_product':
+        product = db.session.get(Product, params['product_id'])
+        if product is None:
+            raise ValueError(f"Product {params['product_id']} not found")
+        return {'product': product}
+    if kind == 'sale':
+        return {
+            'sale_title': params.get('sale_title'),
+            'sale_description': params.get('sale_description'),
+            'discount_percent': params.get('discount_percent'),
+            'products': _products_by_ids(params.get('product_ids'), 6),
+        }
+    if kind == 'newsletter':
+        return {
+            'content': params.get('content'),
+            'featured_products': _products_by_ids(params.get('product_ids'), 4),
+        }
+    raise ValueError(f"Unknown campaign kind '{kind}'")
+
+
+def render_campaign(campaign):
+    """Render the campaign body once with recipient placeholders."""
+    params = json.loads(campaign.params or '{}')
+    placeholder = SimpleNamespace(full_name=NAME_TOKEN, id=ID_TOKEN, email=EMAIL_TOKEN)
+    return render_template(CAMPAIGN_TEMPLATES[campaign.kind], user=placeholder,
+                           **_template_context(campaign.kind, params))
+
+
+def personalize(body, recipient):
+    return (body
+            .replace(NAME_TOKEN, str(escape(recipient.full_name or '')))
+            .replace(ID_TOKEN, str(recipient.id))
+            .replace(EMAIL_TOKEN, str(escape(recipient.email))))
+
+
+def iter_recipient_batches(after_id=0, batch_size=500):
+    """
+    Yield opted-in recipients in id order, one keyset page at a time.
+
+    Only the three columns the send needs are loaded, and each page starts
+    after the last id seen, so memory stays flat and a checkpoint is just an id.
+    """
+    last_id = after_id
+    while True:
+        rows = (
+            db.session.query(User.id, User.email, User.full_name)
+            .filter(User.marketing_opt_in.is_(True), User.active.is_(True),
+                    User.email.isnot(None), User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield [SimpleNamespace(id=r.id, email=r.email, full_name=r.full_name) for r in rows]
+        last_id = rows[-1].id
+
+
+def start_campaign(kind, subject, params):
+    """Record a new campaign; call run_campaign() to send it."""
+    if kind not in CAMPAIGN_TEMPLATES:
+        raise ValueError(f"Unknown campaign kind '{kind}'")
+    campaign = EmailCampaign(kind=kind, subject=subject, params=json.dumps(params, default=str),
+                             status='running', last_user_id=0, sent_count=0, failed_count=0)
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign
+
+
+class CampaignSender:
+    """Bounded pool of senders sharing a rate limit, each thread with its own keep-alive session."""
+
+    def __init__(self, app, concurrency, rate_per_second, max_attempts):
+        self.app = app
+        self.max_attempts = max(1, max_attempts)
+        self.limiter = RateLimiter(rate_per_second)
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='campaign')
+
+    def _session(self):
+        http = getattr(self._local, 'session', None)
+        if http is None:
+            http = self._local.session = requests.Session()
+        return http
+
+    def send(self, recipient, subject, body):
+        """Send one email with retries on throttling and transient failures; returns True on success."""
+        with self.app.app_context():
+            for attempt in range(1, self.max_attempts + 1):
+                self.limiter.acquire()
+                try:
+                    send_email_sendlayer(recipient.full_name or recipient.email, recipient.email,
+                                         subject, personalize(body, recipient), session=self._session())
+                    return True
+                except requests.HTTPError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    if status not in RETRYABLE_STATUS or attempt == self.max_attempts:
+                        current_app.logger.error(f"Failed to send campaign email to {recipient.email}: {e}")
+                        return False
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == self.max_attempts:
+                        current_app.logger.error(f"Failed to send campaign email to {recipient.email}: {e}")
+                        return False
+                except Exception as e:
+                    current_app.logger.error(f"Failed to send campaign email to {recipient.email}: {e}")
+                    return False
+                time.sleep(2 ** attempt)
+        return False
+
+    def send_batch(self, recipients, subject, body):
+        results = list(self._pool.map(lambda r: self.send(r, subject, body), recipients))
+        return sum(results), len(results) - sum(results)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def _lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"[:100]
+
+
+def _lease_free(now):
+    return or_(EmailCampaign.locked_until.is_(None), EmailCampaign.locked_until < now)
+
+
+def claim_campaign(campaign_id, owner, lease_seconds):
+    """
+    Take the send lease on a running campaign. A conditional UPDATE, so when
+    two processes try to resume the same campaign only one wins.
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(EmailCampaign)
+        .where(EmailCampaign.id == campaign_id, EmailCampaign.status == 'running',
+               or_(_lease_free(now), EmailCampaign.locked_by == owner))
+        .values(locked_by=owner, locked_until=now + timedelta(seconds=lease_seconds))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _checkpoint(campaign_id, owner, lease_seconds, last_user_id, sent, failed):
+    """Record a finished batch and renew the lease; False if another process took the campaign over."""
+    result = db.session.execute(
+        update(EmailCampaign)
+        .where(EmailCampaign.id == campaign_id, EmailCampaign.locked_by == owner)
+        .values(last_user_id=last_user_id,
+                sent_count=EmailCampaign.sent_count + sent,
+                failed_count=EmailCampaign.failed_count + failed,
+                locked_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _release(campaign_id, owner, **values):
+    db.session.execute(
+        update(EmailCampaign)
+        .where(EmailCampaign.id == campaign_id, EmailCampaign.locked_by == owner)
+        .values(locked_by=None, locked_until=None, **values)
+    )
+    db.session.commit()
+
+
+def run_campaign(campaign_id):
+    """
+    Send (or resume) a campaign.
+
+    The sender holds a lease on the campaign, renewed with the checkpoint
+    after every batch; a campaign leased by another live process is left
+    alone. The checkpoint records the last user id and running counts, so a
+    crash resumes after the last finished batch once the lease expires; at
+    most one batch can be re-sent.
+    """
+    app = current_app._get_current_object()
+    campaign = db.session.get(EmailCampaign, campaign_id)
+    if campaign is None:
+        raise ValueError(f"Campaign {campaign_id} not found")
+    if campaign.status == 'completed':
+        return campaign
+
+    config = app.config
+    owner = _lease_owner()
+    lease_seconds = config.get('EMAIL_CAMPAIGN_LEASE_SECONDS', 600)
+    if not claim_campaign(campaign_id, owner, lease_seconds):
+        db.session.refresh(campaign)
+        app.logger.info(f"⏭️  Campaign #{campaign_id} is being sent by {campaign.locked_by}; skipping")
+        return campaign
+
+    sender = None
+    started = time.monotonic()
+    try:
+        db.session.refresh(campaign)
+        body = render_campaign(campaign)
+        sender = CampaignSender(
+            app,
+            concurrency=config.get('EMAIL_CAMPAIGN_CONCURRENCY', 8),
+            rate_per_second=config.get('EMAIL_CAMPAIGN_RATE_PER_SECOND', 10),
+            max_attempts=config.get('EMAIL_CAMPAIGN_MAX_ATTEMPTS', 3),
+        )
+        app.logger.info(f"📣 Campaign #{campaign.id} ({campaign.kind}) starting after user {campaign.last_user_id}")
+        subject = campaign.subject
+        for batch in iter_recipient_batches(campaign.last_user_id,
+                                            config.get('EMAIL_CAMPAIGN_BATCH_SIZE', 500)):
+            sent, failed = sender.send_batch(batch, subject, body)
+            if not _checkpoint(campaign_id, owner, lease_seconds, batch[-1].id, sent, failed):
+                app.logger.error(f"❌ Campaign #{campaign_id} lease was taken over; stopping this sender")
+                db.session.refresh(campaign)
+                return campaign
+            db.session.refresh(campaign)
+            app.logger.info(
+                f"📬 Campaign #{campaign.id}: {campaign.sent_count} sent, {campaign.failed_count} failed "
+                f"(through user {campaign.last_user_id})"
+            )
+
+        _release(campaign_id, owner, status='completed', completed_at=datetime.utcnow())
+        db.session.refresh(campaign)
+        app.logger.info(
+            f"✅ Campaign #{campaign.id} complete: {campaign.sent_count} sent, "
+            f"{campaign.failed_count} failed in {time.monotonic() - started:.1f}s"
+        )
+    except Exception:
+        db.session.rollback()
+        app.logger.exception(f"❌ Campaign #{campaign_id} stopped; resume with run_campaign({campaign_id})")
+        try:
+            # Let a resume start right away instead of waiting out the lease
+            _release(campaign_id, owner)
+        except Exception:
+            db.session.rollback()
+        raise
+    finally:
+        if sender is not None:
+            sender.shutdown()
+    return campaign
+
+
+def resume_unfinished_campaigns():
+    """Finish every campaign left 'running' by a crash or deploy whose lease has expired."""
+    ids = [
+        row.id for row in
+        EmailCampaign.query.filter(EmailCampaign.status == 'running', _lease_free(datetime.utcnow()))
+        .order_by(EmailCampaign.id)
+    ]
+    return [run_campaign(campaign_id) for campaign_id in ids]
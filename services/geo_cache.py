@@ -0,0 +1,200 @@
+"""
+Shared TTL cache for geocodes, driving distances and delivery quotes
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from routes import db
+from models import GeoCacheEntry
+
+NAMESPACE_GEOCODE = 'geocode'
+NAMESPACE_DISTANCE = 'distance'
+NAMESPACE_QUOTE = 'quote'
+
+DEFAULT_TTLS = {
+    NAMESPACE_GEOCODE: 30 * 24 * 3600,   # buildings don't move
+    NAMESPACE_DISTANCE: 6 * 3600,        # durations drift with traffic
+    NAMESPACE_QUOTE: 300,
+}
+
+# Chance that a write also sweeps expired rows, so the table stays bounded without a cron
+PURGE_PROBABILITY = 0.01
+
+# ~11m at Miami's latitude; close enough that two requests share a driving distance
+COORD_PRECISION = 4
+
+_STREET_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'boulevard': 'blvd', 'road': 'rd', 'drive': 'dr',
+    'court': 'ct', 'lane': 'ln', 'place': 'pl', 'terrace': 'ter', 'highway': 'hwy',
+    'parkway': 'pkwy', 'circle': 'cir', 'suite': 'ste', 'apartment': 'apt',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+}
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_address(*parts):
+    """Lowercase, strip punctuation and abbreviate street words so equivalent spellings share a key."""
+    tokens = []
+    for part in parts:
+        for token in _NON_WORD_RE.split(str(part or '').lower()):
+            if token:
+                tokens.append(_STREET_ABBREVIATIONS.get(token, token))
+    return ' '.join(tokens)
+
+
+def address_key(address_dict):
+    """Normalized key for the checkout address dict (address, suite, city, state, zip)."""
+    return normalize_address(
+        address_dict.get('address'), address_dict.get('suite'), address_dict.get('city'),
+        address_dict.get('state'), address_dict.get('zip'),
+    )
+
+
+def coords_key(coords):
+    """Rounded 'lat,lng' for a (lat, lng) tuple or a {'latitude', 'longitude'} dict."""
+    if isinstance(coords, dict):
+        lat, lng = coords['latitude'], coords['longitude']
+    else:
+        lat, lng = coords[0], coords[1]
+    return f"{round(float(lat), COORD_PRECISION)},{round(float(lng), COORD_PRECISION)}"
+
+
+def digest(*parts):
+    """Stable across processes and restarts, unlike the salted built-in hash()."""
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+class LocalTTLCache:
+    """Per-process LRU with per-entry expiry, in front of the database table."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = LocalTTLCache()
+
+
+def _ttl(namespace):
+    config_key = f"GEO_CACHE_{namespace.upper()}_TTL"
+    return int(current_app.config.get(config_key, DEFAULT_TTLS[namespace]))
+
+
+def cache_get(namespace, key):
+    """
+    Look up a cached value: local LRU first, then the shared table.
+
+    Uses its own connection, so it never touches the request's session or
+    transaction. Returns None on a miss or if the cache is unavailable.
+    """
+    if not has_app_context():
+        return None
+    cache_key = digest(namespace, key)
+    value = _local.get((namespace, cache_key))
+    if value is not None:
+        return value
+
+    now = datetime.utcnow()
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(GeoCacheEntry.value, GeoCacheEntry.expires_at)
+                .where(GeoCacheEntry.namespace == namespace,
+                       GeoCacheEntry.cache_key == cache_key,
+                       GeoCacheEntry.expires_at > now)
+            ).first()
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ geo_cache read failed ({namespace}): {e}")
+        return None
+    if row is None:
+        return None
+
+    value = json.loads(row.value)
+    _local.set((namespace, cache_key), value, (row.expires_at - now).total_seconds())
+    return value
+
+
+def cache_set(namespace, key, value, ttl=None):
+    """Store a value for every worker; failures are logged and otherwise ignored."""
+    if not has_app_context() or value is None:
+        return
+    ttl = _ttl(namespace) if ttl is None else ttl
+    if ttl <= 0:
+        return
+    cache_key = digest(namespace, key)
+    _local.set((namespace, cache_key), value, ttl)
+
+    now = datetime.utcnow()
+    payload = json.dumps(value, default=str)
+    expires_at = now + timedelta(seconds=ttl)
+    try:
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                update(GeoCacheEntry)
+                .where(GeoCacheEntry.namespace == namespace, GeoCacheEntry.cache_key == cache_key)
+                .values(value=payload, expires_at=expires_at, created_at=now)
+            ).rowcount
+            if not updated:
+                conn.execute(GeoCacheEntry.__table__.insert().values(
+                    namespace=namespace, cache_key=cache_key, value=payload,
+                    expires_at=expires_at, created_at=now,
+                ))
+            if random.random() < PURGE_PROBABILITY:
+                conn.execute(delete(GeoCacheEntry).where(GeoCacheEntry.expires_at <= now))
+    except IntegrityError:
+        # Another worker inserted the same key first; its value is just as good
+        pass
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ geo_cache write failed ({namespace}): {e}")
+
+
+def quote_ttl(quote):
+    """Quote TTL, trimmed so a cached quote is never served after the quote itself expires."""
+    ttl = _ttl(NAMESPACE_QUOTE)
+    expires = quote.get('expires') if isinstance(quote, dict) else None
+    if expires:
+        try:
+            expires_at = datetime.fromisoformat(str(expires).replace('Z', '+00:00'))
+            if expires_at.tzinfo is not None:
+                remaining = (expires_at - datetime.now(expires_at.tzinfo)).total_seconds()
+            else:
+                remaining = (expires_at - datetime.now()).total_seconds()
+            ttl = min(ttl, int(remaining) - 60)
+        except ValueError:
+            pass
+    return ttl
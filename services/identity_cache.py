@@ -0,0 +1,176 @@
+"""
+Per-worker cache of signed-in users and their cart/wishlist counts
+"""
+import threading
+import time
+
+from flask import current_app, has_request_context, session
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from routes import db
+from models import User, Cart, Wishlist, CatalogVersion
+from services.db_health import database_available
+
+# catalog_versions scope bumped by any committed change to a user row
+IDENTITY_SCOPE = 'identity'
+
+# Seconds between version polls per worker; local writes invalidate immediately
+VERSION_CHECK_INTERVAL = 5
+
+# Columns whose changes other workers don't need to see promptly
+IGNORED_COLUMNS = frozenset({'last_login'})
+
+# Session key bumped on the shopper's own cart/wishlist writes; it travels
+# with the cookie, so every worker sees their cached counts go stale at once
+COUNTS_GENERATION_KEY = 'counts_gen'
+
+_users = {}    # user id -> (column values, loaded at)
+_counts = {}   # (user id, generation) -> (cart count, wishlist count, loaded at)
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_column_keys = None
+
+
+def _columns():
+    global _column_keys
+    if _column_keys is None:
+        _column_keys = tuple(attr.key for attr in inspect(User).column_attrs)
+    return _column_keys
+
+
+def _evict_oldest(cache, limit):
+    # dicts keep insertion order, so the first keys are the oldest entries
+    while len(cache) > limit:
+        cache.pop(next(iter(cache)))
+
+
+def _check_version():
+    """Drop every cached user when another worker committed a user change."""
+    global _version, _checked_at
+
+    now = time.monotonic()
+    if now - _checked_at < VERSION_CHECK_INTERVAL or not database_available():
+        return
+    try:
+        version = db.session.query(CatalogVersion.version).filter_by(scope=IDENTITY_SCOPE).scalar() or 0
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ Could not read identity version: {e}")
+        db.session.rollback()
+        _checked_at = now
+        return
+    with _lock:
+        if _version is not None and version != _version:
+            _users.clear()
+        _version = version
+        _checked_at = now
+
+
+def _attach(values):
+    """A session-bound User built from cached values, without a SELECT."""
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_identity(user_id):
+    """
+    The User for user_id, attached to the current session so it can be
+    modified and committed as usual. Served from this worker's cache for
+    IDENTITY_CACHE_TTL_SECONDS; another worker's change to the user clears
+    the cache within VERSION_CHECK_INTERVAL. Returns None for unknown users,
+    or on a cache miss while the database is unavailable.
+    """
+    _check_version()
+    with _lock:
+        entry = _users.get(user_id)
+    if entry is not None and time.monotonic() - entry[1] < current_app.config['IDENTITY_CACHE_TTL_SECONDS']:
+        return _attach(entry[0])
+
+    if not database_available():
+        return None
+    user = db.session.get(User, user_id)
+    with _lock:
+        if user is None:
+            _users.pop(user_id, None)
+        else:
+            _users[user_id] = ({key: getattr(user, key) for key in _columns()}, time.monotonic())
+            _evict_oldest(_users, current_app.config['IDENTITY_CACHE_MAX_USERS'])
+    return user
+
+
+def forget_identity(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+# ─────────────────────────────────────────────────────────────
+# Cart / wishlist counts
+# ─────────────────────────────────────────────────────────────
+
+def get_user_counts(user_id):
+    """(cart quantity, wishlist size), cached for USER_COUNTS_TTL_SECONDS."""
+    key = (user_id, session.get(COUNTS_GENERATION_KEY, 0))
+    with _lock:
+        entry = _counts.get(key)
+    if entry is not None and time.monotonic() - entry[2] < current_app.config['USER_COUNTS_TTL_SECONDS']:
+        return entry[0], entry[1]
+
+    cart_count = db.session.query(func.coalesce(func.sum(Cart.quantity), 0)).filter_by(user_id=user_id).scalar()
+    wishlist_count = db.session.query(func.count(Wishlist.id)).filter_by(user_id=user_id).scalar()
+    counts = (int(cart_count or 0), int(wishlist_count or 0))
+    with _lock:
+        _counts[key] = counts + (time.monotonic(),)
+        _evict_oldest(_counts, current_app.config['IDENTITY_CACHE_MAX_USERS'])
+    return counts
+
+
+def bump_counts_generation():
+    """Mark the current shopper's cached counts stale in every worker."""
+    if not has_request_context():
+        return
+    session[COUNTS_GENERATION_KEY] = session.get(COUNTS_GENERATION_KEY, 0) + 1
+
+
+def invalidate_user_counts(user_id):
+    """Call after the shopper changes their wishlist (cart writes bump through cart_store)."""
+    with _lock:
+        for key in [key for key in _counts if key[0] == user_id]:
+            del _counts[key]
+    bump_counts_generation()
+
+
+# ─────────────────────────────────────────────────────────────
+# Invalidation on user writes
+# ─────────────────────────────────────────────────────────────
+
+def _identity_modified(user):
+    state = inspect(user)
+    return any(state.attrs[key].history.has_changes() for key in _columns() if key not in IGNORED_COLUMNS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_user_write(session, flush_context):
+    changed = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    changed |= {obj.id for obj in session.dirty if isinstance(obj, User) and _identity_modified(obj)}
+    if not changed:
+        return
+    pending = session.info.setdefault('identity_changed', set())
+    if not pending:
+        table = CatalogVersion.__table__
+        session.connection().execute(
+            table.update().where(table.c.scope == IDENTITY_SCOPE).values(version=table.c.version + 1)
+        )
+    pending |= changed
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_after_commit(session):
+    for user_id in session.info.pop('identity_changed', ()):
+        forget_identity(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_after_rollback(session):
+    session.info.pop('identity_changed', None)
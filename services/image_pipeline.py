@@ -0,0 +1,292 @@
+"""
+Content-addressed responsive image builds: WebP/AVIF size ladders and LQIP placeholders
+"""
+import base64
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+# Bump when output encoding changes so every image is rebuilt once
+PIPELINE_VERSION = 1
+
+# Rendition widths; sources narrower than a rung stop the ladder at their own width
+WIDTH_LADDER = (320, 640, 960, 1280)
+
+SAVE_OPTIONS = {'webp': {'quality': 80, 'method': 6}, 'avif': {'quality': 55}}
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Renditions live under static/IMG/<OUTPUT_DIRNAME>/<2 hex>/<16 hex>-<tag>-<width>.<format>;
+# the name is the source content hash plus the encoding tag, so URLs are immutable, identical
+# photos share files, and changing the encoder settings produces new files
+OUTPUT_DIRNAME = 'optimized'
+MANIFEST_NAME = 'manifest.json'
+
+LQIP_SIZE = 20
+
+ENCODING_TAG = hashlib.sha256(
+    json.dumps([PIPELINE_VERSION, SAVE_OPTIONS], sort_keys=True).encode()
+).hexdigest()[:6]
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def available_formats():
+    """WebP always; AVIF when this Pillow build (or the pillow-avif-plugin) can write it."""
+    from PIL import features
+    formats = ['webp']
+    try:
+        if features.check('avif'):
+            formats.append('avif')
+    except ValueError:
+        try:
+            import pillow_avif  # noqa: F401  (registers the AVIF encoder)
+            formats.append('avif')
+        except ImportError:
+            pass
+    return tuple(formats)
+
+
+def ladder_for(width):
+    widths = [w for w in WIDTH_LADDER if w < width]
+    widths.append(min(width, WIDTH_LADDER[-1]))
+    return widths
+
+
+def _normalize_mode(img):
+    # Keep transparency (cut-out product shots) and drop palettes/CMYK
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA')
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def generate_placeholder(img, size=(LQIP_SIZE, LQIP_SIZE)):
+    """
+    Tiny blurred stand-in as a data URI, shown while the real image loads.
+    Accepts an open image or a path.
+    """
+    from PIL import Image
+
+    if not isinstance(img, Image.Image):
+        with Image.open(img) as opened:
+            return generate_placeholder(opened, size)
+    small = img.copy()
+    small.thumbnail(size, Image.Resampling.LANCZOS)
+    if small.mode != 'RGB':
+        background = Image.new('RGB', small.size, (255, 255, 255))
+        rgba = small.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        small = background
+    buffer = BytesIO()
+    small.save(buffer, format='JPEG', quality=30)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def render_image(job):
+    """
+    Build every rendition for one source. Runs in a worker process.
+
+    job is (source path, digest, output root, url prefix, formats, force).
+    Files that already exist are content-addressed duplicates and are not
+    re-encoded unless force is set.
+    """
+    from PIL import Image
+
+    source, digest, output_root, url_prefix, formats, force = job
+    try:
+        with Image.open(source) as opened:
+            img = _normalize_mode(opened)
+            width, height = img.size
+            bucket = Path(output_root) / digest[:2]
+            bucket.mkdir(parents=True, exist_ok=True)
+
+            renditions = {fmt: [] for fmt in formats}
+            written = 0
+            # Largest first, each step resized from the previous one to save work
+            current = img
+            for target in sorted(ladder_for(width), reverse=True):
+                if current.width != target:
+                    current = current.resize((target, max(1, round(height * target / width))),
+                                             Image.Resampling.LANCZOS)
+                for fmt in formats:
+                    name = f"{digest[:16]}-{ENCODING_TAG}-{target}.{fmt}"
+                    path = bucket / name
+                    if force or not path.exists():
+                        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+                        current.save(tmp, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+                        os.replace(tmp, path)
+                        written += 1
+                    renditions[fmt].append([target, f"{url_prefix}/{digest[:2]}/{name}"])
+            for ladder in renditions.values():
+                ladder.reverse()
+
+            return {
+                'source': str(source),
+                'hash': digest,
+                'width': width,
+                'height': height,
+                'renditions': renditions,
+                'lqip': generate_placeholder(img),
+                'written': written,
+            }
+    except Exception as e:
+        return {'source': str(source), 'hash': digest, 'error': str(e)}
+
+
+def iter_sources(image_root):
+    output_root = image_root / OUTPUT_DIRNAME
+    for path in sorted(image_root.rglob('*')):
+        if path.suffix.lower() not in SOURCE_EXTENSIONS or not path.is_file():
+            continue
+        # Skip our own output and siblings left by the old optimizer
+        if output_root in path.parents or '.opt.' in path.name:
+            continue
+        yield path
+
+
+def load_manifest(output_root):
+    try:
+        with open(output_root / MANIFEST_NAME) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return {'version': PIPELINE_VERSION, 'images': {}}
+    if manifest.get('version') != PIPELINE_VERSION:
+        return {'version': PIPELINE_VERSION, 'images': {}}
+    return manifest
+
+
+def save_manifest(output_root, manifest):
+    output_root.mkdir(parents=True, exist_ok=True)
+    tmp = output_root / f"{MANIFEST_NAME}.tmp"
+    with open(tmp, 'w') as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+    os.replace(tmp, output_root / MANIFEST_NAME)
+
+
+def _outputs_exist(entry, static_root):
+    return all(
+        (static_root / url[len('/static/'):]).exists()
+        for ladder in entry.get('renditions', {}).values() for _, url in ladder
+    )
+
+
+def build_images(static_root, workers=None, force=False, log=print):
+    """
+    Bring static/IMG/optimized up to date and return (manifest, stats).
+
+    Unchanged sources are recognised by size and mtime, then by content
+    hash, and skipped; so is everything already built with the current
+    ENCODING_TAG (force re-encodes). Changed ones are resized and encoded in a process
+    pool sized to the CPU count, since that work is CPU-bound.
+    """
+    static_root = Path(static_root)
+    image_root = static_root / 'IMG'
+    output_root = image_root / OUTPUT_DIRNAME
+    url_prefix = f"/static/IMG/{OUTPUT_DIRNAME}"
+    formats = available_formats()
+
+    manifest = {'version': PIPELINE_VERSION, 'images': {}} if force else load_manifest(output_root)
+    previous = manifest['images']
+    images = {}
+    pending = {}   # digest -> sources sharing that content
+    stats = {'sources': 0, 'unchanged': 0, 'built': 0, 'files_written': 0, 'errors': 0}
+
+    for path in iter_sources(image_root):
+        stats['sources'] += 1
+        key = path.relative_to(static_root).as_posix()
+        stat = path.stat()
+        entry = previous.get(key)
+        fresh = (entry is not None and entry.get('formats') == list(formats)
+                 and entry.get('tag') == ENCODING_TAG and _outputs_exist(entry, static_root))
+        if fresh and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            images[key] = entry
+            stats['unchanged'] += 1
+            continue
+        digest = file_digest(path)
+        if fresh and entry.get('hash') == digest:
+            images[key] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            stats['unchanged'] += 1
+            continue
+        pending.setdefault(digest, []).append((key, path, stat))
+
+    if pending:
+        workers = workers or os.cpu_count() or 1
+        log(f"🚀 Building {len(pending)} images with {workers} processes ({', '.join(formats)})")
+        jobs = [(str(sources[0][1]), digest, str(output_root), url_prefix, formats, force)
+                for digest, sources in pending.items()]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(render_image, jobs, chunksize=max(1, len(jobs) // (workers * 8))):
+                if 'error' in result:
+                    stats['errors'] += 1
+                    log(f"❌ {result['source']}: {result['error']}")
+                    continue
+                stats['built'] += 1
+                stats['files_written'] += result.pop('written')
+                result.pop('source')
+                for key, _, stat in pending[result['hash']]:
+                    images[key] = dict(result, formats=list(formats), tag=ENCODING_TAG,
+                                       size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    manifest = {'version': PIPELINE_VERSION, 'images': images}
+    save_manifest(output_root, manifest)
+    return manifest, stats
+
+
+def _manifest_key(url):
+    """product_images.url -> manifest key (path relative to static/)."""
+    if url.startswith('http'):
+        return None
+    return url[len('/static/'):] if url.startswith('/static/') else url.lstrip('/')
+
+
+def sync_product_images(manifest):
+    """
+    Copy renditions onto product_images rows whose file was built.
+    Needs an app context; returns the number of rows changed.
+    """
+    from sqlalchemy import bindparam, select, update
+    from routes import db
+    from models import ProductImage
+    from services.catalog_snapshot import bump_catalog_version
+
+    images = manifest['images']
+    changes = []
+    rows = db.session.execute(select(ProductImage.id, ProductImage.url, ProductImage.content_hash,
+                                     ProductImage.renditions))
+    for image_id, url, current_hash, current_renditions in rows:
+        entry = images.get(_manifest_key(url or '') or '')
+        if entry is None:
+            continue
+        # A re-encode keeps the hash but renames the files
+        renditions = json.dumps(entry['renditions'], separators=(',', ':'))
+        if entry['hash'] == current_hash and renditions == current_renditions:
+            continue
+        changes.append({
+            'image_id': image_id,
+            'content_hash': entry['hash'],
+            'width': entry['width'],
+            'height': entry['height'],
+            'renditions': renditions,
+            'lqip': entry['lqip'],
+        })
+    if changes:
+        table = ProductImage.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('image_id')).values(
+                content_hash=bindparam('content_hash'), width=bindparam('width'), height=bindparam('height'),
+                renditions=bindparam('renditions'), lqip=bindparam('lqip'),
+            ),
+            changes,
+        )
+        bump_catalog_version(db.session)
+        db.session.commit()
+    return len(changes)
@@ -0,0 +1,272 @@
+"""
+Set-based stock decrements, exactly once per payment, plus TTL checkout holds
+"""
+import random
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from routes import db
+from models import FORCE_PRODUCT_STOCK_IDS, InventoryCommit, InventoryReservation, Product, ProductVariant
+from services.catalog_snapshot import bump_catalog_version
+
+StockLine = namedtuple('StockLine', 'product_id variant_id quantity')
+
+# Where a line's stock lives: ('product', id) or ('variant', id)
+TARGET_MODELS = {'product': Product, 'variant': ProductVariant}
+
+DEFAULT_RESERVATION_TTL = 900
+
+# Fraction of reserve_stock calls that also sweep long-expired holds
+PURGE_PROBABILITY = 0.02
+
+
+class InsufficientStock(Exception):
+    """Not enough unreserved stock; shortages maps (kind, id) -> (requested, available)."""
+
+    def __init__(self, shortages):
+        super().__init__(f"Insufficient stock for {sorted(shortages)}")
+        self.shortages = shortages
+
+
+class StockAlreadyCommitted(Exception):
+    """Stock for this payment was already taken by another request or webhook delivery."""
+
+
+def stock_lines(items):
+    """
+    StockLine tuples from cart-like items: compute_totals items, Cart rows or
+    {'product'/'product_id', 'variant_id', 'quantity'} dicts.
+    """
+    lines = []
+    for item in items:
+        get = item.get if isinstance(item, dict) else lambda name, default=None: getattr(item, name, default)
+        product_id = get('product_id')
+        if product_id is None and get('product') is not None:
+            product_id = get('product').id
+        quantity = int(get('quantity') or 0)
+        if product_id and quantity > 0:
+            lines.append(StockLine(int(product_id), get('variant_id'), quantity))
+    return lines
+
+
+def resolve_targets(lines, session=None):
+    """
+    Sum line quantities per stock row, following ProductVariant.available_stock:
+    a variant carries its own count only when its product has several variants,
+    isn't forced to product stock, and the variant's count is set.
+    Two column-only queries, whatever the number of lines.
+    """
+    session = session or db.session
+    product_ids = {line.product_id for line in lines}
+    variant_ids = {line.variant_id for line in lines if line.variant_id}
+
+    variants = {}
+    if variant_ids:
+        variants = {
+            row.id: row for row in session.execute(
+                select(ProductVariant.id, ProductVariant.product_id, ProductVariant.quantity_on_hand)
+                .where(ProductVariant.id.in_(variant_ids))
+            )
+        }
+    variant_counts = dict(session.execute(
+        select(ProductVariant.product_id, func.count(ProductVariant.id))
+        .where(ProductVariant.product_id.in_(product_ids))
+        .group_by(ProductVariant.product_id)
+    ).all()) if variant_ids else {}
+
+    targets = Counter()
+    for line in lines:
+        variant = variants.get(line.variant_id)
+        if variant is None or variant.product_id != line.product_id \
+                or line.product_id in FORCE_PRODUCT_STOCK_IDS \
+                or variant_counts.get(line.product_id, 0) <= 1 \
+                or variant.quantity_on_hand is None:
+            targets[('product', line.product_id)] += line.quantity
+        else:
+            targets[('variant', line.variant_id)] += line.quantity
+    return targets
+
+
+def _by_kind(targets):
+    grouped = {}
+    for (kind, target_id), quantity in sorted(targets.items()):
+        grouped.setdefault(kind, {})[target_id] = quantity
+    return grouped
+
+
+def _decrement_statement(model, amounts, clamp=False):
+    """
+    One UPDATE for every row of `model` in amounts ({id: quantity}).
+
+    Guarded form: qty = qty - n WHERE qty >= n, so a short row is skipped
+    and shows up in rowcount. Clamped form floors at zero instead (the
+    payment is already taken; the shortfall is logged, not refused).
+    in_stock is assigned first because MySQL evaluates SET left to right.
+    """
+    quantity = model.quantity_on_hand
+    requested = case(amounts, value=model.id)
+    if clamp:
+        remaining = case((quantity >= requested, quantity - requested), else_=0)
+    else:
+        remaining = quantity - requested
+    statement = update(model).where(model.id.in_(amounts))
+    if not clamp:
+        statement = statement.where(quantity >= requested)
+    return statement.ordered_values(
+        (model.in_stock, case((remaining > 0, model.in_stock), else_=False)),
+        (quantity, remaining),
+    ).execution_options(synchronize_session=False)
+
+
+def _current_stock(grouped, session, lock=False):
+    stock = {}
+    for kind, amounts in grouped.items():
+        model = TARGET_MODELS[kind]
+        query = select(model.id, model.quantity_on_hand).where(model.id.in_(amounts)).order_by(model.id)
+        if lock:
+            query = query.with_for_update()
+        for target_id, quantity in session.execute(query):
+            stock[(kind, target_id)] = quantity or 0
+    return stock
+
+
+def _shortages(targets, available):
+    return {
+        key: (requested, max(0, available.get(key, 0)))
+        for key, requested in targets.items()
+        if available.get(key, 0) < requested
+    }
+
+
+def _mark_catalog_changed(session):
+    # Core UPDATEs skip the ORM flush hook, so bump the shared version here
+    if not session.info.get('catalog_bumped'):
+        bump_catalog_version(session)
+        session.info['catalog_bumped'] = True
+
+
+def commit_order_stock(payment_key, items, allow_oversell=False, reservation_key=None, session=None):
+    """
+    Take stock for a paid order, exactly once per payment_key.
+
+    Inserting the payment key into inventory_commits first serializes
+    parallel deliveries of the same payment: the second insert waits on the
+    first transaction and then fails, raising StockAlreadyCommitted so the
+    caller can return the order the winner created. Stock then moves in one
+    guarded UPDATE per table. Raises InsufficientStock unless allow_oversell,
+    in which case rows are floored at zero. Runs in the caller's transaction;
+    nothing here commits.
+    """
+    session = session or db.session
+    try:
+        with session.begin_nested():
+            session.execute(insert(InventoryCommit).values(payment_key=payment_key, created_at=datetime.utcnow()))
+    except IntegrityError:
+        raise StockAlreadyCommitted(payment_key)
+
+    targets = resolve_targets(stock_lines(items), session)
+    grouped = _by_kind(targets)
+    short = None
+    try:
+        with session.begin_nested():
+            for kind, amounts in grouped.items():
+                if session.execute(_decrement_statement(TARGET_MODELS[kind], amounts)).rowcount != len(amounts):
+                    raise InsufficientStock({})
+    except InsufficientStock:
+        # The savepoint rolled back every table, so current counts are pre-order
+        short = _shortages(targets, _current_stock(grouped, session))
+        if not allow_oversell:
+            raise InsufficientStock(short)
+        current_app.logger.error(f"⚠️ Oversold payment {payment_key}: {short} (requested, available)")
+        for kind, amounts in grouped.items():
+            session.execute(_decrement_statement(TARGET_MODELS[kind], amounts, clamp=True))
+
+    if targets:
+        _mark_catalog_changed(session)
+    if reservation_key:
+        release_reservations(reservation_key, session)
+    return short or {}
+
+
+def reserve_stock(reservation_key, items, ttl=None, session=None):
+    """
+    Hold stock for a checkout until it is paid or the hold expires.
+
+    Replaces any earlier holds under the same key, so re-entering checkout
+    never double-counts. Stock rows are locked in id order while holds by
+    other shoppers are summed, so two checkouts racing for the last unit
+    can't both get it. Raises InsufficientStock; the caller commits.
+    """
+    session = session or db.session
+    if ttl is None:
+        ttl = current_app.config.get('INVENTORY_RESERVATION_TTL_SECONDS', DEFAULT_RESERVATION_TTL)
+    now = datetime.utcnow()
+    if random.random() < PURGE_PROBABILITY:
+        purge_expired_reservations(session)
+
+    targets = resolve_targets(stock_lines(items), session)
+    if not targets:
+        release_reservations(reservation_key, session)
+        return targets
+
+    stock = _current_stock(_by_kind(targets), session, lock=True)
+    held = session.execute(
+        select(InventoryReservation.target_type, InventoryReservation.target_id,
+               func.sum(InventoryReservation.quantity))
+        .where(InventoryReservation.expires_at > now,
+               InventoryReservation.reservation_key != reservation_key,
+               InventoryReservation.target_id.in_({target_id for _, target_id in targets}))
+        .group_by(InventoryReservation.target_type, InventoryReservation.target_id)
+    ).all()
+    available = dict(stock)
+    for kind, target_id, quantity in held:
+        if (kind, target_id) in available:
+            available[(kind, target_id)] -= int(quantity or 0)
+
+    short = _shortages(targets, available)
+    if short:
+        raise InsufficientStock(short)
+
+    release_reservations(reservation_key, session)
+    expires_at = now + timedelta(seconds=ttl)
+    session.execute(insert(InventoryReservation), [
+        {'reservation_key': reservation_key, 'target_type': kind, 'target_id': target_id,
+         'quantity': quantity, 'expires_at': expires_at, 'created_at': now}
+        for (kind, target_id), quantity in sorted(targets.items())
+    ])
+    return targets
+
+
+def release_reservations(reservation_key, session=None):
+    return (session or db.session).execute(
+        delete(InventoryReservation).where(InventoryReservation.reservation_key == reservation_key)
+    ).rowcount
+
+
+def purge_expired_reservations(session=None, grace_seconds=3600):
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    return (session or db.session).execute(
+        delete(InventoryReservation).where(InventoryReservation.expires_at < cutoff)
+    ).rowcount
+
+
+def describe_shortages(shortages):
+    """Human-readable shortage list for API errors."""
+    names = {}
+    product_ids = {target_id for kind, target_id in shortages if kind == 'product'}
+    variant_ids = {target_id for kind, target_id in shortages if kind == 'variant'}
+    if product_ids:
+        names.update({('product', pid): name for pid, name in db.session.execute(
+            select(Product.id, Product.name).where(Product.id.in_(product_ids)))})
+    if variant_ids:
+        names.update({('variant', vid): name for vid, name in db.session.execute(
+            select(ProductVariant.id, Product.name).join(Product, Product.id == ProductVariant.product_id)
+            .where(ProductVariant.id.in_(variant_ids)))})
+    return [
+        {'name': names.get(key, 'Item'), 'requested': requested, 'available': available}
+        for key, (requested, available) in sorted(shortages.items())
+    ]
@@ -0,0 +1,435 @@
+"""
+Durable outbox for Slack and email notifications
+"""
+import json
+import os
+import random
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import requests
+from flask import current_app, render_template
+from sqlalchemy import and_, event, or_, update
+from sqlalchemy.orm import Session
+
+from routes import db
+from models import NotificationOutbox, Order, OrderItem, Product, UberDelivery
+
+KIND_SLACK_ORDER = 'slack_order'
+KIND_SLACK_MANUAL_DELIVERY = 'slack_manual_delivery'
+KIND_SLACK_DELIVERY = 'slack_delivery'
+KIND_EMAIL = 'email'
+KIND_ORDER_CONFIRMATION = 'order_confirmation'
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_DEAD = 'dead'
+
+MAX_ERROR_LENGTH = 2000
+
+
+class PermanentNotificationError(Exception):
+    """A send that will never succeed on retry (missing config, deleted order, 4xx)."""
+
+
+# ── enqueueing ───────────────────────────────────────────────
+
+def enqueue_notification(kind, payload, hold_seconds=0):
+    """
+    Queue a notification in the caller's transaction.
+
+    Nothing is sent until the caller commits, so a rolled-back order never
+    pages the team and a committed one is never lost. hold_seconds delays
+    the first send (see release_notifications).
+    """
+    row = NotificationOutbox(
+        kind=kind,
+        payload=json.dumps(payload, default=str),
+        status=STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=hold_seconds),
+    )
+    db.session.add(row)
+    db.session.info['outbox_enqueued'] = True
+    return row
+
+
+def release_notifications(rows):
+    """
+    Make held rows due now. Callers hold notifications they queue with an
+    order while a slow follow-up step (the Uber dispatch) runs, then release
+    them; if the process dies in between, the hold simply runs out. Caller
+    commits.
+    """
+    ids = [row.id for row in rows if row is not None and row.id is not None]
+    if not ids:
+        return 0
+    result = db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(ids), NotificationOutbox.status == STATUS_PENDING)
+        .values(next_attempt_at=datetime.utcnow())
+    )
+    db.session.info['outbox_enqueued'] = True
+    return result.rowcount
+
+
+def enqueue_order_notification(order, order_items=None, hold_seconds=0):
+    """
+    Queue the new-order Slack alert. order_items are dicts with 'product' and
+    'quantity'; without them the worker reads the order's stored lines.
+    """
+    items = []
+    for item in order_items or ():
+        product = item['product']
+        product_id = product.get('id') if isinstance(product, dict) else product.id
+        items.append({'product_id': product_id, 'quantity': int(item['quantity'])})
+    return enqueue_notification(KIND_SLACK_ORDER, {'order_id': order.id, 'items': items}, hold_seconds)
+
+
+def enqueue_manual_delivery_alert(order, reason, quote_id=None):
+    return enqueue_notification(KIND_SLACK_MANUAL_DELIVERY, {
+        'order_id': order.id,
+        'reason': reason,
+        'quote_id': quote_id,
+    })
+
+
+def enqueue_delivery_notification(order, delivery, event_type):
+    return enqueue_notification(KIND_SLACK_DELIVERY, {
+        'order_id': order.id,
+        'delivery_id': delivery.id,
+        'event_type': event_type,
+    })
+
+
+def enqueue_order_confirmation(order, email_items, totals, hold_seconds=0):
+    """
+    Queue the buyer's confirmation email. It is rendered when sent, so it
+    carries the Uber tracking link if the delivery exists by then.
+    """
+    return enqueue_notification(KIND_ORDER_CONFIRMATION, {
+        'order_id': order.id,
+        'items': email_items,
+        'totals': totals,
+    }, hold_seconds)
+
+
+def enqueue_email(to_name, to_email, subject, html_body, plain_body=""):
+    return enqueue_notification(KIND_EMAIL, {
+        'to_name': to_name,
+        'to_email': to_email,
+        'subject': subject,
+        'html_body': html_body,
+        'plain_body': plain_body,
+    })
+
+
+# ── senders ──────────────────────────────────────────────────
+
+def _require_slack():
+    if not current_app.config.get('SLACK_WEBHOOK_URL'):
+        raise PermanentNotificationError("SLACK_WEBHOOK_URL is not configured")
+
+
+def _load_order(order_id):
+    order = db.session.get(Order, order_id)
+    if order is None:
+        raise PermanentNotificationError(f"Order {order_id} no longer exists")
+    return order
+
+
+def _send_slack_order(payload):
+    from services.slack_notifications import send_order_notification
+
+    _require_slack()
+    order = _load_order(payload['order_id'])
+    quantities = payload.get('items') or []
+    if not quantities:
+        # Older rows (or callers without items) fall back to the stored order lines
+        quantities = [
+            {'product_id': item.product_id, 'quantity': item.quantity}
+            for item in OrderItem.query.filter_by(order_id=order.id).all()
+        ]
+    product_ids = {item['product_id'] for item in quantities}
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()} if product_ids else {}
+    order_items = [
+        {'product': products[item['product_id']], 'quantity': item['quantity']}
+        for item in quantities if item['product_id'] in products
+    ]
+    if not send_order_notification(order, order_items):
+        raise RuntimeError(f"Slack rejected order notification for {order.order_number}")
+
+
+def _send_slack_manual_delivery(payload):
+    from services.slack_notifications import send_manual_delivery_alert
+
+    _require_slack()
+    order = _load_order(payload['order_id'])
+    if not send_manual_delivery_alert(order, payload.get('reason'), payload.get('quote_id')):
+        raise RuntimeError(f"Slack rejected manual delivery alert for {order.order_number}")
+
+
+def _send_slack_delivery(payload):
+    from services.slack_notifications import send_delivery_notification
+
+    _require_slack()
+    order = _load_order(payload['order_id'])
+    delivery = db.session.get(UberDelivery, payload['delivery_id'])
+    if delivery is None:
+        raise PermanentNotificationError(f"Delivery {payload['delivery_id']} no longer exists")
+    if not send_delivery_notification(order, delivery, payload['event_type']):
+        raise RuntimeError(f"Slack rejected {payload['event_type']} notification for {order.order_number}")
+
+
+def _send_email(payload):
+    from email_utils import send_email_sendlayer
+
+    if not os.getenv("SENDLAYER_API_KEY"):
+        raise PermanentNotificationError("SENDLAYER_API_KEY is not set")
+    try:
+        send_email_sendlayer(
+            payload.get('to_name') or payload['to_email'],
+            payload['to_email'],
+            payload['subject'],
+            payload['html_body'],
+            payload.get('plain_body') or "",
+        )
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        # 4xx means the request itself is bad; only throttling is worth retrying
+        if status and 400 <= status < 500 and status != 429:
+            raise PermanentNotificationError(f"SendLayer rejected email ({status})") from e
+        raise
+
+
+def _send_order_confirmation(payload):
+    order = _load_order(payload['order_id'])
+    buyer_email = (order.email or '').strip()
+    if not buyer_email:
+        raise PermanentNotificationError(f"Order {order.order_number} has no email address")
+
+    # Mirrors the success page; SimpleNamespace keeps Jinja off dict.items
+    order_ns = SimpleNamespace(
+        public_id=order.order_number,
+        items=payload['items'],
+        delivery_type=order.delivery_type,
+        delivery_address={
+            "address": order.shipping_address,
+            "suite": order.shipping_suite or '',
+            "city": order.shipping_city,
+            "state": order.shipping_state,
+            "zip": order.shipping_zip,
+        },
+        tracking_url=order.delivery.tracking_url if order.delivery else None,
+        pin_code=order.pin_code,
+    )
+    html_body = render_template(
+        "email_confirmation.html",
+        customer_name=order.full_name or None,
+        order=order_ns,
+        totals=SimpleNamespace(**payload['totals']),
+        now=datetime.utcnow,
+    )
+    subject = f"Order #{order.order_number} confirmed — {current_app.config.get('BRAND_NAME', 'LoveMeNow Miami')}"
+    _send_email({
+        'to_name': order.full_name or "Customer",
+        'to_email': buyer_email,
+        'subject': subject,
+        'html_body': html_body,
+    })
+
+
+SENDERS = {
+    KIND_SLACK_ORDER: _send_slack_order,
+    KIND_SLACK_MANUAL_DELIVERY: _send_slack_manual_delivery,
+    KIND_SLACK_DELIVERY: _send_slack_delivery,
+    KIND_EMAIL: _send_email,
+    KIND_ORDER_CONFIRMATION: _send_order_confirmation,
+}
+
+
+# ── worker ───────────────────────────────────────────────────
+
+def backoff_seconds(attempts, base, cap):
+    """Exponential backoff with ±20% jitter so retries from both workers don't align."""
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxWorker:
+    """Polls the outbox, claims due rows and sends them on a bounded thread pool."""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.threads = max(1, config.get('NOTIFICATION_WORKER_THREADS', 2))
+        self.poll_seconds = config.get('NOTIFICATION_POLL_SECONDS', 5)
+        self.batch_size = config.get('NOTIFICATION_BATCH_SIZE', 20)
+        self.max_attempts = config.get('NOTIFICATION_MAX_ATTEMPTS', 8)
+        self.backoff_base = config.get('NOTIFICATION_BACKOFF_SECONDS', 30)
+        self.backoff_max = config.get('NOTIFICATION_BACKOFF_MAX_SECONDS', 3600)
+        self.lease_seconds = config.get('NOTIFICATION_LEASE_SECONDS', 120)
+        self.wake = threading.Event()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='outbox')
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='outbox-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = []
+            try:
+                with self.app.app_context():
+                    claimed = self.claim_batch()
+            except Exception as e:
+                self.app.logger.error(f"❌ Notification outbox poll failed: {e}")
+
+            if claimed:
+                # Wait for the batch so claims never outrun the pool
+                list(self._pool.map(self._process, claimed))
+                if len(claimed) >= self.batch_size:
+                    continue
+
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+
+    def claim_batch(self):
+        """
+        Claim up to batch_size due rows for this worker.
+
+        Each claim is a conditional UPDATE, so two gunicorn workers racing for
+        the same row can't both win. Rows left in 'sending' by a crashed worker
+        become claimable again once their lease expires.
+        """
+        now = datetime.utcnow()
+        due = or_(
+            and_(NotificationOutbox.status == STATUS_PENDING, NotificationOutbox.next_attempt_at <= now),
+            and_(NotificationOutbox.status == STATUS_SENDING, NotificationOutbox.locked_until < now),
+        )
+        try:
+            candidate_ids = [
+                row_id for (row_id,) in
+                db.session.query(NotificationOutbox.id)
+                .filter(due)
+                .order_by(NotificationOutbox.next_attempt_at, NotificationOutbox.id)
+                .limit(self.batch_size)
+                .all()
+            ]
+            claimed = []
+            lease = now + timedelta(seconds=self.lease_seconds)
+            for row_id in candidate_ids:
+                result = db.session.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.id == row_id, due)
+                    .values(status=STATUS_SENDING, locked_until=lease,
+                            attempts=NotificationOutbox.attempts + 1)
+                )
+                if result.rowcount == 1:
+                    claimed.append(row_id)
+            db.session.commit()
+            return claimed
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _process(self, row_id):
+        with self.app.app_context():
+            try:
+                self.deliver(row_id)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"❌ Notification outbox row {row_id} crashed: {e}")
+
+    def deliver(self, row_id):
+        row = db.session.get(NotificationOutbox, row_id)
+        if row is None or row.status != STATUS_SENDING:
+            return
+        sender = SENDERS.get(row.kind)
+        try:
+            if sender is None:
+                raise PermanentNotificationError(f"Unknown notification kind '{row.kind}'")
+            sender(json.loads(row.payload))
+        except PermanentNotificationError as e:
+            # Roll back anything the sender loaded before recording the outcome
+            db.session.rollback()
+            row = db.session.get(NotificationOutbox, row_id)
+            self._dead_letter(row, str(e))
+        except Exception as e:
+            db.session.rollback()
+            row = db.session.get(NotificationOutbox, row_id)
+            self._retry_or_dead_letter(row, e)
+        else:
+            row.status = STATUS_SENT
+            row.sent_at = datetime.utcnow()
+            row.locked_until = None
+            row.last_error = None
+            current_app.logger.info(f"✅ Sent {row.kind} notification #{row.id} (attempt {row.attempts})")
+        db.session.commit()
+
+    def _retry_or_dead_letter(self, row, error):
+        message = f"{error}\n{traceback.format_exc()}"
+        if row.attempts >= self.max_attempts:
+            self._dead_letter(row, message)
+            return
+        delay = backoff_seconds(row.attempts, self.backoff_base, self.backoff_max)
+        row.status = STATUS_PENDING
+        row.locked_until = None
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        row.last_error = message[:MAX_ERROR_LENGTH]
+        current_app.logger.warning(
+            f"⚠️  {row.kind} notification #{row.id} failed (attempt {row.attempts}/{self.max_attempts}), "
+            f"retrying in {delay:.0f}s: {error}"
+        )
+
+    def _dead_letter(self, row, message):
+        row.status = STATUS_DEAD
+        row.locked_until = None
+        row.last_error = message[:MAX_ERROR_LENGTH]
+        current_app.logger.error(f"🚨 {row.kind} notification #{row.id} dead-lettered: {message.splitlines()[0]}")
+
+
+def requeue_dead_notifications(ids=None):
+    """Move dead-lettered rows (optionally only the given ids) back to pending. Caller commits."""
+    query = update(NotificationOutbox).where(NotificationOutbox.status == STATUS_DEAD)
+    if ids:
+        query = query.where(NotificationOutbox.id.in_(ids))
+    result = db.session.execute(query.values(
+        status=STATUS_PENDING, attempts=0, next_attempt_at=datetime.utcnow(), last_error=None,
+    ))
+    return result.rowcount
+
+
+_worker = None
+
+
+def init_notification_outbox(app):
+    """Start this process's outbox worker (one per gunicorn worker; claims keep them apart)."""
+    global _worker
+    if _worker is not None or not app.config.get('NOTIFICATION_WORKER_ENABLED', True):
+        return _worker
+    _worker = OutboxWorker(app)
+    _worker.start()
+    app.logger.info(f"✅ Notification outbox worker started ({_worker.threads} threads)")
+    return _worker
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker_on_commit(session):
+    if session.info.pop('outbox_enqueued', False) and _worker is not None:
+        _worker.wake.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_enqueue_flag(session):
+    session.info.pop('outbox_enqueued', None)
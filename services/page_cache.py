@@ -0,0 +1,264 @@
+"""
+Server-side full-page cache for the homepage and listing pages
+"""
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, session, Response
+from flask_login import UserMixin, current_user
+from flask_wtf.csrf import generate_csrf
+
+from routes import db
+from services.catalog_snapshot import get_catalog_snapshot
+from services.db_health import database_available
+
+# Rendered in place of the CSRF token and swapped for the shopper's own on every hit
+CSRF_PLACEHOLDER = '__page_cache_csrf_token_7f3a9c__'
+
+# Ad and analytics parameters that don't change the page; dropped from the key
+# so every click from a campaign shares one entry
+TRACKING_PARAMS = frozenset({'gclid', 'gbraid', 'wbraid', 'fbclid', 'msclkid', 'dclid', 'ttclid',
+                             'mc_cid', 'mc_eid', '_ga', '_gl'})
+TRACKING_PREFIXES = ('utm_',)
+
+# Headers from the rendered response worth replaying on hits
+REPLAYED_HEADERS = ('Content-Type', 'Cache-Control', 'Vary', 'Location')
+
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+_DEFLATE_END = b'\x03\x00'  # empty final block
+
+
+class _SkeletonUser(UserMixin):
+    """Stands in for any signed-in shopper while a shared page is rendered."""
+    id = None
+
+
+def _deflate(data):
+    # Raw deflate, flushed to a byte boundary with no back-references, so
+    # separately compressed pieces can be concatenated into one stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+class CachedPage:
+    """
+    A rendered page split at the CSRF placeholder. Each static piece is
+    compressed once; hits only compress the token and stitch the gzip stream.
+    """
+    __slots__ = ('segments', 'compressed', 'status', 'headers', 'version', 'created_at')
+
+    def __init__(self, body, status, headers, version):
+        self.segments = body.split(CSRF_PLACEHOLDER.encode())
+        self.compressed = [_deflate(segment) for segment in self.segments]
+        self.status = status
+        self.headers = headers
+        self.version = version
+        self.created_at = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def body(self, token):
+        return token.join(self.segments)
+
+    def gzip_body(self, token):
+        token_deflated = _deflate(token)
+        parts = [_GZIP_HEADER]
+        crc = 0
+        size = 0
+        last = len(self.segments) - 1
+        for i, (segment, deflated) in enumerate(zip(self.segments, self.compressed)):
+            parts.append(deflated)
+            crc = zlib.crc32(segment, crc)
+            size += len(segment)
+            if i < last:
+                parts.append(token_deflated)
+                crc = zlib.crc32(token, crc)
+                size += len(token)
+        parts.append(_DEFLATE_END)
+        parts.append(struct.pack('<II', crc, size & 0xffffffff))
+        return b''.join(parts)
+
+    def respond(self, state):
+        token = generate_csrf().encode() if len(self.segments) > 1 else b''
+        if request.accept_encodings['gzip'] > 0:
+            response = Response(self.gzip_body(token), status=self.status, headers=self.headers)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(self.body(token), status=self.status, headers=self.headers)
+        response.headers['Vary'] = 'Accept-Encoding, Cookie'
+        response.headers['X-Page-Cache'] = state
+        return response
+
+
+# ─────────────────────────────────────────────────────────────
+# Storage (per worker)
+# ─────────────────────────────────────────────────────────────
+
+_pages = OrderedDict()
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def _lookup(key):
+    with _lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+        return page
+
+
+def _store(key, page):
+    with _lock:
+        _pages[key] = page
+        _pages.move_to_end(key)
+        while len(_pages) > current_app.config['PAGE_CACHE_MAX_ENTRIES']:
+            _pages.popitem(last=False)
+
+
+def clear_page_cache():
+    with _lock:
+        _pages.clear()
+
+
+def page_cache_stats():
+    with _lock:
+        return {'entries': len(_pages), 'refreshing': len(_refreshing)}
+
+
+# ─────────────────────────────────────────────────────────────
+# Rendering
+# ─────────────────────────────────────────────────────────────
+
+def skip_page_cache():
+    """Call from a view whose output shouldn't be shared (e.g. a degraded fallback)."""
+    g.page_cache_skip = True
+
+
+def rendering_page_skeleton():
+    """True while a view is rendering the shared copy of a page."""
+    return g.get('page_cache_render', False)
+
+
+def _normalized_query():
+    return tuple(sorted(
+        (k, v) for k, v in request.args.items(multi=True)
+        if k not in TRACKING_PARAMS and not k.startswith(TRACKING_PREFIXES)
+    ))
+
+
+def _cache_key():
+    """(path, query, age verified, logged in), or None when this request can't share a page."""
+    if not current_app.config['PAGE_CACHE_ENABLED'] or request.method != 'GET':
+        return None
+    # Flashed messages are one-shot and personal
+    if '_flashes' in session:
+        return None
+    age_verified = bool(session.get('age_verified') or request.cookies.get('age_verified') == '1')
+    return request.path, _normalized_query(), age_verified, bool(current_user.is_authenticated)
+
+
+def _current_version():
+    if not database_available():
+        return None
+    try:
+        return get_catalog_snapshot().version
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ Page cache could not read catalog version: {e}")
+        db.session.rollback()
+        return None
+
+
+def _render(view, view_args, key, base_url):
+    """
+    Render the view for key in a clean request context: anonymous session
+    (bar the age flag), a stand-in user, and the CSRF placeholder in place
+    of a real token. Returns (CachedPage, shareable).
+    """
+    app = current_app._get_current_object()
+    path, query, age_verified, logged_in = key
+    version = _current_version()
+    # Inside a live request the nested context shares its app context and g
+    saved = dict(g.__dict__)
+    try:
+        with app.test_request_context(path, base_url=base_url, query_string=list(query)):
+            g.pop('page_cache_skip', None)
+            if age_verified:
+                session['age_verified'] = True
+            g._login_user = _SkeletonUser() if logged_in else app.login_manager.anonymous_user()
+            g.csrf_token = CSRF_PLACEHOLDER
+            g.page_cache_render = True
+            response = app.make_response(view(**view_args))
+            shareable = not g.get('page_cache_skip') and response.status_code == 200 and version is not None
+    finally:
+        g.__dict__.clear()
+        g.__dict__.update(saved)
+
+    headers = [(name, response.headers[name]) for name in REPLAYED_HEADERS if name in response.headers]
+    return CachedPage(response.get_data(), response.status_code, headers, version), shareable
+
+
+def _refresh(app, view, view_args, key, base_url):
+    try:
+        with app.app_context():
+            page, shareable = _render(view, view_args, key, base_url)
+            if shareable:
+                _store(key, page)
+    except Exception as e:
+        app.logger.warning(f"⚠️ Page cache refresh failed for {key[0]}: {e}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def _schedule_refresh(view, view_args, key):
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    app = current_app._get_current_object()
+    threading.Thread(
+        target=_refresh, args=(app, view, view_args, key, request.host_url),
+        name='page-cache-refresh', daemon=True,
+    ).start()
+
+
+def cached_page(view):
+    """
+    Serve the view from the page cache (stale-while-revalidate).
+
+    Entries are fresh for PAGE_CACHE_TTL_SECONDS and while the catalog
+    version is unchanged; after that, for PAGE_CACHE_STALE_SECONDS more, the
+    old copy is served while one background thread re-renders it. If the
+    catalog version can't be read (database trouble), whatever copy exists
+    is served. The CSRF token is the only per-shopper fragment in these
+    pages; cart and wishlist counts are fetched client-side.
+    """
+    @wraps(view)
+    def wrapper(**view_args):
+        key = _cache_key()
+        if key is None:
+            return view(**view_args)
+
+        page = _lookup(key)
+        if page is not None:
+            version = _current_version()
+            age = page.age()
+            if version is None:
+                return page.respond('STALE')
+            if version == page.version and age < current_app.config['PAGE_CACHE_TTL_SECONDS']:
+                return page.respond('HIT')
+            if age < current_app.config['PAGE_CACHE_TTL_SECONDS'] + current_app.config['PAGE_CACHE_STALE_SECONDS']:
+                _schedule_refresh(view, view_args, key)
+                return page.respond('STALE')
+
+        page, shareable = _render(view, view_args, key, request.host_url)
+        if shareable:
+            _store(key, page)
+        return page.respond('MISS')
+
+    return wrapper
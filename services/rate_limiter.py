@@ -0,0 +1,276 @@
+"""
+Sliding-window rate limiting shared by every worker on the host
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from flask import current_app, request
+
+# One budget per rule: `limit` requests per `window` seconds, per client.
+# Rules match by path prefix, most specific first; limit None means exempt.
+RateRule = namedtuple('RateRule', 'name prefix limit window')
+
+DEFAULT_RULES = (
+    RateRule('static', '/static/', None, 60),
+    RateRule('webhooks', '/webhooks/', None, 60),   # Stripe/Uber retries must never be throttled
+    RateRule('health', '/api/health', None, 60),
+    RateRule('quote', '/api/uber/quote', 10, 60),
+    RateRule('cart_add', '/api/cart/add', 30, 60),
+    RateRule('discount', '/api/cart/apply-discount', 10, 60),
+    RateRule('discount', '/api/apply-discount', 10, 60),
+    RateRule('discount', '/api/validate-discount', 10, 60),
+    RateRule('login', '/auth/login', 10, 60),
+    RateRule('register', '/auth/register', 5, 60),
+    RateRule('checkout', '/api/create-checkout-session', 10, 60),
+    RateRule('checkout', '/api/create-order', 10, 60),
+    RateRule('search', '/api/search', 120, 60),
+)
+DEFAULT_BUDGET = RateRule('default', '', 60, 60)
+
+# Violations are aggregated per (ip, rule) and written as one AuditLog row each per flush
+VIOLATION_FLUSH_SECONDS = 10
+
+# Every this many checks, drop counters idle for two full windows
+SWEEP_EVERY_CHECKS = 5000
+
+
+def match_rule(path, rules=DEFAULT_RULES, default=DEFAULT_BUDGET):
+    best = None
+    for rule in rules:
+        if path.startswith(rule.prefix) and (best is None or len(rule.prefix) > len(best.prefix)):
+            best = rule
+    return best or default
+
+
+def client_ip(trusted_proxies=1):
+    """
+    Client address, looking through `trusted_proxies` reverse proxies.
+
+    Proxies append to X-Forwarded-For, so only the last `trusted_proxies`
+    entries are trustworthy; anything earlier can be forged by the client.
+    """
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    if trusted_proxies > 0 and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if hops:
+            return hops[max(len(hops) - trusted_proxies, 0)]
+    return request.remote_addr or 'unknown'
+
+
+def sliding_window(state, now, limit, window):
+    """
+    Pure sliding-window-counter step.
+
+    state is (window_start, current_count, previous_count) or None. The
+    previous window's count is weighted by how much of it still overlaps the
+    sliding window, which approximates a true sliding log in O(1) space.
+    Returns (allowed, new_state, retry_after_seconds).
+    """
+    window_start = now - (now % window)
+    if state is None:
+        current, previous = 0, 0
+    else:
+        start, current, previous = state
+        if start == window_start:
+            pass
+        elif start == window_start - window:
+            current, previous = 0, current
+        else:
+            current, previous = 0, 0
+
+    elapsed = now - window_start
+    estimate = previous * (window - elapsed) / window + current
+    if estimate + 1 > limit:
+        retry_after = max(1, int(window - elapsed) + 1) if current >= limit else 1
+        return False, (window_start, current, previous), retry_after
+    return True, (window_start, current + 1, previous), 0
+
+
+class MemoryRateStore:
+    """Per-process counters; each gunicorn worker enforces its own budget."""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        with self._lock:
+            allowed, state, retry_after = sliding_window(self._state.get(key), now, limit, window)
+            self._state[key] = state
+            return allowed, retry_after
+
+    def sweep(self, older_than):
+        with self._lock:
+            for key in [k for k, (start, _, _) in self._state.items() if start < older_than]:
+                del self._state[key]
+
+
+class SQLiteRateStore:
+    """
+    Counters in a host-local SQLite file (in /dev/shm when available) so all
+    workers share one budget without a round trip to MySQL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_counters (
+                key TEXT PRIMARY KEY,
+                window_start INTEGER NOT NULL,
+                current INTEGER NOT NULL,
+                previous INTEGER NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, window, now):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT window_start, current, previous FROM rate_counters WHERE key = ?', (key,)
+            ).fetchone()
+            allowed, state, retry_after = sliding_window(row, now, limit, window)
+            if state != row:
+                conn.execute(
+                    'INSERT OR REPLACE INTO rate_counters (key, window_start, current, previous) '
+                    'VALUES (?, ?, ?, ?)', (key,) + state
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def sweep(self, older_than):
+        self._connection().execute('DELETE FROM rate_counters WHERE window_start < ?', (older_than,))
+
+
+def _default_store_path():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'lovemenow_rate_limits.sqlite3')
+
+
+class ViolationLog:
+    """Aggregates rate-limit violations and hands them to the audit writer once per interval."""
+
+    def __init__(self, app, interval=VIOLATION_FLUSH_SECONDS):
+        self.app = app
+        self.interval = interval
+        self._counts = Counter()
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='rate-limit-log', daemon=True)
+        self._thread.start()
+
+    def record(self, ip, rule, url, user_agent, user_id):
+        with self._lock:
+            self._counts[(ip, rule.name)] += 1
+            self._samples[(ip, rule.name)] = (url, user_agent, user_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Failed to log rate limit violations: {e}")
+
+    def flush(self):
+        with self._lock:
+            counts, samples = self._counts, self._samples
+            self._counts, self._samples = Counter(), {}
+        if not counts:
+            return 0
+
+        from services.audit_writer import audit_row, enqueue_audit
+
+        now = datetime.utcnow()
+        rows = []
+        for (ip, rule_name), count in counts.items():
+            url, user_agent, user_id = samples[(ip, rule_name)]
+            rows.append(audit_row(
+                'rate_limit_exceeded',
+                user_id=user_id,
+                resource_type='rate_limit',
+                resource_id=rule_name,
+                details=f"IP: {ip}, Rule: {rule_name}, Blocked: {count}, Last URL: {url}",
+                ip_address=ip,
+                user_agent=user_agent,
+                status='warning',
+                created_at=now,
+            ))
+        if all(enqueue_audit(row) for row in rows):
+            return len(rows)
+
+        from routes import db
+        from models import AuditLog
+
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(AuditLog.__table__.insert(), rows)
+        return len(rows)
+
+
+class RateLimiter:
+    """Per-route sliding-window budgets over a pluggable counter store."""
+
+    def __init__(self, app):
+        config = app.config
+        self.enabled = config.get('RATE_LIMIT_ENABLED', True)
+        self.rules = tuple(RateRule(*rule) for rule in config.get('RATE_LIMIT_RULES', DEFAULT_RULES))
+        default_limit, default_window = config.get('RATE_LIMIT_DEFAULT', (DEFAULT_BUDGET.limit, DEFAULT_BUDGET.window))
+        self.default = RateRule('default', '', default_limit, default_window)
+        self.trusted_proxies = config.get('RATE_LIMIT_TRUSTED_PROXIES', 1)
+        self.max_window = max([r.window for r in self.rules] + [self.default.window])
+        self._checks = 0
+        if not self.enabled:
+            return
+
+        backend = config.get('RATE_LIMIT_BACKEND', 'sqlite')
+        if backend == 'memory':
+            self.store = MemoryRateStore()
+        else:
+            self.store = SQLiteRateStore(config.get('RATE_LIMIT_STORE_PATH') or _default_store_path())
+        self.violations = ViolationLog(app)
+
+    def check(self):
+        """Return (allowed, retry_after_seconds) for the current request."""
+        if not self.enabled:
+            return True, 0
+        rule = match_rule(request.path, self.rules, self.default)
+        if rule.limit is None:
+            return True, 0
+
+        ip = client_ip(self.trusted_proxies)
+        now = int(time.time())
+        try:
+            allowed, retry_after = self.store.hit(f"{rule.name}:{ip}", rule.limit, rule.window, now)
+            self._checks += 1
+            if self._checks % SWEEP_EVERY_CHECKS == 0:
+                self.store.sweep(now - 2 * self.max_window)
+        except Exception as e:
+            # A broken counter store must not take the site down; fail open
+            current_app.logger.error(f"Rate limiter store error: {e}")
+            return True, 0
+
+        if not allowed:
+            from flask_login import current_user
+            user_id = current_user.id if current_user.is_authenticated else None
+            self.violations.record(ip, rule, request.url, request.headers.get('User-Agent'), user_id)
+        return allowed, retry_after
@@ -0,0 +1,268 @@
+"""
+Related-products index: co-purchases, category proximity and shared colors
+"""
+import heapq
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import groupby, permutations
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from routes import db
+from models import CatalogVersion, OrderItem, ProductNeighbors
+
+# catalog_versions scope bumped by each offline rebuild so workers reload
+RELATED_SCOPE = 'related'
+
+# Score weights. Co-purchases are linear in the number of shared orders so a
+# new order can be folded in exactly by adding W_COPURCHASE per pair.
+W_COPURCHASE = 5.0
+W_SAME_CATEGORY = 3.0
+W_SIBLING_CATEGORY = 1.5
+W_SHARED_COLOR = 0.5
+MAX_SHARED_COLORS = 2
+
+# Neighbors kept per product; reads filter for stock, so keep more than are shown
+NEIGHBORS_PER_PRODUCT = 16
+
+# Orders with more distinct products than this are bulk buys and say little about affinity
+MAX_BASKET = 25
+
+# Seconds between polls for orders placed since the index was built
+ORDER_POLL_INTERVAL = 60
+
+
+def base_score(product, other):
+    """Catalog-only affinity between two snapshot products."""
+    score = 0.0
+    if product.category_id == other.category_id:
+        score += W_SAME_CATEGORY
+    elif product.category and other.category and product.category.parent_id is not None \
+            and product.category.parent_id == other.category.parent_id:
+        score += W_SIBLING_CATEGORY
+    if product.colors and other.colors:
+        shared = len({c.id for c in product.colors} & {c.id for c in other.colors})
+        score += W_SHARED_COLOR * min(shared, MAX_SHARED_COLORS)
+    return score
+
+
+def iter_baskets(after_order_id=0, limit=None):
+    """Yield (order_id, product ids) for orders after `after_order_id`, streamed in order id order."""
+    query = (
+        select(OrderItem.order_id, OrderItem.product_id)
+        .where(OrderItem.order_id > after_order_id)
+        .order_by(OrderItem.order_id)
+    )
+    if limit:
+        query = query.limit(limit)
+    rows = db.session.execute(query.execution_options(yield_per=2000))
+    for order_id, items in groupby(rows, key=lambda row: row[0]):
+        yield order_id, {product_id for _, product_id in items}
+
+
+def basket_pairs(products):
+    if 2 <= len(products) <= MAX_BASKET:
+        return permutations(products, 2)
+    return ()
+
+
+def build_neighbors(snapshot):
+    """
+    Score every product against its candidates and keep the best few.
+
+    Candidates are co-purchased products plus those in the same or a sibling
+    category, so the work grows with category sizes, not with the square of
+    the catalog. Returns ({product_id: [[id, score], ...]}, last order id).
+    """
+    copurchases = defaultdict(Counter)
+    last_order_id = 0
+    for order_id, products in iter_baskets():
+        for a, b in basket_pairs(products):
+            copurchases[a][b] += 1
+        last_order_id = order_id
+
+    by_category = defaultdict(list)
+    by_parent = defaultdict(list)
+    for product in snapshot.products:
+        if product.in_active:
+            continue
+        by_category[product.category_id].append(product.id)
+        if product.category and product.category.parent_id is not None:
+            by_parent[product.category.parent_id].append(product.id)
+
+    products_by_id = snapshot.products_by_id
+    neighbors = {}
+    for product in snapshot.products:
+        if product.in_active:
+            continue
+        candidates = set(copurchases.get(product.id, ()))
+        candidates.update(by_category[product.category_id])
+        if product.category and product.category.parent_id is not None:
+            candidates.update(by_parent[product.category.parent_id])
+        candidates.discard(product.id)
+
+        scored = []
+        for other_id in candidates:
+            other = products_by_id.get(other_id)
+            if other is None or other.in_active:
+                continue
+            score = base_score(product, other) + W_COPURCHASE * copurchases[product.id].get(other_id, 0)
+            scored.append((score, -other_id))
+        best = heapq.nlargest(NEIGHBORS_PER_PRODUCT, scored)
+        neighbors[product.id] = [[-negative_id, round(score, 3)] for score, negative_id in best]
+    return neighbors, last_order_id
+
+
+def _read_version():
+    return db.session.query(CatalogVersion.version).filter_by(scope=RELATED_SCOPE).scalar() or 0
+
+
+def store_neighbors(neighbors, last_order_id, bump=False):
+    now = datetime.utcnow()
+    table = CatalogVersion.__table__
+    with db.engine.begin() as conn:
+        conn.execute(delete(ProductNeighbors))
+        if bump:
+            conn.execute(table.update().where(table.c.scope == RELATED_SCOPE)
+                         .values(version=table.c.version + 1))
+        if neighbors:
+            conn.execute(ProductNeighbors.__table__.insert(), [
+                {'product_id': product_id, 'neighbors': json.dumps(items),
+                 'built_through_order_id': last_order_id, 'built_at': now}
+                for product_id, items in neighbors.items()
+            ])
+
+
+def rebuild_related_index():
+    """Offline build: recompute every neighbor list from scratch and store it. Returns product count."""
+    from services.catalog_snapshot import get_catalog_snapshot
+
+    neighbors, last_order_id = build_neighbors(get_catalog_snapshot())
+    store_neighbors(neighbors, last_order_id, bump=True)
+    _index.reset()
+    return len(neighbors)
+
+
+class RelatedIndex:
+    """
+    In-memory copy of product_neighbors for this worker.
+
+    Loaded once (and again after each offline rebuild), then kept current by
+    polling for orders placed since and folding their co-purchases into the
+    affected lists.
+    """
+
+    def __init__(self):
+        self.neighbors = None
+        self.version = None
+        self.last_order_id = 0
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.neighbors = None
+
+    def _load(self, snapshot):
+        self.version = _read_version()
+        rows = db.session.execute(
+            select(ProductNeighbors.product_id, ProductNeighbors.neighbors,
+                   ProductNeighbors.built_through_order_id)
+        ).all()
+        if rows:
+            self.neighbors = {product_id: json.loads(items) for product_id, items, _ in rows}
+            self.last_order_id = max(built_through for _, _, built_through in rows)
+            return
+        # Never built: build now so the first product page isn't empty, and share it
+        started = time.monotonic()
+        self.neighbors, self.last_order_id = build_neighbors(snapshot)
+        try:
+            store_neighbors(self.neighbors, self.last_order_id)
+        except Exception as e:
+            current_app.logger.warning(f"⚠️ Could not store related-products index: {e}")
+        current_app.logger.info(
+            f"✅ Related-products index built for {len(self.neighbors)} products "
+            f"in {(time.monotonic() - started) * 1000:.0f}ms"
+        )
+
+    def _fold_new_orders(self, snapshot):
+        latest = db.session.execute(select(func.max(OrderItem.order_id))).scalar() or 0
+        if latest <= self.last_order_id:
+            return
+        touched = set()
+        for order_id, products in iter_baskets(self.last_order_id):
+            for a, b in basket_pairs(products):
+                self._bump(snapshot, a, b)
+                touched.add(a)
+            self.last_order_id = order_id
+        for product_id in touched:
+            items = self.neighbors[product_id]
+            items.sort(key=lambda item: (-item[1], item[0]))
+            del items[NEIGHBORS_PER_PRODUCT:]
+
+    def _bump(self, snapshot, a, b):
+        items = self.neighbors.setdefault(a, [])
+        for item in items:
+            if item[0] == b:
+                item[1] = round(item[1] + W_COPURCHASE, 3)
+                return
+        product, other = snapshot.products_by_id.get(a), snapshot.products_by_id.get(b)
+        base = base_score(product, other) if product is not None and other is not None else 0.0
+        items.append([b, round(base + W_COPURCHASE, 3)])
+
+    def neighbor_ids(self, product_id, snapshot):
+        now = time.monotonic()
+        if self.neighbors is None or now - self.checked_at >= ORDER_POLL_INTERVAL:
+            with self.lock:
+                try:
+                    if self.neighbors is None or _read_version() != self.version:
+                        self._load(snapshot)
+                    elif now - self.checked_at >= ORDER_POLL_INTERVAL:
+                        self._fold_new_orders(snapshot)
+                except Exception as e:
+                    current_app.logger.warning(f"⚠️ Related-products index refresh failed: {e}")
+                    db.session.rollback()
+                self.checked_at = now
+        return [item[0] for item in (self.neighbors or {}).get(product_id, ())]
+
+
+_index = RelatedIndex()
+
+
+def get_related_products(product_id, limit=4):
+    """
+    Up to `limit` in-stock related products as catalog snapshot objects.
+
+    Stock is checked at read time against the snapshot, so the stored lists
+    never need rebuilding when inventory moves. Falls back to other in-stock
+    products from the same category when the list runs short.
+    """
+    from services.catalog_snapshot import get_catalog_snapshot
+
+    snapshot = get_catalog_snapshot()
+    product = snapshot.products_by_id.get(product_id)
+    if product is None:
+        return []
+
+    related = []
+    seen = {product_id}
+    for other_id in _index.neighbor_ids(product_id, snapshot):
+        other = snapshot.products_by_id.get(other_id)
+        if other is not None and not other.in_active and other.is_available and other_id not in seen:
+            related.append(other)
+            seen.add(other_id)
+            if len(related) >= limit:
+                return related
+
+    for other in snapshot.products:
+        if len(related) >= limit:
+            break
+        if other.category_id == product.category_id and other.id not in seen \
+                and not other.in_active and other.is_available:
+            related.append(other)
+            seen.add(other.id)
+    return related
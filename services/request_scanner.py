@@ -0,0 +1,84 @@
+"""
+Single-pass signature scanner for suspicious request URLs and bodies
+"""
+import re
+
+# (rule id, pattern). Order matters only for which rule is reported when two
+# signatures start at the same offset.
+SIGNATURES = (
+    ('xss-script-tag', r'<script'),
+    ('xss-javascript-uri', r'javascript:'),
+    ('xss-vbscript-uri', r'vbscript:'),
+    ('xss-onload', r'onload='),
+    ('xss-onerror', r'onerror='),
+    ('js-eval', r'eval\('),
+    ('css-expression', r'expression\('),
+    ('css-url', r'url\('),
+    ('js-import', r'import\('),
+    ('path-traversal', r'\.\./'),
+    ('sqli-union-select', r'union.*?select'),
+    ('sqli-drop-table', r'drop.*?table'),
+)
+
+# Bodies are only inspected up to this many bytes; payloads worth blocking sit at the front
+DEFAULT_BODY_LIMIT = 16 * 1024
+
+# Trusted, signature-verified callers whose payloads legitimately contain markup and URLs
+DEFAULT_SKIP_PREFIXES = ('/static/', '/webhooks/stripe')
+
+
+class RequestScanner:
+    """
+    All signatures compiled once into a single alternation, with a str twin
+    for URLs and a bytes twin so bodies are scanned without decoding.
+
+    Input is lowercased up front instead of using re.IGNORECASE, and the
+    alternation has no capture groups: both keep the regex engine's literal
+    prefix scan, which makes one pass over a clean request several times
+    cheaper than the old per-pattern loop. The rule id is only worked out
+    for text that already matched.
+    """
+
+    def __init__(self, signatures=SIGNATURES, body_limit=DEFAULT_BODY_LIMIT,
+                 skip_prefixes=DEFAULT_SKIP_PREFIXES):
+        self.body_limit = body_limit
+        self.skip_prefixes = tuple(skip_prefixes)
+        if len({rule_id for rule_id, _ in signatures}) != len(signatures):
+            raise ValueError("Duplicate rule ids in scanner signatures")
+        alternation = '|'.join(f"(?:{pattern})" for _, pattern in signatures)
+        self._text = re.compile(alternation)
+        self._bytes = re.compile(alternation.encode('ascii'))
+        self._rules = [(rule_id, re.compile(pattern), re.compile(pattern.encode('ascii')))
+                       for rule_id, pattern in signatures]
+
+    def skips(self, path):
+        return path.startswith(self.skip_prefixes)
+
+    def _rule_for(self, matched):
+        """First rule (in signature order) whose pattern spans the matched text, as the alternation would pick."""
+        index = 1 if isinstance(matched, str) else 2
+        for rule in self._rules:
+            if rule[index].fullmatch(matched):
+                return rule[0]
+        return None
+
+    def _inputs(self, url, body):
+        yield self._text, url.lower()
+        if body:
+            yield self._bytes, bytes(body[:self.body_limit]).lower()
+
+    def first_match(self, url, body=b''):
+        """Rule id of the first signature found in the URL or body prefix, or None."""
+        for pattern, text in self._inputs(url, body):
+            match = pattern.search(text)
+            if match:
+                return self._rule_for(match.group(0))
+        return None
+
+    def matches(self, url, body=b''):
+        """Every distinct rule id found, in order of first appearance."""
+        found = {}
+        for pattern, text in self._inputs(url, body):
+            for match in pattern.finditer(text):
+                found.setdefault(self._rule_for(match.group(0)), None)
+        return list(found)
@@ -0,0 +1,276 @@
+"""
+Inverted-index product search over the catalog snapshot
+"""
+import bisect
+import hashlib
+import math
+import re
+import threading
+from collections import defaultdict
+
+from services.catalog_snapshot import get_catalog_snapshot
+
+# Per-field weights; the brand is the leading word of the product name,
+# matching how the listing's brand filter reads it
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'brand': 2.0,
+    'features': 1.5,
+    'specifications': 1.0,
+    'description': 1.0,
+}
+
+# Score multipliers for looser matches
+PREFIX_FACTOR = 0.8
+TYPO_FACTOR = 0.6
+
+MAX_PREFIX_EXPANSIONS = 50
+MIN_TYPO_LENGTH = 4
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with', 'your', 'you',
+))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# (suffix, replacement) pairs tried in order; first match wins
+_SUFFIXES = (
+    ('ational', 'ate'), ('iveness', 'ive'), ('fulness', 'ful'), ('ization', 'ize'),
+    ('ies', 'y'), ('sses', 'ss'), ('ing', ''), ('edly', ''), ('ed', ''), ('ly', ''),
+    ('ers', 'er'), ('s', ''),
+)
+
+
+def stem(word):
+    """Light suffix-stripping stemmer; index and queries share it, so consistency beats accuracy."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == 's' and word[-2] in 'su':
+                return word
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def words(text):
+    """Lowercase alphanumeric words with stopwords removed."""
+    return [w for w in _WORD_RE.findall((text or '').lower()) if w not in STOPWORDS]
+
+
+def _deletes(term):
+    """Single-character deletions, used to find terms one edit away."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _document_fields(product):
+    name_words = words(product.name)
+    return {
+        'name': product.name,
+        'brand': name_words[0] if name_words else '',
+        'features': product.features,
+        'specifications': product.specifications,
+        'description': product.description,
+    }
+
+
+def _signature(fields):
+    digest = hashlib.sha1()
+    for field in FIELD_WEIGHTS:
+        digest.update((fields.get(field) or '').encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class SearchIndex:
+    """Incrementally maintained inverted index keyed by product id."""
+
+    def __init__(self):
+        self.version = None
+        self.postings = defaultdict(dict)      # stem -> {product_id: weight}
+        self.doc_terms = {}                    # product_id -> {stem: weight}
+        self.doc_words = {}                    # product_id -> set of surface words
+        self.signatures = {}                   # product_id -> content digest
+        self.word_stems = {}                   # surface word -> stem
+        self.word_counts = defaultdict(int)    # surface word -> document count
+        self.typo_map = defaultdict(set)       # deletion variant -> stems
+        self._sorted_words = []
+        self._words_dirty = False
+        self._lock = threading.RLock()
+
+    # ── maintenance ──────────────────────────────────────────
+
+    def sync(self, snapshot):
+        """Bring the index up to date with a snapshot, re-indexing only changed products."""
+        with self._lock:
+            if self.version == snapshot.version:
+                return 0
+
+            active = {p.id: p for p in snapshot.products if not p.in_active}
+            changed = 0
+            for product_id in list(self.signatures):
+                if product_id not in active:
+                    self._remove(product_id)
+                    changed += 1
+
+            for product_id, product in active.items():
+                fields = _document_fields(product)
+                signature = _signature(fields)
+                if self.signatures.get(product_id) == signature:
+                    continue
+                self._remove(product_id)
+                self._add(product_id, fields, signature)
+                changed += 1
+
+            self.version = snapshot.version
+            return changed
+
+    def _add(self, product_id, fields, signature):
+        terms = defaultdict(float)
+        surface = set()
+        for field, weight in FIELD_WEIGHTS.items():
+            field_words = words(fields.get(field))
+            if not field_words:
+                continue
+            # Dampen long fields so a single mention in a description can't outrank the name
+            per_word = weight / math.sqrt(len(field_words))
+            for word in field_words:
+                terms[stem(word)] += per_word
+                surface.add(word)
+
+        for term, weight in terms.items():
+            if term not in self.postings:
+                for variant in _deletes(term) | {term}:
+                    self.typo_map[variant].add(term)
+            self.postings[term][product_id] = weight
+
+        for word in surface:
+            if word not in self.word_stems:
+                self.word_stems[word] = stem(word)
+                self._words_dirty = True
+            self.word_counts[word] += 1
+
+        self.doc_terms[product_id] = dict(terms)
+        self.doc_words[product_id] = surface
+        self.signatures[product_id] = signature
+
+    def _remove(self, product_id):
+        if product_id not in self.signatures:
+            return
+        for term in self.doc_terms.pop(product_id, {}):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self.postings[term]
+                for variant in _deletes(term) | {term}:
+                    bucket = self.typo_map.get(variant)
+                    if bucket:
+                        bucket.discard(term)
+                        if not bucket:
+                            del self.typo_map[variant]
+
+        for word in self.doc_words.pop(product_id, ()):
+            self.word_counts[word] -= 1
+            if self.word_counts[word] <= 0:
+                del self.word_counts[word]
+                self.word_stems.pop(word, None)
+                self._words_dirty = True
+
+        del self.signatures[product_id]
+
+    def _words_with_prefix(self, prefix):
+        if self._words_dirty:
+            self._sorted_words = sorted(self.word_stems)
+            self._words_dirty = False
+        start = bisect.bisect_left(self._sorted_words, prefix)
+        matches = []
+        for word in self._sorted_words[start:]:
+            if not word.startswith(prefix):
+                break
+            matches.append(word)
+        return matches
+
+    # ── queries ──────────────────────────────────────────────
+
+    def _expand(self, word, allow_prefix):
+        """Map one query word to candidate stems with a score factor each."""
+        term = stem(word)
+        candidates = {}
+        if term in self.postings:
+            candidates[term] = 1.0
+
+        if allow_prefix:
+            prefix_words = self._words_with_prefix(word)
+            prefix_words.sort(key=lambda w: -self.word_counts[w])
+            for prefix_word in prefix_words[:MAX_PREFIX_EXPANSIONS]:
+                prefix_term = self.word_stems[prefix_word]
+                candidates.setdefault(prefix_term, PREFIX_FACTOR)
+
+        if not candidates and len(word) >= MIN_TYPO_LENGTH:
+            for variant in _deletes(term) | {term}:
+                for typo_term in self.typo_map.get(variant, ()):
+                    candidates.setdefault(typo_term, TYPO_FACTOR)
+
+        return candidates
+
+    def search(self, query, limit=None, prefix=True):
+        """
+        Rank products for a free-text query.
+
+        Every query word must match (exactly, by stem, by prefix for the last
+        word, or within one edit). Returns (product_id, score) pairs, best first.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        with self._lock:
+            total_docs = max(len(self.signatures), 1)
+            scores = None
+            for i, word in enumerate(query_words):
+                allow_prefix = prefix and i == len(query_words) - 1
+                matched = {}
+                for term, factor in self._expand(word, allow_prefix).items():
+                    posting = self.postings.get(term)
+                    if not posting:
+                        continue
+                    idf = math.log(1 + total_docs / len(posting))
+                    for product_id, weight in posting.items():
+                        score = weight * idf * factor
+                        if score > matched.get(product_id, 0.0):
+                            matched[product_id] = score
+
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in matched.items() if pid in scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def complete(self, query, limit=8):
+        """Suggest whole words for the last (partial) word of a query."""
+        query_words = _WORD_RE.findall((query or '').lower())
+        if not query_words:
+            return []
+        head, last = query_words[:-1], query_words[-1]
+        with self._lock:
+            matches = self._words_with_prefix(last)
+            matches.sort(key=lambda w: (-self.word_counts[w], w))
+        prefix = ' '.join(head)
+        return [f"{prefix} {word}".strip() for word in matches[:limit]]
+
+
+_index = SearchIndex()
+
+
+def get_search_index():
+    """Return the worker's search index, synced to the current catalog snapshot."""
+    snapshot = get_catalog_snapshot()
+    _index.sync(snapshot)
+    return _index, snapshot
@@ -0,0 +1,235 @@
+"""
+Streaming sitemap generator with a per-worker cache keyed on the catalog version
+"""
+import gzip
+import hashlib
+import threading
+import time
+from xml.sax.saxutils import escape
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import func, select
+
+from routes import db
+from models import CatalogVersion, Product
+
+CATALOG_SCOPE = 'catalog'
+
+# Sexual Enhancements (59) is noindex for Google Ads policy; robots.txt blocks its products too
+EXCLUDED_CATEGORY_IDS = (59,)
+
+# The protocol caps a sitemap at 50,000 URLs; switch to an index well before that
+URLS_PER_SITEMAP = 45000
+
+# Seconds between catalog version polls per worker
+VERSION_CHECK_INTERVAL = 30
+
+STATIC_PAGES = (
+    ('/', 'daily', '1.0'),
+    ('/products', 'daily', '0.9'),
+    ('/about', 'monthly', '0.6'),
+    ('/support', 'monthly', '0.6'),
+    ('/return', 'monthly', '0.5'),
+    ('/track', 'monthly', '0.5'),
+)
+
+# Pages whose content is the catalog itself, so their lastmod follows the newest product
+CATALOG_PAGES = ('/', '/products')
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+URLSET_OPEN = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_OPEN = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+
+# Rows per yielded chunk when streaming
+CHUNK_ROWS = 500
+
+
+def _base_url():
+    return current_app.config.get('SITEMAP_BASE_URL', 'https://lovemenowmiami.com').rstrip('/')
+
+
+def _w3c_date(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def _url_entry(loc, lastmod=None, changefreq=None, priority=None):
+    parts = [f'  <url>\n    <loc>{escape(loc)}</loc>\n']
+    if lastmod:
+        parts.append(f'    <lastmod>{lastmod}</lastmod>\n')
+    if changefreq:
+        parts.append(f'    <changefreq>{changefreq}</changefreq>\n')
+    if priority:
+        parts.append(f'    <priority>{priority}</priority>\n')
+    parts.append('  </url>\n')
+    return ''.join(parts)
+
+
+def _indexable_products():
+    return (Product.in_active.is_(False), Product.category_id.notin_(EXCLUDED_CATEGORY_IDS))
+
+
+def iter_product_rows(offset=0, limit=None):
+    """(id, updated_at) for indexable products in id order, fetched in batches rather than as ORM objects."""
+    query = select(Product.id, Product.updated_at).where(*_indexable_products()).order_by(Product.id)
+    if offset:
+        query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+    return db.session.execute(query.execution_options(yield_per=1000))
+
+
+def _catalog_stats():
+    count, newest = db.session.execute(
+        select(func.count(Product.id), func.max(Product.updated_at)).where(*_indexable_products())
+    ).one()
+    return count or 0, newest
+
+
+def _render_static_pages(base, newest):
+    catalog_lastmod = _w3c_date(newest)
+    for path, changefreq, priority in STATIC_PAGES:
+        lastmod = catalog_lastmod if path in CATALOG_PAGES else None
+        yield _url_entry(base + path, lastmod, changefreq, priority)
+
+
+def _render_products(base, rows):
+    chunk = []
+    for product_id, updated_at in rows:
+        chunk.append(_url_entry(f"{base}/product/{product_id}", _w3c_date(updated_at), 'weekly', '0.8'))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def render_document(name, product_count, newest):
+    """
+    Yield the XML for one sitemap document in chunks.
+
+    Small catalogs get a single urlset at sitemap.xml. Past URLS_PER_SITEMAP
+    products, sitemap.xml becomes an index over sitemap-pages.xml and
+    sitemap-products-<n>.xml.
+    """
+    base = _base_url()
+    pages = max(1, -(-product_count // URLS_PER_SITEMAP))
+    split = product_count + len(STATIC_PAGES) > URLS_PER_SITEMAP
+
+    if name == 'sitemap.xml' and not split:
+        yield XML_HEADER + URLSET_OPEN
+        yield from _render_static_pages(base, newest)
+        yield from _render_products(base, iter_product_rows())
+        yield '</urlset>'
+    elif name == 'sitemap.xml':
+        yield XML_HEADER + INDEX_OPEN
+        lastmod = _w3c_date(newest)
+        for document in ['sitemap-pages.xml'] + [f'sitemap-products-{n}.xml' for n in range(1, pages + 1)]:
+            yield f'  <sitemap>\n    <loc>{escape(base)}/{document}</loc>\n'
+            yield f'    <lastmod>{lastmod}</lastmod>\n  </sitemap>\n' if lastmod else '  </sitemap>\n'
+        yield '</sitemapindex>'
+    elif name == 'sitemap-pages.xml' and split:
+        yield XML_HEADER + URLSET_OPEN
+        yield from _render_static_pages(base, newest)
+        yield '</urlset>'
+    elif name.startswith('sitemap-products-') and split:
+        page = int(name[len('sitemap-products-'):-len('.xml')])
+        if not 1 <= page <= pages:
+            raise LookupError(name)
+        yield XML_HEADER + URLSET_OPEN
+        yield from _render_products(base, iter_product_rows((page - 1) * URLS_PER_SITEMAP, URLS_PER_SITEMAP))
+        yield '</urlset>'
+    else:
+        raise LookupError(name)
+
+
+class CachedDocument:
+    __slots__ = ('body', 'gzipped', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+class SitemapCache:
+    """Rendered documents for one catalog version; a version bump empties it."""
+
+    def __init__(self):
+        self.version = None
+        self.stats = None
+        self.documents = {}
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Drop everything if another worker (or this one) changed the catalog; returns (count, newest)."""
+        now = time.monotonic()
+        if self.stats is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return self.stats
+        version = db.session.query(CatalogVersion.version).filter_by(scope=CATALOG_SCOPE).scalar() or 0
+        with self.lock:
+            if version != self.version or self.stats is None:
+                self.version = version
+                self.documents = {}
+                self.stats = _catalog_stats()
+            self.checked_at = now
+            return self.stats
+
+    def store(self, name, version, body):
+        with self.lock:
+            if version == self.version:
+                self.documents[name] = CachedDocument(body)
+
+
+_cache = SitemapCache()
+
+
+def _cached_response(document):
+    gzip_ok = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = Response(document.gzipped if gzip_ok else document.body, mimetype='application/xml')
+    if gzip_ok:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.set_etag(document.etag + ('-gz' if gzip_ok else ''))
+    return response.make_conditional(request)
+
+
+def sitemap_response(name):
+    """
+    Serve a sitemap document from cache, or stream it while filling the cache.
+
+    The first request after a catalog change streams rows straight from the
+    database; the bytes are kept so later crawler hits get a precompressed
+    body with an ETag and no query beyond the periodic version check.
+    """
+    try:
+        count, newest = _cache.refresh()
+    except Exception as e:
+        current_app.logger.error(f"❌ Sitemap catalog check failed: {e}")
+        db.session.rollback()
+        return Response('Sitemap temporarily unavailable', status=503, mimetype='text/plain')
+
+    document = _cache.documents.get(name)
+    if document is not None:
+        return _cached_response(document)
+
+    version = _cache.version
+    chunks = render_document(name, count, newest)
+    try:
+        first = next(chunks)
+    except LookupError:
+        return Response('Not found', status=404, mimetype='text/plain')
+
+    def generate():
+        rendered = [first.encode('utf-8')]
+        yield rendered[0]
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            rendered.append(data)
+            yield data
+        _cache.store(name, version, b''.join(rendered))
+
+    response = Response(stream_with_context(generate()), mimetype='application/xml')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
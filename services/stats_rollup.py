@@ -0,0 +1,197 @@
+"""
+Hourly event counters for the admin dashboards, maintained as events happen
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from routes import db
+from models import AuditLog, Order, StatsHourly, User
+
+METRICS = (
+    'orders',
+    'registrations',
+    'logins',
+    'failed_logins',
+    'suspicious_requests',
+    'rate_limit_hits',
+    'age_verifications',
+    'age_verification_denials',
+)
+
+# Dashboards look back at most this far, so rollups older than this are never read
+RETENTION_DAYS = 30
+
+# audit_logs action -> metric; user_login is split on status below
+AUDIT_ACTION_METRICS = {
+    'login_failed': 'failed_logins',
+    'suspicious_request': 'suspicious_requests',
+    'rate_limit_exceeded': 'rate_limit_hits',
+    'age_verification': 'age_verifications',
+    'age_verification_denied': 'age_verification_denials',
+}
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def audit_metric(action, status):
+    if action == 'user_login':
+        return 'failed_logins' if status == 'failed' else 'logins'
+    return AUDIT_ACTION_METRICS.get(action)
+
+
+def count_audit_rows(rows):
+    """Counter of (metric, bucket) for audit row dicts as queued by services.audit_writer."""
+    counts = Counter()
+    for row in rows:
+        metric = audit_metric(row.get('action'), row.get('status'))
+        if metric:
+            counts[(metric, hour_bucket(row.get('created_at') or datetime.utcnow()))] += 1
+    return counts
+
+
+def bump_counters(conn, counts):
+    """
+    Add counts to their hourly rows on an open connection/transaction.
+
+    Keys are applied in sorted order so two workers flushing at once lock
+    rows in the same order instead of deadlocking.
+    """
+    table = StatsHourly.__table__
+    for (metric, bucket), amount in sorted(counts.items()):
+        if not amount:
+            continue
+        increment = (
+            update(table)
+            .where(table.c.bucket == bucket, table.c.metric == metric)
+            .values(count=table.c.count + amount)
+        )
+        if conn.execute(increment).rowcount:
+            continue
+        try:
+            with conn.begin_nested():
+                conn.execute(table.insert().values(bucket=bucket, metric=metric, count=amount))
+        except IntegrityError:
+            # Another worker created the row between our UPDATE and INSERT
+            conn.execute(increment)
+
+
+def record_counts(counts):
+    """Apply counts in their own transaction; failures are logged, never raised into a request."""
+    if not counts or not has_app_context():
+        return
+    try:
+        with db.engine.begin() as conn:
+            bump_counters(conn, counts)
+    except Exception as e:
+        current_app.logger.warning(f"⚠️ Failed to update stats rollups: {e}")
+
+
+def window_counts(since, metrics=METRICS):
+    """
+    Totals per metric from the hour containing `since` until now.
+
+    Reads at most one row per metric per hour (720 for a 30-day window),
+    independent of how many orders or audit entries there are.
+    """
+    rows = db.session.execute(
+        select(StatsHourly.metric, func.sum(StatsHourly.count))
+        .where(StatsHourly.bucket >= hour_bucket(since), StatsHourly.metric.in_(metrics))
+        .group_by(StatsHourly.metric)
+    ).all()
+    totals = dict.fromkeys(metrics, 0)
+    totals.update({metric: int(total or 0) for metric, total in rows})
+    return totals
+
+
+def rebuild_rollups(days=RETENTION_DAYS):
+    """
+    Recompute the last `days` of counters from orders, users and audit_logs.
+
+    Used to seed the table and to repair it; everyday updates are incremental.
+    Returns the number of hourly rows written.
+    """
+    since = hour_bucket(datetime.utcnow() - timedelta(days=days))
+    counts = Counter()
+
+    for (created_at,) in db.session.query(Order.created_at).filter(Order.created_at >= since).yield_per(1000):
+        counts[('orders', hour_bucket(created_at))] += 1
+    for (created_at,) in db.session.query(User.created_at).filter(User.created_at >= since).yield_per(1000):
+        counts[('registrations', hour_bucket(created_at))] += 1
+
+    audit_actions = list(AUDIT_ACTION_METRICS) + ['user_login']
+    audit_rows = (
+        db.session.query(AuditLog.action, AuditLog.status, AuditLog.created_at)
+        .filter(AuditLog.action.in_(audit_actions), AuditLog.created_at >= since)
+        .yield_per(1000)
+    )
+    for action, status, created_at in audit_rows:
+        counts[(audit_metric(action, status), hour_bucket(created_at))] += 1
+
+    with db.engine.begin() as conn:
+        conn.execute(delete(StatsHourly).where(StatsHourly.bucket >= since))
+        if counts:
+            conn.execute(StatsHourly.__table__.insert(), [
+                {'metric': metric, 'bucket': bucket, 'count': amount}
+                for (metric, bucket), amount in sorted(counts.items())
+            ])
+    return len(counts)
+
+
+def purge_old_rollups(days=RETENTION_DAYS * 2):
+    with db.engine.begin() as conn:
+        return conn.execute(
+            delete(StatsHourly).where(StatsHourly.bucket < hour_bucket(datetime.utcnow() - timedelta(days=days)))
+        ).rowcount
+
+
+def init_stats_rollup(app):
+    """Importing this module registers the session listeners; also trims rollups nobody reads."""
+    try:
+        with app.app_context():
+            purged = purge_old_rollups()
+        if purged:
+            app.logger.info(f"🧹 Purged {purged} old hourly stats rows")
+    except Exception as e:
+        app.logger.warning(f"⚠️ Could not purge old stats rollups: {e}")
+
+
+# Orders, registrations and synchronously written audit entries are counted
+# from the ORM session, but only once their transaction actually commits.
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_events(session, flush_context):
+    counts = None
+    for obj in session.new:
+        if isinstance(obj, Order):
+            key = ('orders', hour_bucket(obj.created_at or datetime.utcnow()))
+        elif isinstance(obj, User):
+            key = ('registrations', hour_bucket(obj.created_at or datetime.utcnow()))
+        elif isinstance(obj, AuditLog):
+            metric = audit_metric(obj.action, obj.status)
+            if not metric:
+                continue
+            key = (metric, hour_bucket(obj.created_at or datetime.utcnow()))
+        else:
+            continue
+        if counts is None:
+            counts = session.info.setdefault('stats_pending', Counter())
+        counts[key] += 1
+
+
+@event.listens_for(Session, 'after_commit')
+def _record_committed_events(session):
+    counts = session.info.pop('stats_pending', None)
+    if counts:
+        record_counts(counts)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_events(session):
+    session.info.pop('stats_pending', None)
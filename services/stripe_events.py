@@ -0,0 +1,343 @@
+"""
+Stripe webhook ledger: deliveries are recorded and acknowledged, then processed in order per PaymentIntent
+"""
+import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from routes import db
+from models import StripeEvent
+from services.notification_outbox import backoff_seconds
+
+STATUS_PENDING = 'pending'
+STATUS_PROCESSING = 'processing'
+STATUS_PROCESSED = 'processed'
+STATUS_IGNORED = 'ignored'
+STATUS_DEAD = 'dead'
+
+UNFINISHED_STATUSES = (STATUS_PENDING, STATUS_PROCESSING)
+
+MAX_ERROR_LENGTH = 2000
+
+
+class EventProcessingError(Exception):
+    """A handler reported failure; the event is retried with backoff."""
+
+
+# ── handlers ─────────────────────────────────────────────────
+# Handlers leave their writes uncommitted so they commit together with the
+# event's 'processed' mark; a crash in between re-runs the event, and
+# commit_order_stock makes the re-run a no-op.
+
+def _handle_payment_intent_succeeded(event):
+    from routes.webhooks import fulfill_order
+
+    payment_intent = event['data']['object']
+    shipping = payment_intent.get('shipping') or {}
+    customer_info = {
+        'email': payment_intent.get('receipt_email'),
+        'name': shipping.get('name') or 'Stripe Customer',
+        'phone': shipping.get('phone') or 'N/A',
+    }
+    success, _ = fulfill_order(
+        payment_intent_id=payment_intent['id'],
+        metadata=payment_intent.get('metadata') or {},
+        customer_info=customer_info,
+        shipping_details=shipping,
+        commit=False,
+    )
+    if not success:
+        raise EventProcessingError(f"Fulfillment failed for payment intent {payment_intent['id']}")
+
+
+def _handle_checkout_session_completed(event):
+    from routes.webhooks import process_successful_payment
+
+    session_obj = event['data']['object']
+    if not process_successful_payment(session_obj, commit=False):
+        raise EventProcessingError(f"Failed to process payment for session {session_obj['id']}")
+
+
+HANDLERS = {
+    'payment_intent.succeeded': _handle_payment_intent_succeeded,
+    'checkout.session.completed': _handle_checkout_session_completed,
+}
+
+
+# ── ingestion ────────────────────────────────────────────────
+
+def ordering_key(event):
+    """The PaymentIntent an event belongs to; events sharing it are processed one at a time, oldest first."""
+    obj = event['data']['object']
+    if event['type'].startswith('payment_intent.'):
+        return obj['id']
+    payment_intent = obj.get('payment_intent')
+    if isinstance(payment_intent, dict):
+        payment_intent = payment_intent.get('id')
+    return payment_intent or obj.get('id') or event['id']
+
+
+def record_event(event, payload):
+    """
+    Append a verified event to the ledger and commit. Returns False when the
+    event id is already recorded (a Stripe retry or duplicate delivery).
+    """
+    row = StripeEvent(
+        event_id=event['id'],
+        event_type=event['type'],
+        ordering_key=ordering_key(event)[:255],
+        stripe_created=int(event.get('created') or 0),
+        payload=payload,
+        status=STATUS_PENDING if event['type'] in HANDLERS else STATUS_IGNORED,
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(row)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    if row.status == STATUS_PENDING and _worker is not None:
+        _worker.wake.set()
+    return True
+
+
+def requeue_events(event_ids=None, dead_only=False):
+    """
+    Reset events to pending so they run again (all dead ones when no ids are
+    given). Re-running a processed event is safe; its handler finds the order
+    already fulfilled. Caller commits.
+    """
+    query = update(StripeEvent).where(StripeEvent.event_type.in_(HANDLERS))
+    if event_ids:
+        query = query.where(StripeEvent.event_id.in_(event_ids))
+    if dead_only or not event_ids:
+        query = query.where(StripeEvent.status == STATUS_DEAD)
+    result = db.session.execute(query.values(
+        status=STATUS_PENDING, attempts=0, next_attempt_at=datetime.utcnow(),
+        locked_until=None, last_error=None,
+    ))
+    return result.rowcount
+
+
+# ── worker ───────────────────────────────────────────────────
+
+class StripeEventWorker:
+    """
+    Claims due ledger rows and runs their handlers on a bounded thread pool.
+
+    Only the oldest unfinished event of each PaymentIntent is claimable, so
+    events for one payment run in order and never concurrently, while
+    different payments proceed in parallel.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.threads = max(1, config.get('STRIPE_EVENT_WORKER_THREADS', 2))
+        self.poll_seconds = config.get('STRIPE_EVENT_POLL_SECONDS', 5)
+        self.batch_size = config.get('STRIPE_EVENT_BATCH_SIZE', 20)
+        self.max_attempts = config.get('STRIPE_EVENT_MAX_ATTEMPTS', 10)
+        self.backoff_base = config.get('STRIPE_EVENT_BACKOFF_SECONDS', 15)
+        self.backoff_max = config.get('STRIPE_EVENT_BACKOFF_MAX_SECONDS', 1800)
+        self.lease_seconds = config.get('STRIPE_EVENT_LEASE_SECONDS', 300)
+        self.wake = threading.Event()
+        self._stop = threading.Event()
+        self._pool = None
+        self._thread = None
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='stripe-events')
+        self._thread = threading.Thread(target=self._run, name='stripe-event-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = []
+            try:
+                with self.app.app_context():
+                    claimed = self.claim_batch()
+            except Exception as e:
+                self.app.logger.error(f"❌ Stripe event poll failed: {e}")
+
+            if claimed:
+                # Wait for the batch so claims never outrun the pool
+                list(self._pool.map(self._process, claimed))
+                continue
+
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+
+    def _due(self, now):
+        return or_(
+            and_(StripeEvent.status == STATUS_PENDING, StripeEvent.next_attempt_at <= now),
+            and_(StripeEvent.status == STATUS_PROCESSING, StripeEvent.locked_until < now),
+        )
+
+    def _claim(self, event_id, condition, now):
+        result = db.session.execute(
+            update(StripeEvent)
+            .where(StripeEvent.event_id == event_id, condition)
+            .values(status=STATUS_PROCESSING, locked_until=now + timedelta(seconds=self.lease_seconds),
+                    attempts=StripeEvent.attempts + 1)
+        )
+        return result.rowcount == 1
+
+    def claim_batch(self):
+        """
+        Claim up to batch_size due events, at most one per PaymentIntent.
+
+        Each claim is a conditional UPDATE, so two gunicorn workers racing for
+        the same row can't both win. Rows left in 'processing' by a crashed
+        worker become claimable again once their lease expires.
+        """
+        now = datetime.utcnow()
+        due = self._due(now)
+        try:
+            candidates = (
+                db.session.query(StripeEvent.event_id, StripeEvent.ordering_key)
+                .filter(due)
+                .order_by(StripeEvent.stripe_created, StripeEvent.event_id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not candidates:
+                db.session.commit()
+                return []
+
+            # The oldest unfinished event per key goes first; later ones (and
+            # anything queued behind an event another worker holds) wait
+            heads = {}
+            for event_id, key in (
+                db.session.query(StripeEvent.event_id, StripeEvent.ordering_key)
+                .filter(StripeEvent.ordering_key.in_({key for _, key in candidates}),
+                        StripeEvent.status.in_(UNFINISHED_STATUSES))
+                .order_by(StripeEvent.stripe_created, StripeEvent.event_id)
+            ):
+                heads.setdefault(key, event_id)
+
+            claimed = [
+                event_id for event_id, key in candidates
+                if heads.get(key) == event_id and self._claim(event_id, due, now)
+            ]
+            db.session.commit()
+            return claimed
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _process(self, event_id):
+        with self.app.app_context():
+            try:
+                self.deliver(event_id)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"❌ Stripe event {event_id} crashed: {e}")
+
+    def deliver(self, event_id):
+        """Run the handler for a claimed event and record the outcome; returns the final status."""
+        row = db.session.get(StripeEvent, event_id)
+        if row is None or row.status != STATUS_PROCESSING:
+            return row.status if row is not None else None
+        handler = HANDLERS.get(row.event_type)
+        if handler is None:
+            row.status = STATUS_IGNORED
+            row.locked_until = None
+            db.session.commit()
+            return row.status
+
+        started = datetime.utcnow()
+        try:
+            handler(json.loads(row.payload))
+        except Exception as e:
+            # Roll back anything the handler did before recording the outcome
+            db.session.rollback()
+            row = db.session.get(StripeEvent, event_id)
+            self._retry_or_dead_letter(row, e)
+        else:
+            row = db.session.get(StripeEvent, event_id)
+            row.status = STATUS_PROCESSED
+            row.processed_at = datetime.utcnow()
+            row.locked_until = None
+            row.last_error = None
+            elapsed_ms = (row.processed_at - started).total_seconds() * 1000
+            current_app.logger.info(
+                f"✅ Processed Stripe {row.event_type} {row.event_id} in {elapsed_ms:.0f}ms (attempt {row.attempts})"
+            )
+        db.session.commit()
+        return row.status
+
+    def process_now(self, event_id):
+        """Claim one pending event regardless of schedule and run it in this thread."""
+        now = datetime.utcnow()
+        try:
+            claimed = self._claim(event_id, StripeEvent.status == STATUS_PENDING, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if not claimed:
+            row = db.session.get(StripeEvent, event_id)
+            return row.status if row is not None else None
+        return self.deliver(event_id)
+
+    def drain(self):
+        """Process everything due, in order, in this thread; returns the number of events run."""
+        total = 0
+        while True:
+            claimed = self.claim_batch()
+            if not claimed:
+                return total
+            for event_id in claimed:
+                self.deliver(event_id)
+            total += len(claimed)
+
+    def _retry_or_dead_letter(self, row, error):
+        message = f"{error}\n{traceback.format_exc()}"
+        row.locked_until = None
+        row.last_error = message[:MAX_ERROR_LENGTH]
+        if row.attempts >= self.max_attempts:
+            row.status = STATUS_DEAD
+            current_app.logger.error(f"🚨 Stripe event {row.event_id} ({row.event_type}) dead-lettered: {error}")
+            return
+        delay = backoff_seconds(row.attempts, self.backoff_base, self.backoff_max)
+        row.status = STATUS_PENDING
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        current_app.logger.warning(
+            f"⚠️  Stripe event {row.event_id} failed (attempt {row.attempts}/{self.max_attempts}), "
+            f"retrying in {delay:.0f}s: {error}"
+        )
+
+
+_worker = None
+
+
+def init_stripe_event_worker(app):
+    """Start this process's event worker (one per gunicorn worker; claims keep them apart)."""
+    global _worker
+    if _worker is not None or not app.config.get('STRIPE_EVENT_WORKER_ENABLED', True):
+        return _worker
+    _worker = StripeEventWorker(app)
+    _worker.start()
+    app.logger.info(f"✅ Stripe event worker started ({_worker.threads} threads)")
+    return _worker
+
+
+def stripe_event_worker_running():
+    return _worker is not None
+
+
+def process_event_inline(event_id):
+    """For processes without a worker (tests, local dev): run the event now and return its status."""
+    return StripeEventWorker(current_app._get_current_object()).process_now(event_id)
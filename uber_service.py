@@ -2,13 +2,24 @@
 Uber Direct API Integration Service
 """
 import requests
+import requests.adapters
+import hashlib
 import json
 import logging
 import math
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, Tuple
 from flask import current_app, has_app_context
 
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: refreshes just aren't serialized across processes
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 _DEFAULT_STORE_SETTINGS = {
@@ -32,6 +43,68 @@ def _store_config_value(key: str, default_key: str = None):
     return _DEFAULT_STORE_SETTINGS.get(key, None)
 
 
+# Refresh the OAuth token this long before it expires; a failed early refresh keeps
+# using the current token until it is within TOKEN_HARD_MARGIN of expiry
+TOKEN_REFRESH_MARGIN = timedelta(hours=1)
+TOKEN_HARD_MARGIN = timedelta(minutes=1)
+
+# (connect, read) seconds; quotes sit on the checkout path so they get a tighter read timeout
+DEFAULT_TIMEOUT = (3.05, 15)
+QUOTE_TIMEOUT = (3.05, 8)
+
+
+def _build_http_session() -> requests.Session:
+    """Keep-alive session shared by every call this process makes to Uber."""
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=10)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+
+class TokenCache:
+    """
+    OAuth token cache in a small JSON file so every gunicorn worker on the host
+    shares one token. A lock file serializes refreshes so workers don't all hit
+    auth.uber.com at the same moment.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, key: str) -> Optional[Tuple[str, datetime]]:
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+            if data.get('key') != key:
+                return None
+            return data['access_token'], datetime.fromisoformat(data['expires_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def store(self, key: str, token: str, expires_at: datetime):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({'key': key, 'access_token': token, 'expires_at': expires_at.isoformat()}, fh)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write Uber token cache {self.path}: {e}")
+
+    @contextmanager
+    def refresh_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 class UberDirectService:
     """Service class for Uber Direct API integration"""
     
@@ -44,13 +117,26 @@ class UberDirectService:
         self.access_token = None
         self.token_expires_at = None
         self.is_sandbox = False
+        self.http = _build_http_session()
+        self.token_cache = TokenCache(os.path.join(tempfile.gettempdir(), 'lovemenow_uber_token.json'))
+        self.timeout = DEFAULT_TIMEOUT
+        self._token_lock = threading.Lock()
         
-    def configure(self, client_id: str, client_secret: str, customer_id: str, is_sandbox: bool = False):
+    def configure(self, client_id: str, client_secret: str, customer_id: str, is_sandbox: bool = False,
+                  token_cache_path: str = None, timeout: Tuple[float, float] = None):
         """Configure the service with Uber credentials"""
+        if (client_id, is_sandbox) != (self.client_id, self.is_sandbox):
+            # Different credentials: the in-memory token belongs to the old ones
+            self.access_token = None
+            self.token_expires_at = None
         self.client_id = client_id
         self.client_secret = client_secret
         self.customer_id = customer_id
         self.is_sandbox = is_sandbox
+        if token_cache_path:
+            self.token_cache = TokenCache(token_cache_path)
+        if timeout:
+            self.timeout = timeout
         
         # Set the correct API endpoint based on sandbox/production mode
         if is_sandbox:
@@ -59,17 +145,53 @@ class UberDirectService:
         else:
             self.base_url = "https://api.uber.com/v1"
             logger.info("🔧 Uber service configured for PRODUCTION mode")
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.client_id and self.client_secret and self.customer_id)
+
+    def _token_cache_key(self) -> str:
+        # Never store the secret itself; the key only tells tokens for different accounts apart
+        raw = f"{self.client_id}:{'sandbox' if self.is_sandbox else 'production'}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _token_is_fresh(self, margin: timedelta) -> bool:
+        return bool(self.access_token and self.token_expires_at and
+                    datetime.now() < self.token_expires_at - margin)
         
-    def _get_access_token(self) -> str:
-        """Get or refresh OAuth access token"""
-        # Check if we have a valid token
-        if (self.access_token and self.token_expires_at and 
-            datetime.now() < self.token_expires_at - timedelta(minutes=5)):
+    def _get_access_token(self, force_refresh: bool = False) -> str:
+        """Get or refresh OAuth access token (memory, then the shared cache, then auth.uber.com)"""
+        if not force_refresh and self._token_is_fresh(TOKEN_REFRESH_MARGIN):
             return self.access_token
-            
-        # Request new token
+
+        with self._token_lock:
+            key = self._token_cache_key()
+            if not force_refresh:
+                cached = self.token_cache.load(key)
+                if cached:
+                    self.access_token, self.token_expires_at = cached
+                    if self._token_is_fresh(TOKEN_REFRESH_MARGIN):
+                        return self.access_token
+
+            with self.token_cache.refresh_lock():
+                # Another worker may have refreshed while we waited for the lock
+                cached = self.token_cache.load(key)
+                if cached and (not force_refresh or cached[0] != self.access_token):
+                    self.access_token, self.token_expires_at = cached
+                    if self._token_is_fresh(TOKEN_REFRESH_MARGIN):
+                        return self.access_token
+
+                try:
+                    return self._request_new_token(key)
+                except Exception:
+                    if not force_refresh and self._token_is_fresh(TOKEN_HARD_MARGIN):
+                        logger.warning("⚠️ Early Uber token refresh failed; using current token until it expires")
+                        return self.access_token
+                    raise
+
+    def _request_new_token(self, key: str) -> str:
         try:
-            response = requests.post(
+            response = self.http.post(
                 self.auth_url,
                 headers={'Content-Type': 'application/x-www-form-urlencoded'},
                 data={
@@ -77,7 +199,8 @@ class UberDirectService:
                     'client_secret': self.client_secret,
                     'grant_type': 'client_credentials',
                     'scope': 'eats.deliveries'
-                }
+                },
+                timeout=self.timeout,
             )
             
             if response.status_code == 200:
@@ -85,6 +208,7 @@ class UberDirectService:
                 self.access_token = token_data['access_token']
                 expires_in = token_data.get('expires_in', 2592000)  # Default 30 days
                 self.token_expires_at = datetime.now() + timedelta(seconds=expires_in)
+                self.token_cache.store(key, self.access_token, self.token_expires_at)
                 
                 logger.info("Successfully obtained Uber Direct access token")
                 return self.access_token
@@ -96,24 +220,28 @@ class UberDirectService:
             logger.error(f"Error getting access token: {str(e)}")
             raise
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict:
+    def _make_request(self, method: str, endpoint: str, data: Dict = None, timeout=None) -> Dict:
         """Make authenticated request to Uber API"""
-        token = self._get_access_token()
-        
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        
         url = f"{self.base_url}{endpoint}"
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
         
         try:
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=headers)
-            elif method.upper() == 'POST':
-                response = requests.post(url, headers=headers, json=data)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+            token = self._get_access_token()
+            for attempt in range(2):
+                headers = {
+                    'Authorization': f'Bearer {token}',
+                    'Content-Type': 'application/json'
+                }
+                response = self.http.request(method, url, headers=headers, json=data,
+                                             timeout=timeout or self.timeout)
+                if response.status_code == 401 and attempt == 0:
+                    # Token revoked or rotated elsewhere: refresh once and retry
+                    logger.warning("Uber API returned 401 - refreshing access token")
+                    token = self._get_access_token(force_refresh=True)
+                    continue
+                break
                 
             if response.status_code in [200, 201]:
                 return response.json()
@@ -163,7 +291,7 @@ class UberDirectService:
                 data["dropoff_longitude"] = dropoff_coords['longitude']
         
         try:
-            quote = self._make_request('POST', endpoint, data)
+            quote = self._make_request('POST', endpoint, data, timeout=QUOTE_TIMEOUT)
             logger.info(f"Created quote: {quote.get('id')} - Fee: ${quote.get('fee', 0)/100:.2f}")
             return quote
         except Exception as e:
@@ -291,7 +419,12 @@ def init_uber_service(app):
     is_sandbox = app.config.get('UBER_SANDBOX', False)
     
     if client_id and client_secret and customer_id:
-        uber_service.configure(client_id, client_secret, customer_id, is_sandbox=is_sandbox)
+        uber_service.configure(
+            client_id, client_secret, customer_id, is_sandbox=is_sandbox,
+            token_cache_path=app.config.get('UBER_TOKEN_CACHE_PATH'),
+            timeout=(app.config.get('UBER_CONNECT_TIMEOUT', DEFAULT_TIMEOUT[0]),
+                     app.config.get('UBER_READ_TIMEOUT', DEFAULT_TIMEOUT[1])),
+        )
         logger.info(f"Uber Direct service configured successfully - Customer ID: {customer_id}")
         logger.info(f"Mode: {'SANDBOX' if is_sandbox else 'PRODUCTION'}")
         
@@ -442,13 +575,9 @@ def get_hybrid_delivery_quote(pickup_address: Dict, dropoff_address: Dict,
     # 1. Try Uber Direct first (regardless of distance)
     try:
         logger.info(f"📍 Distance: {straight_line_distance:.2f}mi - Attempting Uber Direct API...")
-        uber_service = UberDirectService()
-        uber_service.configure(
-            client_id=current_app.config.get('UBER_CLIENT_ID'),
-            client_secret=current_app.config.get('UBER_CLIENT_SECRET'),
-            customer_id=current_app.config.get('UBER_CUSTOMER_ID'),
-            is_sandbox=current_app.config.get('UBER_SANDBOX', True)
-        )
+        # Reuse the process-wide client so the cached token and pooled connection carry over
+        if not uber_service.is_configured:
+            init_uber_service(current_app)
         
         uber_quote = uber_service.create_quote_with_coordinates(
             pickup_address, dropoff_address,
@@ -485,7 +614,8 @@ def get_hybrid_delivery_quote(pickup_address: Dict, dropoff_address: Dict,
     dest_street = ' '.join(filter(None, dropoff_address.get('street_address', [])))
     dest_str = f"{dest_street}, {dropoff_address.get('city', '')}, {dropoff_address.get('state', '')} {dropoff_address.get('zip_code', '')}"
     
-    matrix = get_driving_distance_matrix(origin_str, dest_str)
+    matrix = get_driving_distance_matrix(origin_str, dest_str,
+                                         origin_coords=pickup_coords, destination_coords=dropoff_coords)
     
     if not matrix:
         logger.warning(f"❌ Google Maps Distance Matrix API failed. Using estimated distance based on straight-line ({straight_line_distance:.2f}mi)")
@@ -606,11 +736,32 @@ def calculate_manual_delivery_fee(distance_miles: float, duration_minutes: float
     # Round to 2 decimal places and convert to cents
     return int(round(final_fee_dollars, 2) * 100)
 
-def get_driving_distance_matrix(origin_address: str, destination_address: str) -> Optional[Dict[str, float]]:
+def get_driving_distance_matrix(origin_address: str, destination_address: str,
+                                origin_coords=None, destination_coords=None) -> Optional[Dict[str, float]]:
     """
     Get actual driving distance and duration using Google Maps Distance Matrix API
     Returns dict with 'distance' (miles) and 'duration' (minutes) or None if API call fails
+    
+    Results are cached across workers, keyed by rounded coordinates when both are
+    given and by the normalized addresses otherwise.
     """
+    from services.geo_cache import NAMESPACE_DISTANCE, cache_get, cache_set, coords_key, normalize_address
+    
+    if origin_coords and destination_coords:
+        cache_key = f"coords:{coords_key(origin_coords)}>{coords_key(destination_coords)}"
+    else:
+        cache_key = f"addr:{normalize_address(origin_address)}>{normalize_address(destination_address)}"
+    cached = cache_get(NAMESPACE_DISTANCE, cache_key)
+    if cached:
+        logger.info(f"⚡ Distance cache hit: {cached['distance']:.2f} miles, {cached['duration']:.1f} mins")
+        return cached
+    
+    matrix = _fetch_driving_distance_matrix(origin_address, destination_address)
+    if matrix:
+        cache_set(NAMESPACE_DISTANCE, cache_key, matrix)
+    return matrix
+
+def _fetch_driving_distance_matrix(origin_address: str, destination_address: str) -> Optional[Dict[str, float]]:
     try:
         from flask import current_app
         import requests
@@ -677,7 +828,23 @@ def geocode_address(address_dict: Dict) -> Optional[Tuple[float, float]]:
     """
     Geocode an address to get latitude and longitude using a free geocoding service
     Returns (latitude, longitude) tuple or None if geocoding fails
+    
+    Successful lookups are cached across workers by normalized address.
     """
+    from services.geo_cache import NAMESPACE_GEOCODE, address_key, cache_get, cache_set
+    
+    cache_key = address_key(address_dict)
+    cached = cache_get(NAMESPACE_GEOCODE, cache_key)
+    if cached:
+        logger.info(f"⚡ Geocode cache hit for '{cache_key}': ({cached[0]}, {cached[1]})")
+        return (cached[0], cached[1])
+    
+    coords = _fetch_geocode(address_dict)
+    if coords:
+        cache_set(NAMESPACE_GEOCODE, cache_key, list(coords))
+    return coords
+
+def _fetch_geocode(address_dict: Dict) -> Optional[Tuple[float, float]]:
     try:
         # Format address for geocoding
         address_parts = []